@@ -5,7 +5,7 @@ Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
 Description : Models of FastApi client
 """
 
-from typing import Dict, List
+from typing import Dict, List, Literal
 
 from pydantic import BaseModel, RootModel
 
@@ -18,6 +18,25 @@ class RequestHists(BaseModel):
     # TODO: datasets: list[str] | None = None  # List of filtered datasets, None is no filter and use all
     runs: list[int] | None = None  # List of runs for overlay, None means the most recent run without overlay
     max_era_run_size: int | None = None  # Max RUN size in each ERA. Default calue will come from conf
+    # Overlay of multiple runs: "server" returns THStack canvas JSON, "client" returns each run's histogram and its
+    # style, and the stack is built by JSROOT in the browser
+    overlay_mode: Literal["server", "client"] = "server"
+    # Histogram data format: "json" is TBufferJSON, "compact" is axes and bin arrays as base64 float32, see
+    # pyroot.util_hist_to_compact_json. Server side overlays(THStack canvas) are always "json"
+    hist_format: Literal["json", "compact"] = "json"
+
+
+class ResponseOverlayItem(BaseModel):
+    """A run's histogram in a client side overlay and its style, see utils.get_overlay_styles"""
+
+    run: int  # Run number
+    era: str  # Era of the run
+    legend: str  # Legend entry of the run: era-run
+    line_style: int  # ROOT line style
+    line_color: int  # ROOT line color
+    line_width: int  # ROOT line width
+    data: str | None = None  # Histogram JSON created using TBufferJSON
+    data_format: str = "json"  # Format of the data: json, compact
 
 
 class ResponsePlot(BaseModel):
@@ -25,12 +44,14 @@ class ResponsePlot(BaseModel):
 
     id: str  # hash of the histogram name with 'id' prefix
     data: str | None = None  # Histogram JSON created using TBufferJSON
+    data_format: str = "json"  # Format of the data: json(TBufferJSON) or compact(pyroot.util_hist_to_compact_json)
     dqm_url: str | None = None  # DQMGUI url
     draw_option: str | None = None  # Histogram JSROOT draw option
     hist_name: str | None = None  # Histogram name
     conf_name: str | None = None  # Histogram name in the plots.yaml config file (more descriptive)
     run: int | None = None  # Run number which helps to find ERA too
     type: str | None = None  # Histogram type: TH1F, TH2F, TProfile
+    overlay: List[ResponseOverlayItem] | None = None  # Runs' histograms of a client side overlay, "data" is empty then
 
 
 class ResponsePlotsDict(RootModel):
@@ -58,6 +79,7 @@ class ResponseGroup(BaseModel):
     dataset: str | None = None  # Detector group data root file's dataset name
     root_file: str | None = None  # Detector group root file full EOS path
     plots: List[ResponsePlot] | List = []  # Histogram data of the detector group
+    partial: bool = False  # True if a run of the group cannot be read, its plots miss that run
 
 
 class ResponseMain(BaseModel):
@@ -4,32 +4,245 @@
 Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
 Description : FastAPI main.py
 """
+
 import logging
-from typing import Union, List
+import zlib
+from typing import Iterator, Literal, Union, List
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
-from backend.client import pyroot, utils
+from backend import metrics
+from backend.client import histograms, profiling, utils
+from backend.client.cache import get_hist_cache, make_key
 from backend.config import get_config
-from .models import RequestHists
+from backend.dqm_meta.client import get_dqm_store, get_dqm_store_info
+from .models import RequestHists, ResponseGroup, ResponseMain
 
 # TODO: change prefix
 router = APIRouter()
-logging.basicConfig(level=get_config().loglevel.upper())
+
+
+def _is_not_modified(request: Request, response: Response, etag: str) -> bool:
+    """Sets ETag and Cache-Control headers and returns True if the client has the same version: If-None-Match
+
+    ETag is weak: GZipMiddleware sends the same body gzip compressed or not, and a strong ETag must differ between them.
+    If-None-Match is compared weakly as RFC 9110 requires.
+    """
+    response.headers["ETag"] = f'W/"{etag}"'
+    response.headers["Cache-Control"] = f"public, max-age={get_config().http_cache.max_age_secs}"
+    if_none_match = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+    return f'"{etag}"' in if_none_match or "*" in if_none_match
+
+
+def _not_modified_response(response: Response) -> Response:
+    return Response(status_code=304, headers={k: response.headers[k] for k in ("ETag", "Cache-Control")})
+
+
+def _set_not_cacheable(response: Response):
+    """Removes ETag of a partial response, i.e. a run cannot be read, so clients do not keep it and read it again"""
+    del response.headers["ETag"]
+    response.headers["Cache-Control"] = "no-store"
+
+
+def _get_hists_response(req: RequestHists, request: Request, response: Response):
+    """Returns histograms of the request or 304 if ROOT files and metadata are not changed since the client's ETag
+
+    If profiling is enabled and the request is an admin or a sampled one, it is profiled and the profile name is sent in
+    X-Profile header. Disabled profiling costs only the config check
+    """
+    if get_config().profiling.enabled:
+        trigger = profiling.get_trigger(request.headers.get("x-profile-token"))
+        if trigger:
+            description = f"{request.method} {request.url.path} {req.model_dump_json()}"
+            result, profile_name = profiling.profile_call(
+                trigger, description, _build_hists_response, req, request, response
+            )
+            result.headers["X-Profile"] = profile_name
+            return result
+    return _build_hists_response(req, request, response)
+
+
+def _build_hists_response(req: RequestHists, request: Request, response: Response) -> Response:
+    try:
+        groups_run_era_maps = histograms.get_groups_run_era_maps(
+            runs=req.runs, groups=req.groups, eras=req.eras, max_era_run_size=req.max_era_run_size
+        )
+        etag = histograms.get_histograms_etag(groups_run_era_maps, request_key=req.model_dump_json())
+        if _is_not_modified(request, response, etag):
+            return _not_modified_response(response)
+        result = histograms.get_histograms(
+            runs=req.runs,
+            groups=req.groups,
+            eras=req.eras,
+            max_era_run_size=req.max_era_run_size,
+            overlay_mode=req.overlay_mode,
+            hist_format=req.hist_format,
+            groups_run_era_maps=groups_run_era_maps,
+        )
+    except Exception as e:
+        logging.error(f"Cannot process request. Incoming request => {str(req)}. Error: {str(e)}")
+        raise HTTPException(status_code=404, detail=f"Error while processing request of [ run:{req.runs} ]")
+    if any(group.partial for group in result.groups_data):
+        _set_not_cacheable(response)
+    # Encoded here instead of FastAPI to time it, the output is same
+    with metrics.stage_timer("response_encode"):
+        content = result.model_dump_json()
+    return Response(
+        content=content,
+        media_type="application/json",
+        headers={k: v for k, v in response.headers.items() if k in ("etag", "cache-control")},
+    )
 
 
 @router.post("/get-hists")
-async def get_run_hists(req: Union[RequestHists, None]):
-    """Get ROOT histogram JSONs either overlaid or raw"""
+def get_run_hists(req: Union[RequestHists, None], request: Request, response: Response):
+    """Get ROOT histogram JSONs either overlaid or raw
+
+    It is not async: FastAPI runs it in its thread pool, so waiting ROOT workers does not block the event loop
+    """
     logging.info(f"Request:get-hists req: {str(req)}")
+    return _get_hists_response(req, request, response)
+
+
+@router.get("/get-hists")
+def get_run_hists_cacheable(
+    request: Request,
+    response: Response,
+    groups: List[str] = Query(None),
+    eras: List[str] = Query(None),
+    runs: List[int] = Query(None),
+    max_era_run_size: int = Query(None),
+    overlay_mode: Literal["server", "client"] = Query("server"),
+    hist_format: Literal["json", "compact"] = Query("json"),
+):
+    """GET variant of /get-hists with the same parameters as query parameters, so a reverse proxy can cache it"""
+    req = RequestHists(
+        groups=groups,
+        eras=eras,
+        runs=runs,
+        max_era_run_size=max_era_run_size,
+        overlay_mode=overlay_mode,
+        hist_format=hist_format,
+    )
+    logging.info(f"Request:get-hists req: {str(req)}")
+    return _get_hists_response(req, request, response)
+
+
+@router.get("/get-plot")
+def get_plot(
+    request: Request,
+    response: Response,
+    group: str,
+    conf_name: str,
+    eras: List[str] = Query(None),
+    runs: List[int] = Query(None),
+    max_era_run_size: int = Query(None),
+    overlay_mode: Literal["server", "client"] = Query("server"),
+    hist_format: Literal["json", "compact"] = Query("json"),
+):
+    """Get a single plot of a group, raw or overlaid, to load plots lazily as they scroll into view
+
+    Only that histogram is read from the ROOT files through the open file pool of the workers, and it has its own cache
+    entries. Plots are addressed by group name and plot conf_name of /get-plot-descriptors.
+    """
+    logging.info(f"Request:get-plot group:{group} conf_name:{conf_name} runs:{runs} eras:{eras}")
+    group_conf = histograms.get_single_plot_group_config(group_name=group, conf_name=conf_name)
+    if group_conf is None:
+        raise HTTPException(status_code=404, detail=f"Plot is not in the config: {group}/{conf_name}")
     try:
-        return pyroot.get_histograms(
-            runs=req.runs, groups=req.groups, eras=req.eras, max_era_run_size=req.max_era_run_size
+        [(_, run_era_map)] = histograms.get_groups_run_era_maps(
+            groups=[group], eras=eras, runs=runs, max_era_run_size=max_era_run_size
+        )
+        etag = histograms.get_histograms_etag(
+            [(group_conf, run_era_map)], request_key=make_key(str(request.query_params))
+        )
+        if _is_not_modified(request, response, etag):
+            return _not_modified_response(response)
+        group_result = histograms.get_group_histograms(
+            group_conf=group_conf, run_era_map=run_era_map, overlay_mode=overlay_mode, hist_format=hist_format
+        )
+    except Exception as e:
+        logging.error(f"Cannot get plot {group}/{conf_name} of runs:{runs} eras:{eras}. Error: {str(e)}")
+        raise HTTPException(status_code=404, detail=f"Error while processing request of [ plot:{conf_name} ]")
+    if group_result.partial:
+        _set_not_cacheable(response)
+    if not group_result.plots:
+        raise HTTPException(status_code=404, detail=f"Plot is not found: {group}/{conf_name}")
+    return group_result.plots[0]
+
+
+@router.get("/get-plot-descriptors")
+def get_plot_descriptors(
+    groups: List[str] = Query(None),
+    eras: List[str] = Query(None),
+    runs: List[int] = Query(None),
+    max_era_run_size: int = Query(None),
+):
+    """Get plots of the groups without data, same filters with /get-hists, so the page layout renders immediately"""
+    logging.info(f"Request:get-plot-descriptors groups:{groups} runs:{runs} eras:{eras}")
+    try:
+        groups_run_era_maps = histograms.get_groups_run_era_maps(
+            groups=groups, eras=eras, runs=runs, max_era_run_size=max_era_run_size
+        )
+        return ResponseMain(
+            runs=runs, eras=eras, groups=groups, groups_data=histograms.get_plot_descriptors(groups_run_era_maps)
+        )
+    except Exception as e:
+        logging.error(f"Cannot get plot descriptors. Error: {str(e)}")
+        raise HTTPException(status_code=404, detail=f"Error while processing request of /get-plot-descriptors")
+
+
+def _gzip_lines(lines: Iterator[bytes]) -> Iterator[bytes]:
+    """Gzip compresses the stream and flushes the compressor after each line, so a line is not held in its buffer"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip header
+    for line in lines:
+        yield compressor.compress(line) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+@router.post("/get-hists-stream")
+def get_run_hists_stream(req: Union[RequestHists, None], request: Request):
+    """Streaming variant of /get-hists: NDJSON, each line is a ResponseGroup sent as soon as the group is ready
+
+    Groups come in the order they are ready, not in the config order. Response is gzip compressed with a flush after
+    each group if the client accepts it; GZipMiddleware does not flush, so it is not used for this response.
+    """
+    logging.info(f"Request:get-hists-stream req: {str(req)}")
+    try:
+        groups_iter = histograms.iter_histograms(
+            runs=req.runs,
+            groups=req.groups,
+            eras=req.eras,
+            max_era_run_size=req.max_era_run_size,
+            overlay_mode=req.overlay_mode,
+            hist_format=req.hist_format,
         )
+        # Reads of all groups are submitted before the response starts, so request errors are not streamed
+        first_group = next(groups_iter, None)
     except Exception as e:
         logging.error(f"Cannot process request. Incoming request => {str(req)}. Error: {str(e)}")
         raise HTTPException(status_code=404, detail=f"Error while processing request of [ run:{req.runs} ]")
 
+    def encode(group: ResponseGroup) -> bytes:
+        with metrics.stage_timer("response_encode", group=group.group_name):
+            return group.model_dump_json().encode() + b"\n"
+
+    def lines() -> Iterator[bytes]:
+        if first_group is None:
+            return
+        yield encode(first_group)
+        for group in groups_iter:
+            yield encode(group)
+
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return StreamingResponse(
+            _gzip_lines(lines()),
+            media_type="application/x-ndjson",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+        )
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 
 @router.get("/get-groups")
 async def get_groups():
@@ -45,10 +258,14 @@ async def get_groups():
 
 
 @router.get("/get-eras")
-async def get_eras(groups: List[str] = Query(None)):
+async def get_eras(request: Request, response: Response, groups: List[str] = Query(None)):
     """Get all available eras filtered by groups"""
     logging.info(f"Request:get-eras, param [groups] : {groups}")
     try:
+        conf = get_config()
+        etag = make_key("eras", groups, get_dqm_store(conf).version, conf.get_group_name_eos_directory_map())
+        if _is_not_modified(request, response, etag):
+            return _not_modified_response(response)
         eras = utils.get_available_eras(group_names=groups)
         logging.debug(f"Eras  + {str(eras)}")
         return eras
@@ -58,13 +275,45 @@ async def get_eras(groups: List[str] = Query(None)):
 
 
 @router.get("/get-runs")
-async def get_runs(limit: int = Query(None), groups: List[str] = Query(None), eras: List[str] = Query(None)):
+async def get_runs(
+    request: Request,
+    response: Response,
+    limit: int = Query(None),
+    groups: List[str] = Query(None),
+    eras: List[str] = Query(None),
+):
     """Get all available eras filtered by groups and eras"""
     logging.info(f"Request:get-runs, param [eras] : {eras}")
     try:
+        conf = get_config()
+        etag = make_key(
+            "runs", limit, groups, eras, get_dqm_store(conf).version, conf.get_group_name_eos_directory_map()
+        )
+        if _is_not_modified(request, response, etag):
+            return _not_modified_response(response)
         eras = utils.get_available_runs(limit=limit, groups=groups, eras=eras)
         logging.debug(f"Eras  + {str(eras)}")
         return eras
     except Exception as e:
         logging.error(f"Cannot get eras Error: {str(e)}")
         raise HTTPException(status_code=404, detail=f"Error while processing request of /get-eras ]")
+
+
+@router.get("/get-store-info")
+async def get_store_info():
+    """Get version and age of the loaded DQM Metadata Store"""
+    logging.info("Request:get-store-info")
+    store_info = get_dqm_store_info()
+    if store_info is None:
+        raise HTTPException(status_code=503, detail="DQM Metadata Store is not loaded yet")
+    return store_info
+
+
+@router.get("/get-cache-stats")
+async def get_cache_stats():
+    """Get hit/miss counters and size of the persistent histogram cache"""
+    logging.info("Request:get-cache-stats")
+    cache = get_hist_cache()
+    if cache is None:
+        raise HTTPException(status_code=404, detail="Histogram cache is disabled")
+    return cache.stats()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Micro benchmarks of the metadata, ROOT reading, overlay and response serialization hot paths
+How         :
+- Metadata: synthetic ROOT file names(default 100k) are parsed with eos_grinder.get_formatted_meta_from_raw_input,
+  then DqmMetaStore queries and snapshot write/read are timed on the result.
+- ROOT: synthetic ROOT files are created once in the data directory, then the readers' group reads of one run, THStack
+  overlay of a group's era and /get-hists response serialization are timed. Each read is a different run, so each
+  one opens its file, like a request of a new run.
+- Results are written as JSON: environment, parameters and {benchmark name: seconds stats}. `--compare` prints the
+  ratios against a previous result and exits with 1 if any median is slower than the threshold.
+- Usage: python -m backend.benchmarks.run [--meta-files 100000] [--compare old.json]
+"""
+
+import json
+import logging
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import click
+
+from backend.api_v1.models import ResponseGroup, ResponseMain
+from backend.client import pyroot, uproot_reader
+from backend.config import get_config, get_config_group_directories
+from backend.dqm_meta.eos_grinder import get_formatted_meta_from_raw_input, get_group_metas
+from backend.dqm_meta.snapshot import read_snapshot, write_snapshot
+from .synthetic import create_synthetic_root_files, get_synthetic_root_file_names
+
+RESULTS_FORMAT_VERSION = 1
+READERS = {"pyroot": pyroot, "uproot": uproot_reader}
+
+
+def timeit(func: Callable, repeat: int, setup: Callable = None) -> Dict[str, float]:
+    """Returns seconds stats of repeated calls, setup is called before each call and is not timed
+
+    setup's result is given to func if it is not None
+    """
+    times = []
+    for i in range(repeat):
+        arg = setup(i) if setup else None
+        start_time = time.perf_counter()
+        func(arg) if setup else func()
+        times.append(time.perf_counter() - start_time)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "max": max(times),
+        "repeat": repeat,
+    }
+
+
+def bench_metadata(results: Dict, years: List[int], eras_per_year: int, file_count: int, repeat: int, work_dir: str):
+    """Metadata parsing, DqmMetaStore queries and snapshot benchmarks"""
+    conf = get_config()
+    allowed_group_directories = get_config_group_directories()
+    file_names = get_synthetic_root_file_names(
+        base_dir=conf.dqm_meta_store.base_dqm_eos_dir,
+        group_confs=conf.plots.groups,
+        years=years,
+        eras_per_year=eras_per_year,
+        file_count=file_count,
+    )
+    input_file = os.path.join(work_dir, "raw_root_files.txt")
+    with open(input_file, "w") as f:
+        f.write("\n".join(file_names) + "\n")
+
+    results["meta.parse_raw_input"] = timeit(
+        lambda: get_formatted_meta_from_raw_input(input_file, allowed_group_directories), repeat
+    )
+    store = get_formatted_meta_from_raw_input(input_file, allowed_group_directories)
+    results["meta.parse_raw_input"]["files"] = len(store)
+
+    snapshot_file = os.path.join(work_dir, "DQM_META.snapshot")
+    results["store.snapshot_write"] = timeit(lambda: write_snapshot(store, snapshot_file), repeat)
+    results["store.snapshot_read"] = timeit(lambda: read_snapshot(snapshot_file), repeat)
+    store = read_snapshot(snapshot_file)  # Queries run on the memory mapped store like the API
+
+    max_era_run_size = conf.plots.max_era_run_size
+    group_dirs = [g.eos_directory for g in conf.plots.groups]
+    last_era, latest_runs = store.eras[-1], sorted(set(store.runs.tolist()))[-max_era_run_size:]
+    queries = {
+        "store.groups_and_runs_of_eras.all": lambda: store.get_groups_and_runs_of_eras(run_limit=max_era_run_size),
+        "store.groups_and_runs_of_eras.era": lambda: store.get_groups_and_runs_of_eras(
+            eras=[last_era], groups_eos_dirs=group_dirs[:1], run_limit=max_era_run_size
+        ),
+        "store.groups_and_runs_of_eras.runs": lambda: store.get_groups_and_runs_of_eras(runs=latest_runs),
+        "store.runs_era_tuples": lambda: store.get_runs_era_tuples(limit=1000),
+        "store.eras_filtered": lambda: store.get_eras_filtered(),
+        "store.meta_by_group_and_run": lambda: [
+            store.get_meta_by_group_and_run(group_directory=d, run_num=r) for d in group_dirs for r in latest_runs
+        ],
+        "store.new_group_runs": lambda: store.get_new_group_runs(store),
+    }
+    for name, query in queries.items():
+        results[name] = timeit(query, repeat)
+    results["store.meta_by_group_and_run"]["lookups"] = len(group_dirs) * len(latest_runs)
+
+
+def bench_root(results: Dict, data_dir: str, years: List[int], runs_per_era: int, readers: List[str]):
+    """ROOT reading, overlay and response serialization benchmarks of the first group"""
+    conf = get_config()
+    group_conf = conf.plots.groups[0]
+    root_files = create_synthetic_root_files(
+        base_dir=data_dir, group_confs=[group_conf], years=years, eras_per_year=1, runs_per_era=runs_per_era
+    )
+    dqm_metas = sorted(get_group_metas(root_files, [group_conf.eos_directory]), key=lambda m: m.run)
+    repeat = len(dqm_metas)
+
+    for reader in readers:
+        module = READERS[reader]
+        for hist_format in ("json", "compact"):
+            results[f"root.read_group_plots.{reader}.{hist_format}"] = timeit(
+                lambda m: module.util_read_group_plots_of_one_run_from_root_file(group_conf, m, hist_format),
+                repeat,
+                setup=lambda i: dqm_metas[i],
+            )
+            module.get_file_pool().close_all()
+
+    results["root.read_group_hists.pyroot"] = timeit(
+        lambda m: pyroot.util_read_group_hists_of_one_run_from_root_file(group_conf, m),
+        repeat,
+        setup=lambda i: dqm_metas[i],
+    )
+    overlay_metas = dqm_metas[-conf.plots.max_era_run_size :]
+    runs_hists = [(m, pyroot.util_read_group_hists_of_one_run_from_root_file(group_conf, m)) for m in overlay_metas]
+    run_era_map = {m.run: m.era for m in overlay_metas}
+    results["overlay.thstack_group"] = timeit(
+        lambda: pyroot.util_overlay_group_hists(group_conf, runs_hists, run_era_map), repeat=5
+    )
+    results["overlay.thstack_group"]["runs"] = len(runs_hists)
+
+    # /get-hists response of the latest run, FastAPI serializes it with pydantic
+    for hist_format in ("json", "compact"):
+        plots = pyroot.util_read_group_plots_of_one_run_from_root_file(group_conf, dqm_metas[-1], hist_format)
+        response = ResponseMain(
+            groups_data=[ResponseGroup(group_name=group_conf.group_name, plots=plots.get_plots_only())]
+        )
+        results[f"response.serialize.{hist_format}"] = timeit(lambda: response.model_dump_json(), repeat=20)
+        results[f"response.serialize.{hist_format}"]["bytes"] = len(response.model_dump_json())
+    pyroot.get_file_pool().close_all()
+
+
+def compare_results(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Prints median ratios of the common benchmarks and returns names of the ones which are slower than threshold"""
+    regressions = []
+    print(f"{'benchmark':<45} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for name, stats in current["results"].items():
+        base_stats = baseline["results"].get(name)
+        if base_stats is None:
+            continue
+        ratio = stats["median"] / base_stats["median"] if base_stats["median"] else math.inf
+        flag = " <-- slower" if ratio > threshold else ""
+        print(f"{name:<45} {base_stats['median'] * 1e3:>10.3f}ms {stats['median'] * 1e3:>10.3f}ms {ratio:>8.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def get_environment() -> Dict[str, str]:
+    import ROOT
+    import uproot
+
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "root": ROOT.gROOT.GetVersion(),
+        "uproot": uproot.__version__,
+    }
+
+
+@click.command()
+@click.option("--meta-files", default=100000, show_default=True, help="Number of synthetic ROOT file names")
+@click.option("--years", default=3, show_default=True, help="Number of synthetic Run years")
+@click.option("--eras-per-year", default=6, show_default=True, help="Number of eras in each year")
+@click.option("--root-runs", default=30, show_default=True, help="Number of ROOT files created and read")
+@click.option("--readers", default="pyroot,uproot", show_default=True, help="Comma separated readers to benchmark")
+@click.option("--repeat", default=5, show_default=True, help="Repeat count of metadata benchmarks")
+@click.option("--data-dir", default="backend/benchmarks/DQMGUI_data", show_default=True, help="Synthetic ROOT files")
+@click.option("--output", default=None, help="Results JSON file, default: backend/benchmarks/results/<time>.json")
+@click.option("--compare", "compare_file", default=None, help="Previous results JSON file to compare")
+@click.option("--threshold", default=1.2, show_default=True, help="Median ratio which is reported as regression")
+def main(meta_files, years, eras_per_year, root_runs, readers, repeat, data_dir, output, compare_file, threshold):
+    """Benchmarks CLI: python -m backend.benchmarks.run"""
+    # Per histogram debug logs of the readers would be timed too
+    logging.getLogger().setLevel(logging.WARNING)
+    first_year = datetime.now().year - years + 1
+    run_years = list(range(first_year, first_year + years))
+    params = {
+        "meta_files": meta_files,
+        "years": run_years,
+        "eras_per_year": eras_per_year,
+        "root_runs": root_runs,
+        "readers": readers.split(","),
+        "repeat": repeat,
+    }
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        bench_metadata(results, run_years, eras_per_year, meta_files, repeat, work_dir)
+    bench_root(results, data_dir, run_years[-1:], root_runs, params["readers"])
+
+    current = {
+        "format_version": RESULTS_FORMAT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": get_environment(),
+        "params": params,
+        "results": results,
+    }
+    output = output or f"backend/benchmarks/results/{datetime.now():%Y%m%d-%H%M%S}.json"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"Results are written to {output}")
+
+    if compare_file:
+        with open(compare_file) as f:
+            regressions = compare_results(current, json.load(f), threshold)
+        if regressions:
+            print(f"Slower than {threshold}x: {regressions}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
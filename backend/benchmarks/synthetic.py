@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Synthetic DQMGUI_data generator of the benchmarks
+How         :
+- Layout is same with DQMGUI EOS and the test data: base/RunYYYY/GROUP_DIR/0001234xx/DQM_V0001_R000123456__...root
+- ROOT file names are generated without touching the disk to benchmark metadata parsing and DQM Metadata Store
+  queries at realistic sizes, i.e. 100k files across several years and groups.
+- ROOT files are created only for the runs which are read, with create_root_file_hists. Their histograms are TH1F,
+  TH2F and TProfile as the plots config types. Test data of backend/tests is created with it too.
+- Each era starts from a new run block directory(0001234xx) after the previous era's runs, so runs of eras and years
+  never overlap whatever runs_per_era is.
+"""
+
+import math
+import pathlib
+from typing import List
+
+import numpy as np
+from ROOT import TFile, TH1F, TH2F, TProfile
+
+from backend.config import ConfigPlotsGroup
+
+ROOT_FILE_FMT = "DQM_V0001_R{run9d}__{eosdir}__{era}-SYNTHETIC-DATASET__DQMIO.root"
+ERA_LETTERS = "ABCDEFGH"
+FIRST_RUN = 100000
+RUN_BLOCK_SIZE = 100  # Runs of a run block directory, i.e. 0001234xx
+
+
+def get_root_file_path(base_dir: str, year: int, eos_directory: str, era: str, run: int) -> str:
+    """Returns DQMGUI EOS path of the ROOT file of a group's run"""
+    run_xx_dir = f"{run // 100}xx".zfill(9)
+    file_name = ROOT_FILE_FMT.format(run9d=str(run).zfill(9), eosdir=eos_directory, era=era)
+    return str(pathlib.Path(base_dir) / f"Run{year}" / eos_directory / run_xx_dir / file_name)
+
+
+def get_synthetic_runs(years: List[int], eras_per_year: int, runs_per_era: int) -> List[tuple]:
+    """Returns [(year, era, run)] of all synthetic runs, runs are increasing with the year and era"""
+    era_run_jump = math.ceil(runs_per_era / RUN_BLOCK_SIZE) * RUN_BLOCK_SIZE
+    result = []
+    first_run = FIRST_RUN
+    for year in years:
+        for letter in ERA_LETTERS[:eras_per_year]:
+            result.extend((year, f"Run{year}{letter}", run) for run in range(first_run, first_run + runs_per_era))
+            first_run += era_run_jump
+    return result
+
+
+def get_synthetic_root_file_names(
+    base_dir: str, group_confs: List[ConfigPlotsGroup], years: List[int], eras_per_year: int, file_count: int
+) -> List[str]:
+    """Returns about file_count ROOT file paths, they are distributed evenly to the groups, years and eras"""
+    runs_per_era = math.ceil(file_count / (len(group_confs) * len(years) * eras_per_year))
+    runs = get_synthetic_runs(years=years, eras_per_year=eras_per_year, runs_per_era=runs_per_era)
+    return [
+        get_root_file_path(base_dir, year, group_conf.eos_directory, era, run)
+        for group_conf in group_confs
+        for year, era, run in runs
+    ]
+
+
+def create_synthetic_root_files(
+    base_dir: str, group_confs: List[ConfigPlotsGroup], years: List[int], eras_per_year: int, runs_per_era: int
+) -> List[str]:
+    """Creates ROOT files of all groups' plots for each run and returns their paths, existing files are kept"""
+    created_files = []
+    for group_conf in group_confs:
+        for year, era, run in get_synthetic_runs(years=years, eras_per_year=eras_per_year, runs_per_era=runs_per_era):
+            root_file = pathlib.Path(get_root_file_path(base_dir, year, group_conf.eos_directory, era, run))
+            if not root_file.exists():
+                root_file.parent.mkdir(parents=True, exist_ok=True)
+                create_root_file_hists(root_file=str(root_file), group_conf=group_conf, run=run, use_plot_types=True)
+            created_files.append(str(root_file))
+    return created_files
+
+
+def create_root_file_hists(root_file: str, group_conf: ConfigPlotsGroup, run: int, use_plot_types: bool = False):
+    """Creates the histograms of a group's plots for a run in the ROOT file, with the definitions in plots.yaml config
+
+    Histograms are TH1F, unless use_plot_types is True which creates TH1F, TH2F or TProfile as the plot's config type.
+    Tests use TH1F, benchmarks use the plot types for realistic content. See backend/tests/conftest.py
+    """
+    tdirectory = group_conf.tdirectory.format(run_num_int=run)
+
+    with TFile(root_file, "RECREATE") as tf:
+        for plot_conf in group_conf.plots:
+            dir_str, name = (tdirectory + "/" + plot_conf.name).rsplit("/", 1)
+            # Creates all parent directories, or returns the existing directory
+            tdir = tf.mkdir(dir_str, "", True)
+            hist_type = plot_conf.type if use_plot_types else "TH1F"
+            if hist_type == "TH2F":
+                h = TH2F(name, name, 64, -4, 4, 64, -4, 4)
+                h.FillRandom("xygaus", 20000)
+            elif hist_type == "TProfile":
+                h = TProfile(name, name, 64, -4, 4)
+                x = np.random.normal(size=5000)  # TProfile cannot FillRandom
+                h.FillN(len(x), x, x * x + np.random.normal(size=len(x)), np.ones(len(x)))
+            else:
+                h = TH1F(name, name, 64, -4, 4)
+                h.FillRandom("gaus")
+            tdir.WriteObject(h, name)
+            del h
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Persistent histogram JSON cache
+How         :
+- Group plots JSON of one run is stored in a local SQLite file, so the cache survives pod restarts and deploys.
+- Key is made of ROOT file path, its size and mtime, object paths and a hash of the plots config. If the ROOT file is
+  rewritten or the plots config is changed, key changes and the old entry is evicted by LRU eventually.
+- Cache is bounded by the total bytes of values, least recently used entries are evicted first.
+- Backends are pluggable and shared by all processes which use the same store:
+    - sqlite: SQLite file on a local volume, shared by all uvicorn workers of a pod
+    - resp  : Redis protocol server, shared by all pods
+"""
+
+import abc
+import contextlib
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from pydantic import BaseModel
+
+from backend.config import get_config
+
+__HIST_CACHE = None  # CacheBackend singleton
+__HIST_CACHE_LOCK = threading.Lock()
+
+# Last access times of SQLite cache hits are written in batches: with the next put, or when there are this many of
+# them or the oldest one is this old. So a hit does not need a write transaction
+ACCESS_FLUSH_SIZE = 512
+ACCESS_FLUSH_SECS = 10
+
+
+class CacheStats(BaseModel):
+    """Cache hit/miss counters and its size"""
+
+    backend: str  # Cache backend name: sqlite, resp
+    hits: int  # Number of gets which found the key since the process start
+    misses: int  # Number of gets which did not find the key since the process start
+    entries: int  # Number of entries in the cache, shared by all processes using the same cache
+    size_bytes: int | None = None  # Total bytes of the values in the cache, None if backend does not track it
+    max_bytes: int | None = None  # Size limit of the cache, LRU entries are evicted above it
+
+
+def make_key(*parts) -> str:
+    """Returns sha1 hex digest of the joined parts"""
+    return hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()
+
+
+class CacheBackend(abc.ABC):
+    """Interface of the cache backends: a key-value store of bytes shared by all processes which use it
+
+    Hit/miss counters are of the current process, they are counted by the dispatch threads concurrently.
+    """
+
+    name = ""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._count_lock = threading.Lock()
+
+    @abc.abstractmethod
+    def get(self, key: str) -> bytes | None:
+        """Returns the value of the key, None if it does not exist"""
+
+    @abc.abstractmethod
+    def put(self, key: str, value: bytes):
+        """Stores the value of the key"""
+
+    @abc.abstractmethod
+    def stats(self) -> CacheStats:
+        """Returns hit/miss counters of this process and the size of the cache"""
+
+    def close(self):
+        pass
+
+    def _count(self, value: bytes | None) -> bytes | None:
+        with self._count_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+
+class SqliteCache(CacheBackend):
+    """Byte bounded LRU key-value cache in a SQLite file, shared by all processes of a pod which use the same file
+
+    Total size is kept in the database and updated in the same transaction with the entries, so concurrent writer
+    processes see the same size and evict consistently. Last access times of hits are written in batches, so LRU order
+    is approximate between processes. SQLite errors, i.e. "database is locked", are logged: a failed get is a miss and
+    a failed put is skipped, like RespCache.
+
+    Args:
+        file_path: SQLite file, it is created if it does not exist
+        max_bytes: Size limit of the values, LRU entries are evicted above it
+    """
+
+    name = "sqlite"
+
+    def __init__(self, file_path: str, max_bytes: int):
+        super().__init__()
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._accessed = {}  # {key: last access time} of the hits which are not written yet
+        self._access_flush_time = time.time()
+        if os.path.dirname(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self._conn = sqlite3.connect(file_path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_size "
+                "(id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL, size INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO cache_size SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM cache"
+            )
+        # Warm start: entries of the previous process are kept
+        stats = self.stats()
+        logging.info(f"Histogram cache {file_path} is opened with {stats.entries} entries, {stats.size_bytes} bytes")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Write transaction which locks the database against other processes"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def get(self, key: str) -> bytes | None:
+        """Returns the value of the key and marks it as recently used, None if it does not exist or cannot be read"""
+        with self._lock:
+            try:
+                row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"Histogram cache get failed: {str(e)}")
+                row = None
+            if row is not None:
+                self._accessed[key] = time.time()
+                is_flush_due = time.time() - self._access_flush_time > ACCESS_FLUSH_SECS
+                if is_flush_due or len(self._accessed) >= ACCESS_FLUSH_SIZE:
+                    self._flush_access_times()
+            return self._count(row[0] if row else None)
+
+    def _flush_access_times(self):
+        """Writes the batched last access times in their own transaction, errors are logged"""
+        try:
+            with self._transaction():
+                self._write_access_times()
+        except sqlite3.Error as e:
+            logging.warning(f"Histogram cache access times cannot be written: {str(e)}")
+
+    def _write_access_times(self):
+        """Writes the batched last access times of the hits, runs in a write transaction. They are dropped on error"""
+        accessed, self._accessed = self._accessed, {}
+        self._access_flush_time = time.time()
+        self._conn.executemany(
+            "UPDATE cache SET last_access = ? WHERE key = ?", [(t, key) for key, t in accessed.items()]
+        )
+
+    def put(self, key: str, value: bytes):
+        """Stores the value and evicts LRU entries if the cache exceeds max_bytes, it is skipped on SQLite errors"""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            try:
+                with self._transaction():
+                    self._put(key, value)
+            except sqlite3.Error as e:
+                logging.warning(f"Histogram cache put failed: {str(e)}")
+
+    def _put(self, key: str, value: bytes):
+        """Stores the value and evicts LRU entries, runs in a write transaction"""
+        self._write_access_times()  # So eviction sees the recent hits
+        old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, value, len(value), time.time()),
+        )
+        self._conn.execute(
+            "UPDATE cache_size SET entries = entries + ?, size = size + ?",
+            (0 if old else 1, len(value) - (old[0] if old else 0)),
+        )
+        size = self._conn.execute("SELECT size FROM cache_size").fetchone()[0]
+        if size > self.max_bytes:
+            self._evict(size)
+
+    def _evict(self, size: int):
+        """Deletes least recently used entries until the size is below max_bytes, runs in the put transaction"""
+        evicted = []
+        for key, entry_size in self._conn.execute("SELECT key, size FROM cache ORDER BY last_access"):
+            if size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            size -= entry_size
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", evicted)
+        self._conn.execute("UPDATE cache_size SET entries = entries - ?, size = ?", (len(evicted), size))
+        logging.debug(f"Histogram cache evicted {len(evicted)} entries")
+
+    def stats(self) -> CacheStats:
+        """Returns the counters and the size of the cache, counters without size if it cannot be read"""
+        with self._lock:
+            try:
+                entries, size = self._conn.execute("SELECT entries, size FROM cache_size").fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"Histogram cache stats failed: {str(e)}")
+                entries, size = 0, None
+        return CacheStats(
+            backend=self.name,
+            hits=self.hits,
+            misses=self.misses,
+            entries=entries,
+            size_bytes=size,
+            max_bytes=self.max_bytes,
+        )
+
+    def close(self):
+        with self._lock:
+            if self._accessed:
+                self._flush_access_times()
+            self._conn.close()
+
+
+class RespError(Exception):
+    """Raised when the RESP server returns an error reply"""
+
+
+class RespCache(CacheBackend):
+    """Key-value cache in a server which speaks Redis protocol(RESP), shared by all pods
+
+    Minimal RESP client which uses only GET, SET and DBSIZE commands. Eviction is done by the server, so it should be
+    configured with a maxmemory and an LRU policy, i.e. `maxmemory-policy allkeys-lru`. Each thread has its own
+    connection. Connection errors are logged and counted as misses, so the requests fall back to ROOT file reads.
+
+    Args:
+        url: Server url, redis://[:password@]host:port[/db]
+        ttl_secs: Expiry of the entries, 0 means no expiry
+        key_prefix: Prefix of the keys to share the server with others
+        socket_timeout_secs: Connect and read timeout
+    """
+
+    name = "resp"
+
+    def __init__(self, url: str, ttl_secs: int = 0, key_prefix: str = "ppd:hist:", socket_timeout_secs: float = 1):
+        super().__init__()
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.strip("/") or 0)
+        self.ttl_secs = ttl_secs
+        self.key_prefix = key_prefix
+        self.socket_timeout_secs = socket_timeout_secs
+        self._local = threading.local()
+        self._sockets = []  # (socket, its file object) of all threads to close them
+        self._sockets_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.socket_timeout_secs)
+        self._local.sock, self._local.reader = sock, sock.makefile("rb")
+        with self._sockets_lock:
+            self._sockets.append((sock, self._local.reader))
+        if self.password:
+            self._send_command("AUTH", self.password)
+        if self.db:
+            self._send_command("SELECT", self.db)
+
+    def _disconnect(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            with self._sockets_lock:
+                if (sock, self._local.reader) in self._sockets:
+                    self._sockets.remove((sock, self._local.reader))
+            self._local.reader.close()
+            sock.close()
+        self._local.sock = self._local.reader = None
+
+    def _send_command(self, *args):
+        """Sends the command as RESP array of bulk strings and returns its reply"""
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts += [b"$%d\r\n" % len(arg), arg, b"\r\n"]
+        self._local.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("RESP connection is closed")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RespError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            return None if length < 0 else self._local.reader.read(length + 2)[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RespError(f"Unknown RESP reply: {line!r}")
+
+    def command(self, *args):
+        """Runs the command in this thread's connection, reconnects once if the connection is broken"""
+        for attempt in range(2):
+            try:
+                if getattr(self._local, "sock", None) is None:
+                    self._connect()
+                return self._send_command(*args)
+            except (OSError, ConnectionError):
+                self._disconnect()
+                if attempt:
+                    raise
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            value = self.command("GET", self.key_prefix + key)
+        except (OSError, ConnectionError, RespError) as e:
+            logging.warning(f"Histogram cache GET failed: {str(e)}")
+            value = None
+        return self._count(value)
+
+    def put(self, key: str, value: bytes):
+        args = ["SET", self.key_prefix + key, value] + (["EX", self.ttl_secs] if self.ttl_secs else [])
+        try:
+            self.command(*args)
+        except (OSError, ConnectionError, RespError) as e:
+            logging.warning(f"Histogram cache SET failed: {str(e)}")
+
+    def stats(self) -> CacheStats:
+        try:
+            entries = self.command("DBSIZE")
+        except (OSError, ConnectionError, RespError):
+            entries = 0
+        return CacheStats(backend=self.name, hits=self.hits, misses=self.misses, entries=entries)
+
+    def close(self):
+        with self._sockets_lock:
+            for sock, reader in self._sockets:
+                reader.close()  # Socket is closed after its file object is closed
+                sock.close()
+            self._sockets.clear()
+
+
+def get_hist_cache() -> CacheBackend | None:
+    """Returns the histogram cache singleton of the configured backend, None if it is disabled in the config"""
+    global __HIST_CACHE
+    conf = get_config().hist_cache
+    if not conf.enabled:
+        return None
+    with __HIST_CACHE_LOCK:
+        if __HIST_CACHE is None:
+            if conf.backend == "sqlite":
+                __HIST_CACHE = SqliteCache(file_path=conf.file, max_bytes=conf.max_bytes)
+            elif conf.backend == "resp":
+                __HIST_CACHE = RespCache(url=conf.resp_url, ttl_secs=conf.resp_ttl_secs)
+            else:
+                raise ValueError(f"Unknown histogram cache backend: {conf.backend}")
+        return __HIST_CACHE
+
+
+def close_hist_cache():
+    """Closes the histogram cache singleton"""
+    global __HIST_CACHE
+    with __HIST_CACHE_LOCK:
+        if __HIST_CACHE is not None:
+            __HIST_CACHE.close()
+            __HIST_CACHE = None
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Coalescing of concurrent ROOT reads and overlays
+How         :
+- When a new run lands, many shifters load the same page at once and their requests miss the histogram cache at the
+  same moment. SingleFlight starts one call per key: the first caller starts it, concurrent callers of the same key get
+  its future. Keys are the histogram cache keys, see histograms.py
+- ReadBatcher merges different reads of the same ROOT file, i.e. lazy loaded single plots of a page. The first read
+  of a batch key starts a timer of a short window, reads which arrive in it join the batch, then one task reads all of
+  them.
+- Nothing waits in a thread: callers get futures and chain their work with `add_done_callback` or `then`, so the
+  dispatch threads are not held by coalesced calls.
+- Coalesced calls are counted in ppd_coalesced_total metric.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List
+
+from backend import metrics
+
+
+def chain(source: Future, target: Future):
+    """Completes target with the result or exception of source when source is done"""
+
+    def on_done(_):
+        try:
+            result = source.result()
+        except BaseException as e:
+            target.set_exception(e)
+            return
+        target.set_result(result)
+
+    source.add_done_callback(on_done)
+
+
+def then(future: Future, func: Callable[[Any], Any]) -> Future:
+    """Returns the future of func(result of future), exceptions of future and func are set in it
+
+    func runs in the thread which completes future, or in the caller if it is already done, so it should be quick.
+    """
+    result_future = Future()
+
+    def on_done(_):
+        try:
+            result = func(future.result())
+        except BaseException as e:
+            result_future.set_exception(e)
+            return
+        result_future.set_result(result)
+
+    future.add_done_callback(on_done)
+    return result_future
+
+
+class SingleFlight:
+    """Runs one call per key at a time, concurrent callers of the same key get the future of the running call
+
+    A call which starts after the running one is done runs again, results are not kept.
+
+    Args:
+        kind: Label of the coalesced calls in ppd_coalesced_total metric
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, start: Callable[[], Future]) -> Future:
+        """Returns the future of the running call of the key, or starts a call with start() and returns its future
+
+        start should not block, i.e. it submits the call to an executor. Exceptions are set in the future of all
+        callers.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            is_first = future is None
+            if is_first:
+                future = self._calls[key] = Future()
+        if not is_first:
+            metrics.inc("ppd_coalesced_total", kind=self.kind)
+            return future
+
+        try:
+            call_future = start()
+        except BaseException as e:
+            self._done(key)
+            future.set_exception(e)
+            return future
+        # Callbacks run in the order they are added, so the key is released before the callers' callbacks run
+        call_future.add_done_callback(lambda _: self._done(key))
+        chain(call_future, future)
+        return future
+
+    def _done(self, key: Hashable):
+        with self._lock:
+            del self._calls[key]
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.future = Future()
+
+
+class ReadBatcher:
+    """Merges the calls of the same key which arrive in a window into one call of all their items
+
+    Args:
+        kind: Label of the merged calls in ppd_coalesced_total metric
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._batches: Dict[Hashable, _Batch] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        key: Hashable,
+        item: Any,
+        func: Callable[[List[Any]], Any],
+        window_secs: float,
+        submit: Callable[..., Future],
+    ) -> Future:
+        """Returns the future of func(items of the batch), item joins the open batch of the key or opens a new one
+
+        A timer closes the batch after window_secs and calls submit(func, items), i.e. submits it to an executor.
+        func's exception is set in the future of all callers of the batch.
+        """
+        with self._lock:
+            batch = self._batches.get(key)
+            is_first = batch is None
+            if is_first:
+                batch = self._batches[key] = _Batch()
+            batch.items.append(item)
+        if not is_first:
+            metrics.inc("ppd_coalesced_total", kind=self.kind)
+            return batch.future
+
+        timer = threading.Timer(window_secs, self._close, args=(key, batch, func, submit))
+        timer.daemon = True
+        timer.start()
+        return batch.future
+
+    def _close(self, key: Hashable, batch: _Batch, func: Callable[[List[Any]], Any], submit: Callable[..., Future]):
+        with self._lock:
+            del self._batches[key]
+        try:
+            chain(submit(func, batch.items), batch.future)
+        except BaseException as e:  # i.e. executor is shut down
+            batch.future.set_exception(e)
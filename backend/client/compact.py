@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Compact histogram wire format, shared by the ROOT file readers(pyroot, uproot)
+How         :
+- TBufferJSON dumps all members and streamer info of the object, which is large for 2D histograms. Compact format has
+  only what is drawn: axes, bin contents, sum of weight squares, entries and statistics. fFunctions are not included.
+- Bin arrays include under and overflow bins in ROOT order and are base64 of zlib compressed little endian floats.
+  They are float32 if the histogram stores them exactly in float32, i.e. TH1F contents, otherwise float64, i.e. TH1D,
+  TProfile contents and all sum of weight squares. "dtypes" gives "f4" or "f8" of each packed array.
+  Variable bin edges are base64 of little endian float64 to draw exact bin borders.
+- Sum of weight squares is omitted if it is same with the contents, i.e. unit weights, then errors are sqrt(content).
+- Readers fill the fields with numpy arrays and dumps_compact_hist packs them, frontend/src/histCompact.js decodes it.
+"""
+
+import base64
+import json
+import zlib
+
+import numpy as np
+
+# Bin arrays of the histogram, TProfile has bin entries and their sum of weight squares too
+ARRAY_FIELDS = ("contents", "sumw2", "bin_entries", "bin_sumw2")
+
+
+def get_pack_dtype(arr: np.ndarray) -> str:
+    """Returns "f4" if the array type is exact in float32, i.e. float32 or int16, otherwise "f8", i.e. float64"""
+    return "f4" if np.can_cast(np.asarray(arr).dtype, np.float32) else "f8"
+
+
+def pack_array(arr: np.ndarray, dtype: str = "f4") -> str:
+    """Returns base64 of zlib compressed little endian float array, browsers inflate it with DecompressionStream"""
+    return base64.b64encode(zlib.compress(np.asarray(arr).astype("<" + dtype).tobytes(), 6)).decode()
+
+
+def get_stat_names(class_name: str, dimension: int) -> list:
+    """Returns statistics member names which are used in the stats box, same order with TH1::GetStats"""
+    stat_names = ["fTsumw", "fTsumw2", "fTsumwx", "fTsumwx2"]
+    if class_name.startswith("TProfile"):
+        stat_names += ["fTsumwy", "fTsumwy2"]
+    elif dimension == 2:
+        stat_names += ["fTsumwy", "fTsumwy2", "fTsumwxy"]
+    return stat_names
+
+
+def dumps_compact_hist(compact: dict) -> str:
+    """Returns compact JSON of the histogram fields, numpy arrays of bins and axis edges are packed
+
+    Args:
+        compact: class, name, title, entries, minimum, maximum, stats, xaxis, yaxis(None for 1D) and bin arrays(None if
+            not exist). TProfile has error_mode, ymin, ymax too. Axis is nbins, min, max, title, edges and labels.
+    """
+    compact = dict(compact)
+    if compact["sumw2"] is not None and np.array_equal(compact["sumw2"], compact["contents"]):
+        compact["sumw2"] = None
+    dtypes = {}
+    for field in ARRAY_FIELDS:
+        if compact.get(field) is not None:
+            dtypes[field] = get_pack_dtype(compact[field])
+            compact[field] = pack_array(compact[field], dtypes[field])
+    compact["dtypes"] = dtypes
+    for axis_field in ("xaxis", "yaxis"):
+        axis = compact[axis_field]
+        if axis is not None:
+            edges = axis["edges"]
+            edges = base64.b64encode(np.asarray(edges, dtype="<f8").tobytes()).decode() if len(edges) else None
+            compact[axis_field] = {**axis, "edges": edges}
+    return json.dumps(compact, separators=(",", ":"))
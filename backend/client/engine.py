@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Execution engine of PyROOT work: pool of pre-warmed worker processes
+How         :
+- ROOT file reads(TFile open, Get, TBufferJSON) and overlays block, and a ROOT segfault or a hung EOS FUSE read can
+  take down the whole API process. So they run in worker processes which import ROOT once at their start.
+- Tasks are given as "module:function" strings, so the API process does not need to import ROOT to dispatch them.
+- Each worker is a process with its own pipe. A task takes an idle worker, sends the task and waits its result with a
+  timeout. If the worker crashes or times out, only that worker is killed and replaced with a new one. A worker which
+  cannot be started is started again with the next task, and waiting an idle worker times out, so a lost worker does
+  not block the callers forever.
+- If pool size is 0, tasks run in the calling process, which is useful for tests and development. Initializer runs once
+  in the calling process then.
+- Pool size of the config is for the pod, each uvicorn worker process starts its share of it, at least one worker.
+- A worker sends its stage metrics delta with each result, the API process merges them, see backend/metrics.py.
+- Tasks of a profiled request are profiled in the worker and the profile is merged into the request's, see profiling.py
+"""
+
+import importlib
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing.reduction import ForkingPickler
+from typing import Any, Callable, List
+
+from backend.config import get_config
+from backend import metrics
+from . import profiling
+from .readers import get_reader_task
+
+__ENGINE = None  # RootWorkerPool singleton
+__ENGINE_LOCK = threading.Lock()
+
+
+class TaskError(Exception):
+    """Raised when a task raises an exception in the worker"""
+
+
+class WorkerError(Exception):
+    """Raised when a worker crashes or times out while running a task, the worker is replaced"""
+
+
+def resolve_task(task: str) -> Callable:
+    """Returns the function of the "module:function" task string"""
+    module_name, func_name = task.split(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def _worker_main(conn, initializer: str | None):
+    """Main loop of a worker process
+
+    Receives (task, args, profile mode) and sends (is_ok, result or error message, metrics delta, profile). Profile mode
+    is None unless the task is of a profiled request, see profiling.py
+    """
+    logging.basicConfig(level=get_config().loglevel.upper())  # Spawned process does not have the API's logging config
+    if initializer:
+        resolve_task(initializer)()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if message is None:  # shutdown
+            return
+        task, args, profile_mode = message
+        session = profiling.ProfileSession(profile_mode, process_label="root_worker").start() if profile_mode else None
+        try:
+            func = resolve_task(task)
+            result = (True, session.run(func, *args) if session else func(*args))
+        except Exception as e:
+            result = (False, f"{type(e).__name__}: {str(e)}")
+        conn.send(result + (metrics.take_delta(), session.stop() if session else None))
+
+
+class _Worker:
+    """Worker process and parent side of its pipe"""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.task_count = 0
+
+
+class RootWorkerPool:
+    """Pool of worker processes which run tasks one at a time
+
+    Args:
+        size: Number of worker processes, 0 runs tasks in the calling process
+        task_timeout_secs: Default timeout of a task
+        initializer: "module:function" task string that runs once at the start of each worker, i.e. imports ROOT
+        start_method: multiprocessing start method, "spawn" does not copy the API process state to workers
+        acquire_timeout_secs: Timeout of waiting an idle worker, default is 2 * task_timeout_secs
+    """
+
+    def __init__(
+        self,
+        size: int,
+        task_timeout_secs: float,
+        initializer: str = None,
+        start_method: str = "spawn",
+        acquire_timeout_secs: float = None,
+    ):
+        self.size = size
+        self.task_timeout_secs = task_timeout_secs
+        self.acquire_timeout_secs = 2 * task_timeout_secs if acquire_timeout_secs is None else acquire_timeout_secs
+        self.initializer = initializer
+        self.restart_count = 0  # Number of replaced workers because of crash or timeout
+        self._missing_count = 0  # Number of workers which could not be started, they are started again later
+        self._ctx = multiprocessing.get_context(start_method)
+        self._idle = queue.Queue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        if size == 0 and initializer:
+            resolve_task(initializer)()
+        for _ in range(size):
+            self._idle.put(self._start_worker())
+
+    def _start_worker(self) -> _Worker:
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main, args=(child_conn, self.initializer), name="root_worker", daemon=True
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _replace_worker(self, worker: _Worker, reason: str):
+        """Kills the worker and puts a new one to the idle queue"""
+        logging.warning(f"ROOT worker pid:{worker.process.pid} is replaced, reason: {reason}")
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            self.restart_count += 1
+        metrics.inc("ppd_worker_restarts_total")
+        worker.conn.close()
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join(timeout=1)
+        with self._lock:
+            self._missing_count += 1
+        self._start_missing_workers()
+
+    def _start_missing_workers(self):
+        """Starts the workers which are replaced or could not be started before, so the pool does not shrink"""
+        while True:
+            with self._lock:
+                if self._missing_count == 0 or self._closed:
+                    return
+                self._missing_count -= 1
+            try:
+                self._idle.put(self._start_worker())
+            except Exception as e:
+                with self._lock:
+                    self._missing_count += 1
+                logging.error(f"ROOT worker cannot be started, it is retried with the next task: {str(e)}")
+                return
+
+    def _get_idle_worker(self) -> _Worker:
+        """Returns an idle worker, raises WorkerError if no worker is idle in acquire_timeout_secs"""
+        self._start_missing_workers()
+        try:
+            return self._idle.get(timeout=self.acquire_timeout_secs)
+        except queue.Empty:
+            raise WorkerError(
+                f"No idle ROOT worker in {self.acquire_timeout_secs} seconds, missing workers: {self._missing_count}"
+            ) from None
+
+    def run(self, task: str, *args, timeout: float = None) -> Any:
+        """Runs the task in an idle worker and returns its result
+
+        Args:
+            task: "module:function" string of the task function, arguments and result should be picklable
+            args: Arguments of the task function
+            timeout: Timeout in seconds for the task, default is task_timeout_secs
+        Raises:
+            TaskError: task raised an exception or its arguments cannot be sent
+            WorkerError: worker crashed or timed out, it is replaced with a new worker. Or no worker is idle in
+                acquire_timeout_secs
+        """
+        if self.size == 0:
+            return resolve_task(task)(*args)
+        worker = self._get_idle_worker()
+        return self._run_in_worker(worker, task, args, timeout, session=profiling.current_session())
+
+    def run_in_each_worker(self, task: str, *args, timeout: float = None) -> List[Any]:
+        """Runs the task once in each worker and returns their results, i.e. to wait initializers of all workers
+
+        All workers are taken from the idle queue first, so it waits the running tasks. Raises same with run, taken
+        workers are put back if all of them are not idle in acquire_timeout_secs.
+        """
+        if self.size == 0:
+            return [resolve_task(task)(*args)]
+        workers, results = [], []
+        try:
+            for _ in range(self.size):
+                workers.append(self._get_idle_worker())
+            while workers:
+                results.append(self._run_in_worker(workers.pop(0), task, args, timeout))
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+        return results
+
+    def _run_in_worker(
+        self,
+        worker: _Worker,
+        task: str,
+        args: tuple,
+        timeout: float | None,
+        session: "profiling.ProfileSession" = None,
+    ) -> Any:
+        """Runs the task in the worker which is taken from the idle queue, the worker is put back or replaced
+
+        If the profile session is given, the task is profiled in the worker and its profile is added to the session
+        """
+        timeout = self.task_timeout_secs if timeout is None else timeout
+        start_time = time.time()
+        try:
+            # Pickled before sending like Connection.send, so the worker is still idle if arguments are not picklable
+            message = ForkingPickler.dumps((task, args, session.mode if session else None))
+        except Exception as e:
+            self._idle.put(worker)
+            raise TaskError(f"{task} arguments cannot be sent: {type(e).__name__}: {str(e)}") from e
+        try:
+            worker.conn.send_bytes(message)
+            # poll returns True on data or EOF(crash), recv raises EOFError on crash
+            if not worker.conn.poll(timeout):
+                raise TimeoutError(f"task timed out after {timeout} seconds")
+            is_ok, result, metrics_delta, profile = worker.conn.recv()
+        except Exception as e:
+            # Crash, timeout or a result which cannot be unpickled: state of the pipe is unknown
+            reason = f"{task} {type(e).__name__}: {str(e)}, exit code: {worker.process.exitcode}"
+            self._replace_worker(worker, reason=reason)
+            raise WorkerError(reason) from e
+
+        worker.task_count += 1
+        self._idle.put(worker)
+        metrics.merge(metrics_delta)
+        if session is not None and profile is not None:
+            session.add_profile(profile)
+        metrics.observe("ppd_worker_task_seconds", time.time() - start_time, task=task.split(":")[1])
+        logging.debug(f"ROOT worker pid:{worker.process.pid} task:{task} took {time.time() - start_time:.3f}s")
+        if not is_ok:
+            raise TaskError(result)
+        return result
+
+    def shutdown(self):
+        """Stops all workers"""
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in workers:
+            worker.process.join(timeout=2)
+            if worker.process.is_alive():
+                worker.process.kill()
+            worker.conn.close()
+
+
+def get_pool_size_per_process(pool_size: int, process_count: int) -> int:
+    """Returns the share of an API process from the pool size of the pod, 0 stays 0"""
+    if pool_size == 0:
+        return 0
+    return max(1, pool_size // max(1, process_count))
+
+
+def get_engine() -> RootWorkerPool:
+    """Returns the worker pool singleton, it is created on first call with the config"""
+    global __ENGINE
+    with __ENGINE_LOCK:
+        if __ENGINE is None:
+            conf = get_config().root_workers
+            size = get_pool_size_per_process(pool_size=conf.pool_size, process_count=get_config().workers)
+            __ENGINE = RootWorkerPool(
+                size=size,
+                task_timeout_secs=conf.task_timeout_secs,
+                initializer=get_reader_task("init_worker"),
+                start_method=conf.start_method,
+            )
+            logging.info(f"ROOT worker pool is started with {size} {conf.reader} workers")
+        return __ENGINE
+
+
+def shutdown_engine():
+    """Stops the worker pool singleton"""
+    global __ENGINE
+    with __ENGINE_LOCK:
+        if __ENGINE is not None:
+            __ENGINE.shutdown()
+            __ENGINE = None
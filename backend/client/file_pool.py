@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Pool of open file handles, i.e. ROOT TFile
+How         :
+- Opening a ROOT file over EOS FUSE(open, header and streamer info reads) can cost more than reading its histograms,
+  so open handles are kept and reused by path.
+- Pool is bounded: least recently used idle handle is closed above `max_handles`, and handles which are not used for
+  `idle_timeout_secs` are closed. A reaper thread closes idle handles when no file is opened, i.e. after pre-warming,
+  so handles of EOS FUSE files do not stay open and do not pin replaced or deleted files. It runs while the pool has
+  handles.
+- Each handle has its own lock, a handle is used by one thread at a time. Different files are read concurrently.
+- File size and mtime are checked on each use, a handle of a rewritten file is dropped and the file is opened again.
+- Opener and closer are given, so the pool does not depend on ROOT.
+"""
+
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterator, Tuple
+
+
+class _Handle:
+    """Open file, its identity at open time and its usage state"""
+
+    def __init__(self, identity: Tuple[int, int]):
+        self.identity = identity  # (size, mtime_ns) of the file
+        self.file = None  # Opened lazily under the handle lock
+        self.lock = threading.Lock()
+        self.users = 0  # Number of threads which use or wait the handle
+        self.last_used = time.monotonic()
+        self.retired = False  # Removed from the pool, closed when its last user is done
+
+
+class FileHandlePool:
+    """Bounded LRU pool of open file handles keyed by path
+
+    Args:
+        opener: Function which opens the file path and returns its handle, it should raise if the file cannot be opened
+        closer: Function which closes a handle
+        max_handles: Max number of open handles, least recently used idle ones are closed above it
+        idle_timeout_secs: Handles which are not used in this period are closed
+        reap_interval_secs: Period of the reaper thread which closes idle handles, idle_timeout_secs if not given
+    """
+
+    def __init__(
+        self,
+        opener: Callable[[str], Any],
+        closer: Callable[[Any], None],
+        max_handles: int,
+        idle_timeout_secs: float,
+        reap_interval_secs: float | None = None,
+    ):
+        self.opener = opener
+        self.closer = closer
+        self.max_handles = max_handles
+        self.idle_timeout_secs = idle_timeout_secs
+        self.reap_interval_secs = reap_interval_secs or idle_timeout_secs
+        self._reaper = None  # Reaper thread, it exits when the pool is empty and the next open starts a new one
+        self.open_count = 0  # Number of opened files
+        self.reuse_count = 0  # Number of uses of already open handles
+        self._handles: OrderedDict[str, _Handle] = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._handles)
+
+    @contextlib.contextmanager
+    def open(self, path: str) -> Iterator[Any]:
+        """Yields the open handle of the file path, the handle is locked for the caller until the context exits
+
+        Raises:
+            OSError: file cannot be stat'ed
+        """
+        st = os.stat(path)
+        identity = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            self._close_idle_handles()
+            handle = self._handles.get(path)
+            if handle is not None and handle.identity != identity:
+                logging.debug(f"File is changed, its handle is dropped: {path}")
+                self._retire(path)
+                handle = None
+            if handle is None:
+                handle = _Handle(identity)
+                self._handles[path] = handle
+            self._handles.move_to_end(path)
+            handle.users += 1
+            self._close_lru_handles()
+            self._start_reaper()
+
+        try:
+            with handle.lock:
+                if handle.file is None:
+                    try:
+                        handle.file = self.opener(path)
+                    except BaseException:
+                        with self._lock:
+                            if self._handles.get(path) is handle:
+                                self._retire(path)
+                        raise
+                    self.open_count += 1
+                else:
+                    self.reuse_count += 1
+                yield handle.file
+        finally:
+            with self._lock:
+                handle.users -= 1
+                handle.last_used = time.monotonic()
+                if handle.retired and handle.users == 0:
+                    self._close(handle)
+
+    def _retire(self, path: str):
+        """Removes the handle from the pool, it is closed now if nobody uses it. Requires pool lock"""
+        handle = self._handles.pop(path)
+        handle.retired = True
+        if handle.users == 0:
+            self._close(handle)
+
+    def _close(self, handle: _Handle):
+        if handle.file is not None:
+            try:
+                self.closer(handle.file)
+            except Exception as e:
+                logging.warning(f"Cannot close file handle. Error: {str(e)}")
+            handle.file = None
+
+    def _start_reaper(self):
+        """Starts the reaper thread if it is not running. Requires pool lock"""
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_loop, name="file_pool_reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        """Closes idle handles periodically, exits when the pool is empty"""
+        while True:
+            time.sleep(self.reap_interval_secs)
+            with self._lock:
+                self._close_idle_handles()
+                if not self._handles:
+                    self._reaper = None
+                    return
+
+    def _close_idle_handles(self):
+        """Closes the handles which are not used for idle_timeout_secs. Requires pool lock"""
+        now = time.monotonic()
+        for path, handle in list(self._handles.items()):
+            if handle.users == 0 and now - handle.last_used > self.idle_timeout_secs:
+                self._retire(path)
+
+    def _close_lru_handles(self):
+        """Closes least recently used idle handles above max_handles. Requires pool lock"""
+        for path, handle in list(self._handles.items()):
+            if len(self._handles) <= self.max_handles:
+                break
+            if handle.users == 0:
+                self._retire(path)
+
+    def close_all(self):
+        """Closes all idle handles and retires the ones in use"""
+        with self._lock:
+            for path in list(self._handles):
+                self._retire(path)
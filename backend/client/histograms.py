@@ -0,0 +1,671 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Histogram request functionalities
+
+Finds the ROOT files of the requested groups and runs using DQM Metadata Store, and dispatches ROOT reads and overlays
+to the ROOT worker processes(engine.py). This module does not import ROOT.
+
+Concurrent reads and overlays of the same cache key are run once, and partial group reads of the same ROOT file are
+batched into one task, see coalesce.py
+"""
+
+import base64
+import functools
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Iterator, List, Dict, Tuple, Union
+
+from backend.api_v1.models import ResponseOverlayItem, ResponsePlot, ResponsePlotsDict, ResponseGroup, ResponseMain
+from backend.config import get_config, ConfigPlotsGroup
+from backend.dqm_meta.client import get_dqm_store
+from backend.dqm_meta.models import DqmMeta
+from backend import metrics
+from . import profiling, utils
+from .cache import get_hist_cache, make_key
+from .coalesce import ReadBatcher, SingleFlight, chain, then
+from .engine import get_engine
+from .readers import get_reader_name, get_reader_task, READ_GROUP_HISTS_TASK, OVERLAY_GROUP_HISTS_TASK
+
+# Tasks that run in the ROOT worker processes, plots are read by the configured reader
+READ_GROUP_PLOTS_FUNC = "util_read_group_plots_of_one_run_from_root_file"
+
+# Bumped when the cached JSONs or histogram objects change without a plots config change, i.e. plot id format
+CACHE_FORMAT_VERSION = 4
+
+__EXECUTOR = None  # Thread pool which dispatches tasks to ROOT workers
+__EXECUTOR_LOCK = threading.Lock()
+__READ_FLIGHTS = SingleFlight("read")  # In-flight reads, keyed by their cache keys
+__OVERLAY_FLIGHTS = SingleFlight("overlay")  # In-flight overlays, keyed by their plots' cache keys
+__READ_BATCHER = ReadBatcher("batch")  # Partial group reads of the same ROOT file
+
+
+@functools.lru_cache(maxsize=None)
+def get_group_config_hash(group_config: ConfigPlotsGroup) -> str:
+    """Returns hash of a group's plots config: object paths, names, links and draw options, they define its JSONs"""
+    return make_key(CACHE_FORMAT_VERSION, group_config.model_dump_json(), get_config().plots.draw_options)
+
+
+def get_file_identity(file_path: str) -> Tuple[int, int] | None:
+    """Returns (size, mtime) of the file, None if it cannot be stat'ed"""
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def get_hist_cache_key(kind: str, group_config: ConfigPlotsGroup, dqm_meta: DqmMeta) -> str | None:
+    """Returns the persistent cache key of a group's "plots" or "hists" of one run, None if ROOT file is not found
+
+    Key includes ROOT file size and mtime, so a rewritten ROOT file does not hit its old entry
+    """
+    file_identity = get_file_identity(dqm_meta.root_file)
+    if file_identity is None:
+        return None
+    return make_key(kind, dqm_meta.root_file, *file_identity, get_group_config_hash(group_config))
+
+
+def get_overlay_cache_keys(
+    group_config: ConfigPlotsGroup, dqm_metas: List[DqmMeta], run_era_map: Dict[int, str]
+) -> Dict[str, str]:
+    """Returns the persistent cache keys of a group's overlaid plots: {plot name: key}
+
+    Key is made of group plots config, plot name, sorted runs with their ROOT file identities and the era map. Empty if
+    any ROOT file cannot be stat'ed.
+    """
+    runs_files = []
+    for dqm_meta in sorted(dqm_metas, key=lambda m: m.run):
+        file_identity = get_file_identity(dqm_meta.root_file)
+        if file_identity is None:
+            return {}
+        runs_files.append((dqm_meta.run, dqm_meta.root_file, file_identity))
+    runs_eras = sorted(run_era_map.items())
+    group_hash = get_group_config_hash(group_config)
+    return {p.name: make_key("overlay", group_hash, p.name, runs_eras, runs_files) for p in group_config.plots}
+
+
+def _submit_read_through_cache(key: str | None, task: str, args: tuple, dumps: Callable, loads: Callable) -> Future:
+    """Returns the future of the task result from the persistent cache or of the task run in a ROOT worker and cached
+
+    Concurrent reads of the same key are coalesced: the first one looks up the cache in a dispatch thread and submits
+    the task, others get its future. Task args are (group config, DQM metadata, *other args), see _submit_group_read
+    """
+
+    def put(result: Any) -> Any:
+        cache = get_hist_cache()
+        if cache and key and result:
+            cache.put(key, dumps(result))
+        return result
+
+    def read(result_future: Future):
+        try:
+            cache = get_hist_cache()
+            if cache and key:
+                with metrics.stage_timer("cache_get"):
+                    value = cache.get(key)
+                if value is not None:
+                    result_future.set_result(loads(value))
+                    return
+            read_future = _submit_group_read(task, *args)
+        except Exception as e:
+            result_future.set_exception(e)
+            return
+        chain(then(read_future, put), result_future)
+
+    def start() -> Future:
+        result_future = Future()
+        get_executor().submit(profiling.bind(read), result_future)
+        return result_future
+
+    if key is None:
+        return start()
+    return __READ_FLIGHTS.submit(key, start)
+
+
+def _get_configured_group(group_name: str) -> ConfigPlotsGroup | None:
+    return next((g for g in get_config().plots.groups if g.group_name == group_name), None)
+
+
+def _submit_group_read(task: str, group_config: ConfigPlotsGroup, dqm_meta: DqmMeta, *args) -> Future:
+    """Submits a group's read task of one run to a ROOT worker, partial group reads of the same ROOT file are batched
+
+    Lazy loaded plots of a page are single plot reads of the same ROOT files and they arrive together. The ones which
+    arrive in `read_batch_window_secs` are read by one task with the union of their plots, then each one gets its plots.
+    Full group reads are not delayed.
+    """
+    executor = get_executor()
+    window_secs = get_config().root_workers.read_batch_window_secs
+    full_group_config = _get_configured_group(group_config.group_name)
+    if window_secs <= 0 or full_group_config is None or len(group_config.plots) >= len(full_group_config.plots):
+        return executor.submit(profiling.bind(get_engine().run), task, group_config, dqm_meta, *args)
+
+    def read_batch(plot_names_list: List[List[str]]) -> Any:
+        plot_names = set().union(*plot_names_list)
+        batch_config = full_group_config.model_copy(
+            update={"plots": [p for p in full_group_config.plots if p.name in plot_names]}
+        )
+        return get_engine().run(task, batch_config, dqm_meta, *args)
+
+    def get_own_plots(result: Any) -> Any:
+        if result is None:
+            return None
+        if isinstance(result, ResponsePlotsDict):
+            return ResponsePlotsDict({name: result[name] for name in plot_names if name in result.root})
+        return {name: result[name] for name in plot_names if name in result}
+
+    plot_names = [p.name for p in group_config.plots]
+    # Bound here, the batch is submitted by a timer thread which does not have the caller's profile session
+    batch_future = __READ_BATCHER.submit(
+        (task, dqm_meta.root_file, group_config.group_name, args),
+        plot_names,
+        profiling.bind(read_batch),
+        window_secs,
+        executor.submit,
+    )
+    return then(batch_future, get_own_plots)
+
+
+def _dump_hists(hists: Dict[str, bytes]) -> bytes:
+    return json.dumps({name: base64.b64encode(hist).decode() for name, hist in hists.items()}).encode()
+
+
+def _load_hists(value: bytes) -> Dict[str, bytes]:
+    return {name: base64.b64decode(hist) for name, hist in json.loads(value).items()}
+
+
+def submit_read_group_plots_of_one_run(
+    group_config: ConfigPlotsGroup, dqm_meta: DqmMeta, hist_format: str = "json"
+) -> Future:
+    """Returns the future of a group histogram JSONs of one run from the persistent cache or a ROOT worker process
+
+    See readers.py. Worker failures are set in the future, so they are not cached. Each reader and histogram format has
+    its own cache entry. Result is ResponsePlotsDict or None.
+    """
+    reader = get_reader_name()
+    kind = ":".join(
+        ["plots"] + ([hist_format] if hist_format != "json" else []) + ([reader] if reader != "pyroot" else [])
+    )
+    return _submit_read_through_cache(
+        key=get_hist_cache_key(kind, group_config, dqm_meta),
+        task=get_reader_task(READ_GROUP_PLOTS_FUNC),
+        args=(group_config, dqm_meta, hist_format),
+        dumps=lambda plots: plots.model_dump_json().encode(),
+        loads=ResponsePlotsDict.model_validate_json,
+    )
+
+
+def read_group_plots_of_one_run(
+    group_config: ConfigPlotsGroup, dqm_meta: DqmMeta, hist_format: str = "json"
+) -> Union[ResponsePlotsDict, None]:
+    """Blocking variant of submit_read_group_plots_of_one_run for the threads out of the dispatch executor"""
+    return submit_read_group_plots_of_one_run(group_config, dqm_meta, hist_format=hist_format).result()
+
+
+def submit_read_group_hists_of_one_run(group_config: ConfigPlotsGroup, dqm_meta: DqmMeta) -> Future:
+    """Returns the future of a group's serialized histogram objects of one run from the persistent cache or a worker
+
+    They are the input of overlays, see pyroot.util_read_group_hists_of_one_run_from_root_file
+    """
+    return _submit_read_through_cache(
+        key=get_hist_cache_key("hists", group_config, dqm_meta),
+        task=READ_GROUP_HISTS_TASK,
+        args=(group_config, dqm_meta),
+        dumps=_dump_hists,
+        loads=_load_hists,
+    )
+
+
+def get_cached_overlays(overlay_keys: Dict[str, str]) -> Dict[str, ResponsePlot]:
+    """Returns overlaid plots which are in the persistent cache: {plot name: ResponsePlot}"""
+    cache = get_hist_cache()
+    if not cache:
+        return {}
+    cached_plots = {}
+    for name, key in overlay_keys.items():
+        value = cache.get(key)
+        if value is not None:
+            cached_plots[name] = ResponsePlot.model_validate_json(value)
+    return cached_plots
+
+
+def submit_overlay_group_hists(
+    group_config: ConfigPlotsGroup,
+    runs_hists: List[Tuple[DqmMeta, Dict[str, bytes]]],
+    run_era_map: Dict[int, str],
+    overlay_keys: Dict[str, str],
+) -> Future:
+    """Submits the overlay of all histograms of a group to a ROOT worker process and caches them, returns its future
+
+    Concurrent overlays of the same plots and runs are coalesced, the first one re-checks the cache and runs the task.
+    See pyroot.util_overlay_group_hists
+
+    Args:
+        overlay_keys: {plot name: cache key}, empty if overlays should not be cached, i.e. some runs are not read
+    """
+
+    def overlay() -> List[ResponsePlot]:
+        if overlay_keys:
+            # A concurrent overlay may be done after the caller's cache lookup
+            cached_overlays = get_cached_overlays({p.name: overlay_keys[p.name] for p in group_config.plots})
+            if len(cached_overlays) == len(group_config.plots):
+                return list(cached_overlays.values())
+        plots = get_engine().run(OVERLAY_GROUP_HISTS_TASK, group_config, runs_hists, run_era_map)
+        cache = get_hist_cache()
+        if cache:
+            for plot in plots:
+                if plot.data and plot.conf_name in overlay_keys:
+                    cache.put(overlay_keys[plot.conf_name], plot.model_dump_json().encode())
+        return plots
+
+    def start() -> Future:
+        return get_executor().submit(profiling.bind(overlay))
+
+    if not overlay_keys:
+        return start()
+    return __OVERLAY_FLIGHTS.submit(make_key("overlay", *(overlay_keys[p.name] for p in group_config.plots)), start)
+
+
+def get_client_overlays(
+    group_config: ConfigPlotsGroup, runs_plots: List[Tuple[DqmMeta, ResponsePlotsDict]], run_era_map: Dict[int, str]
+) -> List[ResponsePlot]:
+    """Returns client side overlays of a group: each run's histogram JSON once with its style and legend
+
+    JSROOT builds the THStack in the browser, so no ROOT canvas is created and cached per-run JSONs are reused as is.
+
+    Args:
+        group_config: plots config of a group
+        runs_plots: (DQM metadata of the run, its plots) in descending run order
+        run_era_map: dict of run:era
+    """
+    overlays = []
+    for plot_conf in group_config.plots:
+        runs_plot = [(dqm_meta, plots[plot_conf.name]) for dqm_meta, plots in runs_plots if plot_conf.name in plots]
+        if not runs_plot:
+            continue
+        styles = utils.get_overlay_styles(runs=[m.run for m, _ in runs_plot], run_era_map=run_era_map)
+        first_plot = runs_plot[0][1]
+        overlays.append(
+            ResponsePlot(
+                id=first_plot.id,
+                dqm_url=first_plot.dqm_url,
+                draw_option=get_config().plots.draw_options["THStack"],
+                hist_name=first_plot.hist_name,
+                conf_name=plot_conf.name,
+                run=0,  # it is overlaid with runs
+                type="THStack",
+                overlay=[
+                    ResponseOverlayItem(
+                        run=dqm_meta.run,
+                        era=run_era_map[dqm_meta.run],
+                        legend=utils.get_overlay_legend(run=dqm_meta.run, era=run_era_map[dqm_meta.run]),
+                        line_style=line_style,
+                        line_color=line_color,
+                        line_width=line_width,
+                        data=plot.data,
+                        data_format=plot.data_format,
+                    )
+                    for (dqm_meta, plot), (line_style, line_color, line_width) in zip(runs_plot, styles)
+                ],
+            )
+        )
+    return overlays
+
+
+def get_group_dqm_metas(group_conf: ConfigPlotsGroup, run_era_map: Dict[int, str]) -> List[DqmMeta]:
+    """Returns DQM metadata of a group's runs in descending run order, runs which are not in the store are skipped"""
+    dqm_store_client = get_dqm_store(config=get_config())
+    dqm_metas = []
+    for run in sorted(run_era_map.keys(), reverse=True):
+        group_dqm_meta = dqm_store_client.get_meta_by_group_and_run(
+            group_directory=group_conf.eos_directory, run_num=run
+        )
+        if group_dqm_meta:  # Skip if this group and run is not in DQM metadata
+            dqm_metas.append(group_dqm_meta)
+    return dqm_metas
+
+
+def get_histograms_etag(groups_run_era_maps: List[Tuple[ConfigPlotsGroup, Dict[int, str]]], request_key: str) -> str:
+    """Returns strong ETag of a histograms response without reading ROOT files
+
+    It is made of the request, groups' plots config hashes, their runs and eras, and ROOT file paths with their size and
+    mtime. So it changes if the metadata maps a run to another file or a ROOT file is rewritten.
+
+    Args:
+        groups_run_era_maps: list of (plots config of a group, dict of run:era)
+        request_key: Canonical string of the request parameters which change the response body
+    """
+    parts = [request_key]
+    for group_conf, run_era_map in groups_run_era_maps:
+        files = [(m.root_file, get_file_identity(m.root_file)) for m in get_group_dqm_metas(group_conf, run_era_map)]
+        parts.append((get_group_config_hash(group_conf), sorted(run_era_map.items()), files))
+    return make_key(*parts)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool which dispatches tasks to ROOT workers concurrently
+
+    Its size is the bound of concurrent reads and overlays of all requests, see `root_workers.max_concurrent_tasks`
+    """
+    global __EXECUTOR
+    with __EXECUTOR_LOCK:
+        if __EXECUTOR is None:
+            __EXECUTOR = ThreadPoolExecutor(
+                max_workers=get_config().root_workers.max_concurrent_tasks, thread_name_prefix="root_dispatch"
+            )
+        return __EXECUTOR
+
+
+def get_group_histograms(
+    group_conf: ConfigPlotsGroup, run_era_map: Dict[int, str], overlay_mode: str = "server", hist_format: str = "json"
+) -> ResponseGroup:
+    """Returns a group's histograms either overlaid or raw, see submit_group_histograms"""
+    return submit_group_histograms(
+        group_conf, run_era_map, overlay_mode=overlay_mode, hist_format=hist_format
+    ).result()
+
+
+def get_groups_histograms(
+    groups_run_era_maps: List[Tuple[ConfigPlotsGroup, Dict[int, str]]],
+    overlay_mode: str = "server",
+    hist_format: str = "json",
+) -> List[ResponseGroup]:
+    """Returns groups' histograms in the given group order, reads and overlays of all groups run concurrently"""
+    futures = [
+        submit_group_histograms(group_conf, run_era_map, overlay_mode=overlay_mode, hist_format=hist_format)
+        for group_conf, run_era_map in groups_run_era_maps
+    ]
+    return [future.result() for future in futures]
+
+
+def iter_groups_histograms(
+    groups_run_era_maps: List[Tuple[ConfigPlotsGroup, Dict[int, str]]],
+    overlay_mode: str = "server",
+    hist_format: str = "json",
+) -> Iterator[ResponseGroup]:
+    """Yields groups' histograms as soon as each group is ready, fastest group first
+
+    A group which fails is logged and yielded without plots, so the other groups are still streamed.
+    """
+    futures = {
+        submit_group_histograms(
+            group_conf, run_era_map, overlay_mode=overlay_mode, hist_format=hist_format
+        ): group_conf
+        for group_conf, run_era_map in groups_run_era_maps
+    }
+    for future in as_completed(futures):
+        try:
+            yield future.result()
+        except Exception as e:  # Stream is already started, an error cannot be sent as the response status
+            logging.warning(
+                f"Cannot get histograms of group: {futures[future].group_name}, error: {type(e).__name__}: {str(e)}"
+            )
+            yield ResponseGroup(group_name=futures[future].group_name, plots=[], partial=True)
+
+
+def submit_group_histograms(
+    group_conf: ConfigPlotsGroup, run_era_map: Dict[int, str], overlay_mode: str = "server", hist_format: str = "json"
+) -> Future:
+    """Fans out a group's reads of each run and returns the future of its histograms either overlaid or raw
+
+    Nothing blocks on the executor threads: when the last read is done, its overlay is submitted and the group future is
+    completed when the overlay is done. Read results are gathered in descending run order, so overlays do not depend on
+    which read finishes first.
+
+    Notes:
+        - If there is one run in the runs list, response will be raw histogram JSONs including TH2F(2D)
+        - If there are more than one run, response is overlaid histograms from these runs and their ERAs
+    Args:
+        group_conf: plots config of a group
+        run_era_map: dict of run:era
+        overlay_mode: "server" builds THStack canvases in ROOT workers, "client" returns runs' histograms and styles
+        hist_format: "json" or "compact" format of raw and client side overlay histograms
+    Returns:
+        Future of ResponseGroup
+    """
+    # Bound in the caller's thread: the callbacks below run in dispatch threads which do not have its profile session
+    submit_overlay = profiling.bind(submit_overlay_group_hists)
+    group_future = Future()
+    dqm_metas = get_group_dqm_metas(group_conf, run_era_map)
+
+    # Read each run's plots(raw) or histogram objects(overlay)
+    overlay_keys, cached_overlays = {}, {}
+    if len(run_era_map) == 1 or overlay_mode == "client":
+        submit_read = functools.partial(submit_read_group_plots_of_one_run, hist_format=hist_format)
+    else:
+        # Overlays of the same runs are served from the cache, runs are read only if a plot's overlay is missing
+        submit_read = submit_read_group_hists_of_one_run
+        overlay_keys = get_overlay_cache_keys(group_conf, dqm_metas, run_era_map)
+        cached_overlays = get_cached_overlays(overlay_keys)
+        if all(p.name in cached_overlays for p in group_conf.plots):
+            dqm_metas = []
+
+    def set_group_result(plots: List[ResponsePlot], partial: bool = False):
+        group_future.set_result(ResponseGroup(group_name=group_conf.group_name, plots=plots, partial=partial))
+
+    def on_overlay_done(overlay_future: Future):
+        """Merges cached and new overlays in the config order of the plots"""
+        try:
+            overlays = dict(cached_overlays)
+            overlays.update({p.conf_name: p for p in overlay_future.result()})
+            set_group_result([overlays[p.name] for p in group_conf.plots if p.name in overlays], partial=is_partial[0])
+        except Exception as e:
+            group_future.set_exception(e)
+
+    is_partial = [False]  # Set if a run's read fails, the group response is not cacheable then
+
+    def on_reads_done(read_futures: List[Tuple[DqmMeta, Future]]):
+        runs_results = []
+        for group_dqm_meta, future in read_futures:
+            try:
+                result = future.result()
+            except Exception as e:  # Only this run is dropped, i.e. worker, cache or validation errors
+                logging.warning(
+                    f"Cannot read group plots => file: {group_dqm_meta.root_file}, error: {type(e).__name__}: {str(e)}"
+                )
+                is_partial[0] = True
+                continue
+            if result:
+                runs_results.append((group_dqm_meta, result))
+
+        if len(run_era_map) == 1:
+            # RAW: Return raw histogram jsons including 2D
+            set_group_result(runs_results[0][1].get_plots_only() if runs_results else [], partial=is_partial[0])
+        elif overlay_mode == "client":
+            # OVERLAID in the browser
+            set_group_result(
+                get_client_overlays(group_conf, runs_plots=runs_results, run_era_map=run_era_map),
+                partial=is_partial[0],
+            )
+        else:
+            # OVERLAID: If there are more than 1 run, it means return overlaid
+            missing_plot_confs = [p for p in group_conf.plots if p.name not in cached_overlays]
+            if not runs_results or not missing_plot_confs:
+                set_group_result(
+                    [cached_overlays[p.name] for p in group_conf.plots if p.name in cached_overlays],
+                    partial=is_partial[0],
+                )
+                return
+            submit_overlay(
+                group_conf.model_copy(update={"plots": missing_plot_confs}),
+                runs_results,
+                run_era_map,
+                # Overlay of a partially read run set is not cached
+                overlay_keys if len(runs_results) == len(read_futures) else {},
+            ).add_done_callback(on_overlay_done)
+
+    def on_reads_done_safe(read_futures: List[Tuple[DqmMeta, Future]]):
+        try:
+            on_reads_done(read_futures)
+        except Exception as e:
+            group_future.set_exception(e)
+
+    read_futures = [(m, submit_read(group_conf, m)) for m in dqm_metas]
+    if not read_futures:
+        on_reads_done_safe(read_futures)
+        return group_future
+
+    # Last finished read gathers all of them
+    pending = [len(read_futures)]
+    pending_lock = threading.Lock()
+
+    def on_read_done(_):
+        with pending_lock:
+            pending[0] -= 1
+            is_last = pending[0] == 0
+        if is_last:
+            on_reads_done_safe(read_futures)
+
+    for _, future in read_futures:
+        future.add_done_callback(on_read_done)
+    return group_future
+
+
+def get_groups_run_era_maps(
+    groups: List[str] = None,
+    eras: List[str] = None,
+    runs: List[int] | None = None,
+    max_era_run_size: int | None = None,
+) -> List[Tuple[ConfigPlotsGroup, Dict[int, str]]]:
+    """Returns (plots config of a group, dict of run:era) of the requested groups in the config order
+
+    Args:
+        runs: Requested runs data
+        groups: Requested groups data, None means all groups
+        eras: Requested ERAs data, None means all ERAs
+        max_era_run_size: Max RUN size in each ERA. If limit is not defined, default calue will come from conf
+    """
+    logging.debug(f"Params: eras: {eras},  groups: {groups},runs:{runs}")
+    conf = get_config()
+    max_era_run_size = max_era_run_size or conf.plots.max_era_run_size
+    dqm_store_client = get_dqm_store(config=conf)
+
+    # get groups' eos directories from their names in given "groups" argument
+    groups_eos_directories = None
+    if groups:
+        groups_eos_directories = [d for gname, d in conf.get_group_name_eos_directory_map().items() if gname in groups]
+
+    # Get dict of {group: {run: era}} and find runs/eras
+    with metrics.stage_timer("metadata_lookup"):
+        if eras or runs:
+            # If eras or runs given. If both of them are given, both are applied in the filters
+            # ... which means their "AND" condition will be applied.
+            groups_runs_of_eras_dict = dqm_store_client.get_groups_and_runs_of_eras(
+                groups_eos_dirs=groups_eos_directories, eras=eras, runs=runs, run_limit=max_era_run_size
+            )
+        else:
+            # No runs or ERAs given, so return recent run's results
+            # TODO: find recent run from DQM folks instead of intuitive recent run finding!
+            recent_run = dqm_store_client.get_max_run()
+            logging.debug(f"recent_run: {recent_run}")
+            groups_runs_of_eras_dict = dqm_store_client.get_groups_and_runs_of_eras(
+                groups_eos_dirs=groups_eos_directories, runs=[recent_run], run_limit=max_era_run_size
+            )
+
+    logging.debug(f"groups_runs_of_eras_dict: {groups_runs_of_eras_dict}")
+
+    # Iterate items of "ConfigDetectorGroup", a group which does not have the runs gets an empty map
+    return [
+        (group_conf, groups_runs_of_eras_dict.get(group_conf.eos_directory, {}))
+        for group_conf in conf.plots.groups
+        if not groups or group_conf.group_name in groups
+    ]
+
+
+def get_single_plot_group_config(group_name: str, conf_name: str) -> ConfigPlotsGroup | None:
+    """Returns the group config which has only the given plot, None if the group or plot is not in the config
+
+    Reads and overlays of a single plot group read only that object, and have their own cache entries.
+    """
+    for group_conf in get_config().plots.groups:
+        if group_conf.group_name == group_name:
+            for plot_conf in group_conf.plots:
+                if plot_conf.name == conf_name:
+                    return group_conf.model_copy(update={"plots": [plot_conf]})
+    return None
+
+
+def get_plot_descriptors(groups_run_era_maps: List[Tuple[ConfigPlotsGroup, Dict[int, str]]]) -> List[ResponseGroup]:
+    """Returns groups' plots without data from the config and DQM metadata, ROOT files are not read
+
+    Page layout is rendered with them and each plot is loaded lazily using its group, conf_name and runs.
+    Histogram class comes from the plots config, overlays are THStack.
+    """
+    draw_options = get_config().plots.draw_options
+    results = []
+    for group_conf, run_era_map in groups_run_era_maps:
+        dqm_metas = get_group_dqm_metas(group_conf, run_era_map)
+        plots = []
+        if dqm_metas:
+            is_overlay = len(run_era_map) > 1
+            for plot_conf in group_conf.plots:
+                hist_type = "THStack" if is_overlay else plot_conf.type
+                plots.append(
+                    ResponsePlot(
+                        id=utils.get_plot_id(plot_conf.name),
+                        dqm_url=utils.get_formatted_hist_dqm_url(
+                            conf_url=plot_conf.dqm_link, dataset=dqm_metas[0].dataset, run=dqm_metas[0].run
+                        ),
+                        draw_option=draw_options.get(hist_type),
+                        hist_name=plot_conf.name.rsplit("/", 1)[-1],
+                        conf_name=plot_conf.name,
+                        run=0 if is_overlay else dqm_metas[0].run,
+                        type=hist_type,
+                    )
+                )
+        results.append(ResponseGroup(group_name=group_conf.group_name, plots=plots))
+    return results
+
+
+def get_histograms(
+    groups: List[str] = None,
+    eras: List[str] = None,
+    runs: List[int] | None = None,
+    max_era_run_size: int | None = None,
+    overlay_mode: str = "server",
+    hist_format: str = "json",
+    groups_run_era_maps: List[Tuple[ConfigPlotsGroup, Dict[int, str]]] | None = None,
+) -> ResponseMain:
+    """Main function to get all histograms with provided filters
+
+    Args:
+        runs: Requested runs data
+        groups: Requested groups data, None means all groups
+        eras: Requested ERAs data, None means all ERAs
+        max_era_run_size: Max RUN size in each ERA. If limit is not defined, default calue will come from conf
+        overlay_mode: "server" or "client" side overlays of multiple runs
+        hist_format: "json" or "compact" histogram data, see RequestHists
+        groups_run_era_maps: Result of get_groups_run_era_maps if it is already found, i.e. for the ETag
+    """
+    if groups_run_era_maps is None:
+        groups_run_era_maps = get_groups_run_era_maps(
+            groups=groups, eras=eras, runs=runs, max_era_run_size=max_era_run_size
+        )
+    list_of_groups_results = get_groups_histograms(
+        groups_run_era_maps=groups_run_era_maps, overlay_mode=overlay_mode, hist_format=hist_format
+    )
+
+    resp = ResponseMain(runs=runs, eras=eras, groups=groups, groups_data=list_of_groups_results)
+    # logging.debug(resp.model_dump_json())
+    return resp
+
+
+def iter_histograms(
+    groups: List[str] = None,
+    eras: List[str] = None,
+    runs: List[int] | None = None,
+    max_era_run_size: int | None = None,
+    overlay_mode: str = "server",
+    hist_format: str = "json",
+) -> Iterator[ResponseGroup]:
+    """Streaming variant of get_histograms: yields each group's histograms as soon as they are ready"""
+    groups_run_era_maps = get_groups_run_era_maps(
+        groups=groups, eras=eras, runs=runs, max_era_run_size=max_era_run_size
+    )
+    yield from iter_groups_histograms(
+        groups_run_era_maps=groups_run_era_maps, overlay_mode=overlay_mode, hist_format=hist_format
+    )
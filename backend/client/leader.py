@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Leader election of the uvicorn worker processes of a pod with a file lock
+How         :
+- Some background work should run once per pod, not in each uvicorn worker, i.e. histogram cache pre-warming.
+- Leader is the process which holds an exclusive non-blocking flock of the lock file. Kernel releases the lock when
+  the process exits or crashes, so another worker takes it over on its next try.
+- Lock file should be on a local volume of the pod, flock is not reliable on network file systems like EOS.
+"""
+
+import fcntl
+import logging
+import os
+
+
+class LeaderLock:
+    """Exclusive file lock which is held until release or the process exit
+
+    Args:
+        file_path: Lock file, it is created if it does not exist. The leader writes its pid to it
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._fd = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """Returns True if this process is the leader, it does not block"""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        logging.info(f"Process pid:{os.getpid()} is the leader of {self.file_path}")
+        return True
+
+    def release(self):
+        """Releases the lock if it is held"""
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Histogram cache pre-warming of newly discovered runs
+How         :
+- When the DQM Metadata Store refresher swaps in a new store, new (group, run) entries are queued as tasks.
+- "read" task reads all configured plots of a group for a run into the histogram cache.
+- "overlay" task builds the default overlay of a group's era: its latest `max_era_run_size` runs.
+- Tasks run one at a time in a background thread, newest runs first, and at most `prewarm.max_tasks_per_sec`, so they
+  never take more than a single dispatch slot from the live requests.
+- With multiple uvicorn workers only the leader process pre-warms, see leader.py. A worker which takes the leadership
+  over queues the latest runs of its current store, already cached ones are cache hits.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+from backend.config import get_config, ConfigPlotsGroup
+from backend.dqm_meta.client import (
+    add_dqm_store_listener,
+    get_dqm_store,
+    get_dqm_store_info,
+    remove_dqm_store_listener,
+)
+from backend.dqm_meta.models import DqmMetaStore
+from . import histograms
+from .leader import LeaderLock
+
+__PREWARMER = None  # Prewarmer singleton
+
+READ_TASK = "read"
+OVERLAY_TASK = "overlay"
+_TASK_ORDER = {READ_TASK: 0, OVERLAY_TASK: 1}  # Overlays of a run are built after its reads
+LEADER_RETRY_SECS = 10  # Followers try to take the leadership over in this period
+
+
+class Prewarmer:
+    """Priority queue of pre-warming tasks and its rate limited background thread
+
+    Args:
+        max_tasks_per_sec: Rate limit of the tasks
+        max_queue_size: Lowest priority(oldest run) tasks are dropped above this size
+        max_era_run_size: Number of latest runs of an era in the default overlays and new runs of a group to read
+        leader_lock: If given, tasks are queued and run only while this process holds it
+    """
+
+    def __init__(
+        self, max_tasks_per_sec: float, max_queue_size: int, max_era_run_size: int, leader_lock: LeaderLock = None
+    ):
+        self.min_interval_secs = 1 / max_tasks_per_sec
+        self.max_queue_size = max_queue_size
+        self.max_era_run_size = max_era_run_size
+        self.done_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+        self.leader_lock = leader_lock
+        self._heap = []  # [(priority, sequence, task key, group config)]
+        self._pending = set()  # Task keys in the heap
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def is_leader(self) -> bool:
+        return self.leader_lock is None or self.leader_lock.is_leader
+
+    def try_lead(self) -> bool:
+        """Tries to take the leadership, queues the latest runs of the current store when it is taken over"""
+        if self.is_leader:
+            return True
+        if not self.leader_lock.try_acquire():
+            return False
+        # If the store is not loaded yet, its first swap queues them
+        if get_dqm_store_info() is not None:
+            self.put_group_runs(get_dqm_store(config=get_config()).get_new_group_runs(None))
+        return True
+
+    def on_store_swapped(self, previous: DqmMetaStore | None, store: DqmMetaStore):
+        """DQM Metadata Store listener: queues tasks of the new (group, run) entries"""
+        if not self.is_leader:
+            return
+        new_group_runs = store.get_new_group_runs(previous)
+        logging.info(f"Pre-warming new runs of {len(new_group_runs)} groups")
+        self.put_group_runs(new_group_runs)
+
+    def put_group_runs(self, group_runs: Dict[str, Dict[int, str]]):
+        """Queues read tasks of the latest runs and overlay tasks of their eras
+
+        Args:
+            group_runs: {group eos dir:{run: era}} map, runs are in descending order
+        """
+        group_confs = {g.eos_directory: g for g in get_config().plots.groups}
+        for eos_directory, run_era_map in group_runs.items():
+            group_conf = group_confs.get(eos_directory)
+            if group_conf is None:
+                continue
+            # Only the latest runs, i.e. first load of the store has all runs as new
+            latest_runs = list(run_era_map)[: self.max_era_run_size]
+            for run in latest_runs:
+                self._put((-run, _TASK_ORDER[READ_TASK]), (READ_TASK, eos_directory, run), group_conf)
+            for era in {run_era_map[run] for run in latest_runs}:
+                newest_run = max(run for run in latest_runs if run_era_map[run] == era)
+                self._put((-newest_run, _TASK_ORDER[OVERLAY_TASK]), (OVERLAY_TASK, eos_directory, era), group_conf)
+
+    def _put(self, priority: Tuple[int, int], key: Tuple, group_conf: ConfigPlotsGroup):
+        with self._cond:
+            if key in self._pending:
+                return
+            heapq.heappush(self._heap, (priority, next(self._sequence), key, group_conf))
+            self._pending.add(key)
+            if len(self._heap) > self.max_queue_size:
+                lowest = max(self._heap)
+                self._heap.remove(lowest)
+                heapq.heapify(self._heap)
+                self._pending.discard(lowest[2])
+                self.dropped_count += 1
+            self._cond.notify()
+
+    def run_next(self, timeout: float | None = None) -> bool:
+        """Runs the highest priority task, returns False if there was no task in timeout"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._heap or self._stop.is_set(), timeout)
+            if not self._heap:
+                return False
+            _, _, key, group_conf = heapq.heappop(self._heap)
+            self._pending.discard(key)
+
+        kind, eos_directory, arg = key
+        start_time = time.time()
+        try:
+            store = get_dqm_store(config=get_config())
+            if kind == READ_TASK:
+                dqm_meta = store.get_meta_by_group_and_run(group_directory=eos_directory, run_num=arg)
+                if dqm_meta:
+                    histograms.read_group_plots_of_one_run(group_conf, dqm_meta)
+            else:
+                run_era_map = store.get_groups_and_runs_of_eras(
+                    eras=[arg], groups_eos_dirs=[eos_directory], run_limit=self.max_era_run_size
+                ).get(eos_directory, {})
+                if len(run_era_map) > 1:
+                    histograms.get_group_histograms(group_conf=group_conf, run_era_map=run_era_map)
+            self.done_count += 1
+            logging.debug(f"Pre-warm task {key} took {time.time() - start_time:.3f} seconds")
+        except Exception as e:
+            self.failed_count += 1
+            logging.warning(f"Pre-warm task {key} failed. Error: {str(e)}")
+        return True
+
+    def start(self):
+        """Starts the background thread which runs the tasks with the rate limit"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run_loop, name="hist_prewarmer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self.leader_lock:
+            self.leader_lock.release()
+
+    def _run_loop(self):
+        while not self._stop.is_set():
+            if not self.try_lead():
+                self._stop.wait(timeout=LEADER_RETRY_SECS)
+                continue
+            start_time = time.time()
+            if self.run_next(timeout=1):
+                # Rate limit
+                self._stop.wait(timeout=max(0.0, self.min_interval_secs - (time.time() - start_time)))
+
+
+def start_prewarmer():
+    """Starts pre-warming of the new runs which are found by the DQM Metadata Store refresher if it is enabled"""
+    global __PREWARMER
+    conf = get_config()
+    if not conf.prewarm.enabled or __PREWARMER is not None:
+        return
+    __PREWARMER = Prewarmer(
+        max_tasks_per_sec=conf.prewarm.max_tasks_per_sec,
+        max_queue_size=conf.prewarm.max_queue_size,
+        max_era_run_size=conf.plots.max_era_run_size,
+        leader_lock=LeaderLock(conf.prewarm.leader_lock_file),
+    )
+    # Listener is added first, so the runs of a store which is loaded meanwhile are queued either by it or by try_lead
+    add_dqm_store_listener(__PREWARMER.on_store_swapped)
+    __PREWARMER.try_lead()
+    __PREWARMER.start()
+
+
+def stop_prewarmer():
+    """Stops pre-warming"""
+    global __PREWARMER
+    if __PREWARMER is not None:
+        remove_dqm_store_listener(__PREWARMER.on_store_swapped)
+        __PREWARMER.stop()
+        __PREWARMER = None
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : On-demand profiling of single /get-hists requests
+How         :
+- A request is profiled if it has the admin token in "X-Profile-Token" header, or if it is the 1-in-N sampled one.
+  The token is never taken from the URL, URLs are logged and cached by proxies. Nothing is checked if profiling is
+  disabled, see api_v1/routes.py
+- Profile session of the request is kept in a context variable. Functions which are submitted to the dispatch threads
+  are bound to it with `bind`, and the ROOT worker tasks of a session are profiled in the workers too, see engine.py.
+  So a profile covers the request thread, its dispatch threads and its ROOT worker tasks, i.e. overlays.
+- "cprofile" mode: deterministic profile of the session's threads and tasks, written as a pstats dump(.prof).
+  "sampling" mode: call stacks of the session's threads and tasks are sampled, written as collapsed stacks(.collapsed)
+  which flamegraph.pl or speedscope reads.
+- Profiles are written to the local output directory with a JSON info file, oldest ones are deleted above max_files.
+  They are listed and downloaded with "/debug/profiles", see main.py
+"""
+
+import contextvars
+import cProfile
+import functools
+import hmac
+import itertools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, List, Tuple
+
+from pydantic import BaseModel
+
+from backend.config import get_config
+
+PROFILE_EXTENSIONS = {"cprofile": ".prof", "sampling": ".collapsed"}
+
+# Context variable, not a module singleton: each request and dispatch thread sees its own profile session
+_CURRENT_SESSION = contextvars.ContextVar("profile_session", default=None)
+
+__REQUEST_COUNTER = itertools.count(1)  # Sampling counter of the requests of this process
+__FILE_COUNTER = itertools.count(1)  # Makes profile file names unique in the same second
+
+
+class ProfileInfo(BaseModel):
+    """Info of a written profile"""
+
+    name: str  # Profile file name in the output directory
+    mode: str  # "cprofile" or "sampling"
+    trigger: str  # "on_demand" or "sampled"
+    request: str  # Method, path and body of the request
+    duration_secs: float
+    created_at: str
+    pid: int  # uvicorn worker process which served the request
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _StackSampler:
+    """Samples call stacks of the added threads in a background thread and counts them as collapsed stacks"""
+
+    def __init__(self, interval_secs: float):
+        self.interval_secs = interval_secs
+        self.stacks = Counter()  # {"thread;outer frame;...;inner frame": sample count}
+        self._threads = {}  # {thread ident: label}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="profile_sampler", daemon=True)
+
+    def add_thread(self, ident: int, label: str):
+        with self._lock:
+            self._threads[ident] = label
+
+    def remove_thread(self, ident: int):
+        with self._lock:
+            self._threads.pop(ident, None)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run_loop(self):
+        while not self._stop_event.wait(self.interval_secs):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, label in self._threads.items():
+                    frame, stack = frames.get(ident), []
+                    while frame is not None:
+                        stack.append(_frame_label(frame))
+                        frame = frame.f_back
+                    if stack:
+                        self.stacks[";".join([label] + stack[::-1])] += 1
+
+
+class ProfileSession:
+    """Profile of a request or of a ROOT worker task, threads join it with `run`
+
+    Args:
+        mode: "cprofile" or "sampling"
+        process_label: First frame of the sampled stacks, so API and ROOT worker stacks are separated in flamegraphs
+    """
+
+    def __init__(self, mode: str, process_label: str = "api"):
+        if mode not in PROFILE_EXTENSIONS:
+            raise ValueError(f"Unknown profiling mode: {mode}, available: {list(PROFILE_EXTENSIONS)}")
+        self.mode = mode
+        self.process_label = process_label
+        self._stats = pstats.Stats()  # Merged stats of cprofile mode
+        self._lock = threading.Lock()
+        self._sampler = None
+        if mode == "sampling":
+            self._sampler = _StackSampler(get_config().profiling.sampling_interval_secs)
+
+    def start(self) -> "ProfileSession":
+        if self._sampler:
+            self._sampler.start()
+        return self
+
+    def stop(self) -> dict:
+        """Stops sampling and returns the profile: pstats dict of cprofile mode or collapsed stack counts"""
+        if self._sampler:
+            self._sampler.stop()
+            return dict(self._sampler.stacks)
+        return self._stats.stats
+
+    def run(self, func: Callable, *args) -> Any:
+        """Runs the function in the session: its thread is profiled and its ROOT worker tasks are profiled too"""
+        if _CURRENT_SESSION.get() is self:  # Already profiled thread
+            return func(*args)
+        token = _CURRENT_SESSION.set(self)
+        try:
+            if self._sampler:
+                ident = threading.get_ident()
+                self._sampler.add_thread(ident, f"{self.process_label}:{threading.current_thread().name}")
+                try:
+                    return func(*args)
+                finally:
+                    self._sampler.remove_thread(ident)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return func(*args)
+            finally:
+                profiler.disable()
+                self.add_profile(pstats.Stats(profiler).stats)
+        finally:
+            _CURRENT_SESSION.reset(token)
+
+    def add_profile(self, profile: dict):
+        """Merges a profile of a thread or a ROOT worker task, same format with `stop` result"""
+        with self._lock:
+            if self._sampler:
+                self._sampler.stacks.update(profile)
+                return
+            stats = pstats.Stats()
+            stats.stats = profile
+            stats.get_top_level_stats()
+            self._stats.add(stats)
+
+
+def current_session() -> ProfileSession | None:
+    """Returns the profile session of the caller, None if it is not profiled"""
+    return _CURRENT_SESSION.get()
+
+
+def bind(func: Callable) -> Callable:
+    """Returns the function which runs in the caller's profile session in another thread, func if it is not profiled"""
+    session = _CURRENT_SESSION.get()
+    if session is None:
+        return func
+    return functools.partial(session.run, func)
+
+
+def get_trigger(token: str | None) -> str | None:
+    """Returns why a request is profiled: "on_demand" if it has the admin token, "sampled" if it is 1-in-N, or None"""
+    conf = get_config().profiling
+    if token and is_admin_token(token):
+        return "on_demand"
+    if conf.sample_every_n > 0 and next(__REQUEST_COUNTER) % conf.sample_every_n == 0:
+        return "sampled"
+    return None
+
+
+def is_admin_token(token: str | None) -> bool:
+    """Returns True if token is the admin token, empty admin token config disables on-demand profiling"""
+    admin_token = get_config().profiling.admin_token
+    return bool(admin_token and token) and hmac.compare_digest(admin_token.encode(), token.encode())
+
+
+def profile_call(trigger: str, request: str, func: Callable, *args) -> Tuple[Any, str]:
+    """Runs the function in a new profile session, writes the profile and returns (result, profile name)
+
+    Profile is written if the function raises too
+    """
+    conf = get_config().profiling
+    session = ProfileSession(conf.mode).start()
+    start_time = time.perf_counter()
+    try:
+        result = session.run(func, *args)
+    finally:
+        duration_secs = time.perf_counter() - start_time
+        name = write_profile(session.mode, session.stop(), trigger, request, duration_secs)
+    return result, name
+
+
+def write_profile(mode: str, profile: dict, trigger: str, request: str, duration_secs: float) -> str:
+    """Writes the profile and its info file to the output directory, deletes the oldest ones and returns its name"""
+    conf = get_config().profiling
+    os.makedirs(conf.output_dir, exist_ok=True)
+    now = datetime.now()
+    name = f"{now:%Y%m%d-%H%M%S}-{os.getpid()}-{next(__FILE_COUNTER):06d}-{trigger}{PROFILE_EXTENSIONS[mode]}"
+    file_path = os.path.join(conf.output_dir, name)
+    if mode == "cprofile":
+        stats = pstats.Stats()
+        stats.stats = profile
+        stats.dump_stats(file_path)
+    else:
+        with open(file_path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in sorted(profile.items()))
+    info = ProfileInfo(
+        name=name,
+        mode=mode,
+        trigger=trigger,
+        request=request,
+        duration_secs=round(duration_secs, 6),
+        created_at=now.isoformat(timespec="seconds"),
+        pid=os.getpid(),
+    )
+    with open(file_path + ".json", "w") as f:
+        f.write(info.model_dump_json())
+    logging.info(f"Profile of request is written: {file_path}, trigger: {trigger}, took {duration_secs:.3f}s")
+    delete_old_profiles(conf.output_dir, conf.max_files)
+    return name
+
+
+def list_profiles() -> List[ProfileInfo]:
+    """Returns infos of the written profiles, newest first"""
+    output_dir = get_config().profiling.output_dir
+    if not os.path.isdir(output_dir):
+        return []
+    infos = []
+    for file_name in os.listdir(output_dir):
+        if not file_name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(output_dir, file_name)) as f:
+                infos.append(ProfileInfo.model_validate_json(f.read()))
+        except (OSError, ValueError) as e:  # Deleted by another uvicorn worker or partially written
+            logging.debug(f"Cannot read profile info {file_name}: {str(e)}")
+    return sorted(infos, key=lambda i: i.name, reverse=True)
+
+
+def get_profile_path(name: str) -> str | None:
+    """Returns the file path of the listed profile, None if there is no such profile"""
+    if name not in {i.name for i in list_profiles()}:
+        return None
+    return os.path.join(get_config().profiling.output_dir, name)
+
+
+def delete_old_profiles(output_dir: str, max_files: int):
+    """Deletes the oldest profiles and their info files above max_files"""
+    profile_names = sorted(n for n in os.listdir(output_dir) if n.endswith(tuple(PROFILE_EXTENSIONS.values())))
+    for name in profile_names[: max(0, len(profile_names) - max_files)]:
+        for file_name in (name, name + ".json"):
+            try:
+                os.remove(os.path.join(output_dir, file_name))
+            except FileNotFoundError:
+                pass
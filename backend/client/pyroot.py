@@ -3,39 +3,149 @@
 """
 Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
 Description : PyROOT functionalities
+
+Functions of this module run in the ROOT worker processes, see engine.py. histograms.py dispatches them.
 """
-import functools
 import logging
-from typing import List, Dict, Union
+import threading
+from typing import List, Dict, Tuple, Union
 
-from ROOT import TFile, TBufferJSON, TCanvas, THStack, TLegend
+import numpy as np
+import ROOT
+from ROOT import gROOT, SetOwnership, TFile, TBuffer, TBufferFile, TBufferJSON, TCanvas, TH1, THStack, TLegend
 
-from backend.api_v1.models import ResponsePlot, ResponsePlotsDict, ResponseGroup, ResponseMain
-from backend.config import get_config, ConfigPlotsGroup
-from backend.dqm_meta.client import get_dqm_store
+from backend.api_v1.models import ResponsePlot, ResponsePlotsDict
+from backend.config import get_config, ConfigPlotsGroup, ConfigPlotsGroupsHist
 from backend.dqm_meta.models import DqmMeta
-from . import utils
+from backend import metrics
+from . import compact, utils
+from .file_pool import FileHandlePool
 
 # Allowed histogram classes
 stackable_draw_opts = ["hist"]
 DRAW_OPTIONS = get_config().plots.draw_options
 logging.basicConfig(level=get_config().loglevel.upper())
+__FILE_POOL = None  # Open TFile handles of this process
+__FILE_POOL_LOCK = threading.Lock()
 
-# If limit is not defined, default calue will come from conf
-MAX_ERA_RUN_SIZE_PER_GRP = get_config().plots.max_era_run_size
 
+# ROOT settings are applied on import, because a worker of another reader imports this module on its first overlay task
+gROOT.SetBatch(True)  # No graphics in the workers
+# Histograms read from pooled files are not attached to the files, Python owns and deletes them
+TH1.AddDirectory(False)
+# Reads are dispatched from multiple threads when pool size is 0, i.e. they run in the API process
+ROOT.EnableThreadSafety()
 
 # Your Bible: https://root.cern.ch/doc/master/classTDirectoryFile.html
 
 
+def init_worker():
+    """Initializes ROOT worker process, ROOT is already imported and set up with this module"""
+    logging.info("ROOT worker is ready")
+
+
+def open_root_file(file_path: str) -> TFile:
+    """Opens ROOT file in read mode, raises OSError if it cannot be opened"""
+    with metrics.stage_timer("file_open"):
+        tf = TFile.Open(file_path, "read")
+    if not tf or tf.IsZombie():
+        raise OSError(f"Cannot open ROOT file: {file_path}")
+    return tf
+
+
+def get_file_pool() -> FileHandlePool:
+    """Returns pool of open TFile handles of this process, all ROOT file reads should open files through it"""
+    global __FILE_POOL
+    with __FILE_POOL_LOCK:
+        if __FILE_POOL is None:
+            conf = get_config().root_workers
+            __FILE_POOL = FileHandlePool(
+                opener=open_root_file,
+                closer=lambda tf: tf.Close(),
+                max_handles=conf.file_pool_size,
+                idle_timeout_secs=conf.file_idle_timeout_secs,
+            )
+        return __FILE_POOL
+
+
 # ----------------------------------------------------------------------------
 #  READ HIST JSON FROM ROOT FILE
 # ----------------------------------------------------------------------------
 
 
-@functools.lru_cache(maxsize=1000, typed=False)  # Caches responses, params are hashabel so it works
+def _view_to_array(view, size: int, dtype) -> np.ndarray:
+    """Returns numpy array of the C array view without copy"""
+    view.reshape((size,))
+    return np.frombuffer(view, dtype=dtype, count=size)
+
+
+def _compact_axis(axis) -> dict:
+    """Returns compact definition of a TAxis: fixed bins, variable bin edges and bin labels if exist"""
+    edges = axis.GetXbins()
+    labels = axis.GetLabels()
+    return {
+        "nbins": axis.GetNbins(),
+        "min": axis.GetXmin(),
+        "max": axis.GetXmax(),
+        "title": str(axis.GetTitle()),
+        "edges": _view_to_array(edges.GetArray(), edges.GetSize(), np.float64) if edges.GetSize() else [],
+        "labels": {obj.GetUniqueID(): str(obj.GetString()) for obj in labels} if labels else None,
+    }
+
+
+def util_is_compactable(hist) -> bool:
+    """Returns True if the histogram can be converted to the compact format: 1D, 2D histograms and TProfile"""
+    return bool(hist.InheritsFrom("TH1")) and hist.GetDimension() <= 2 and not hist.InheritsFrom("TProfile2D")
+
+
+def util_hist_to_compact_json(hist) -> str:
+    """Returns compact JSON of a 1D/2D histogram or TProfile, see compact.py"""
+    n_cells = hist.GetNcells()
+    dtype = np.float64 if hist.InheritsFrom("TArrayD") else np.float32
+    if hist.InheritsFrom("TArrayI"):
+        dtype = np.int32
+    elif hist.InheritsFrom("TArrayS"):
+        dtype = np.int16
+    elif hist.InheritsFrom("TArrayC"):
+        dtype = np.int8
+
+    class_name = str(hist.ClassName())
+    stats = np.zeros(13)
+    hist.GetStats(stats)
+    sumw2 = hist.GetSumw2()
+    fields = {
+        "class": class_name,
+        "name": str(hist.GetName()),
+        "title": str(hist.GetTitle()),
+        "entries": hist.GetEntries(),
+        "minimum": hist.GetMinimumStored(),
+        "maximum": hist.GetMaximumStored(),
+        "stats": dict(zip(compact.get_stat_names(class_name, hist.GetDimension()), stats.tolist())),
+        "xaxis": _compact_axis(hist.GetXaxis()),
+        "yaxis": _compact_axis(hist.GetYaxis()) if hist.GetDimension() == 2 else None,
+        "contents": _view_to_array(hist.GetArray(), n_cells, dtype),
+        "sumw2": _view_to_array(sumw2.GetArray(), n_cells, np.float64) if sumw2.GetSize() else None,
+    }
+    if hist.InheritsFrom("TProfile"):
+        # fBinEntries is protected, profiles are small so bins are iterated
+        bin_sumw2 = hist.GetBinSumw2()
+        fields.update(
+            {
+                "bin_entries": np.fromiter((hist.GetBinEntries(i) for i in range(n_cells)), np.float64, n_cells),
+                "bin_sumw2": (
+                    _view_to_array(bin_sumw2.GetArray(), n_cells, np.float64) if bin_sumw2.GetSize() else None
+                ),
+                # EErrorType of the error option: "", "s", "i", "g"
+                "error_mode": ["", "s", "i", "g"].index(str(hist.GetErrorOption()).strip().lower()),
+                "ymin": hist.GetYmin(),
+                "ymax": hist.GetYmax(),
+            }
+        )
+    return compact.dumps_compact_hist(fields)
+
+
 def util_read_group_plots_of_one_run_from_root_file(
-    group_config: ConfigPlotsGroup, dqm_meta: DqmMeta
+    group_config: ConfigPlotsGroup, dqm_meta: DqmMeta, hist_format: str = "json"
 ) -> Union[ResponsePlotsDict, None]:
     """Returns a group histogram JSONs of one run
 
@@ -46,91 +156,156 @@ def util_read_group_plots_of_one_run_from_root_file(
     - ROOT file path is fetched from DQM Metadata client which provides DqmMeta object for a group_directory and run.
     - Histograms' object paths are defined in the config and are formatted using run number coming from DQM metadata.
     - A plot required dqm_link which needs to be formatted with dataset and run number.
+    - Errors follow the reader rule, see readers.py: a plot which cannot be read is skipped.
 
     Args:
         group_config: Config of the group to iterate the plots of it
         dqm_meta: DQM metadata to get root file, dataset, era, run
+        hist_format: "json" or "compact", histograms which cannot be compacted are given as "json"
     Returns:
-        ResponsePlotsDict: dict of {key: plot name(name in the config), value: its ResponsePlot object}
+        ResponsePlotsDict: dict of {key: plot name(name in the config), value: its ResponsePlot object}, None if no
+            plot is read
+    Raises:
+        OSError: ROOT file cannot be opened
     """
-    try:
-        group_plots_dicts = {}  # ResponsePlotsDict()  # {plot name: its data}
-        with TFile(dqm_meta.root_file, "read") as tf:
-            logging.debug(f"TFile={dqm_meta.root_file}")
-
-            # Iterate all histograms defined in the plots config for the group
-            for plot_conf in group_config.plots:
-                obj_path = utils.get_formatted_hist_path(
-                    tdirectory=group_config.tdirectory, name=plot_conf.name, run=dqm_meta.run
-                )
-                logging.debug(f"Hist obj path: {obj_path}")
+    group_plots_dicts = {}  # ResponsePlotsDict()  # {plot name: its data}
+    with get_file_pool().open(dqm_meta.root_file) as tf:
+        logging.debug(f"TFile={dqm_meta.root_file}")
+
+        # Iterate all histograms defined in the plots config for the group
+        for plot_conf in group_config.plots:
+            obj_path = utils.get_formatted_hist_path(
+                tdirectory=group_config.tdirectory, name=plot_conf.name, run=dqm_meta.run
+            )
+            logging.debug(f"Hist obj path: {obj_path}")
 
+            try:
                 # Get hist object
-                assumed_hist = tf.Get(obj_path)
+                with metrics.stage_timer("get", group=group_config.group_name):
+                    assumed_hist = tf.Get(obj_path)
+                if not assumed_hist:
+                    raise KeyError(f"object is not in the file: {obj_path}")
+                SetOwnership(assumed_hist, True)  # Deleted with its Python reference, file stays open
+
+                # Class Name is important to define histogram as 1D, 2D
+                assumed_hist_class = str(assumed_hist.ClassName()).strip()
+                draw_option = DRAW_OPTIONS[assumed_hist_class]  # draw option depends on histogram class
+                if hist_format == "compact" and util_is_compactable(assumed_hist):
+                    with metrics.stage_timer("to_compact", group=group_config.group_name):
+                        data, data_format = util_hist_to_compact_json(assumed_hist), "compact"
+                else:
+                    with metrics.stage_timer("to_json", group=group_config.group_name):
+                        data, data_format = str(TBufferJSON.ToJSON(assumed_hist)), "json"  # create json from the obj
+            except Exception as e:
+                logging.warning(
+                    f"Cannot read => file: {dqm_meta.root_file}, obj path: {obj_path}, error: {type(e).__name__}: {str(e)}"
+                )
+                continue
 
-                if not assumed_hist.IsZombie():
-                    # Class Name is important to define histogram as 1D, 2D
-                    assumed_hist_class = str(assumed_hist.ClassName()).strip()
+            # Create hist url from dataset and run number
+            hist_dqm_url = utils.get_formatted_hist_dqm_url(
+                conf_url=plot_conf.dqm_link, dataset=dqm_meta.dataset, run=dqm_meta.run
+            )
 
-                    # Create hist url from dataset and run number
-                    hist_dqm_url = utils.get_formatted_hist_dqm_url(
-                        conf_url=plot_conf.dqm_link, dataset=dqm_meta.dataset, run=dqm_meta.run
-                    )
-                    name = str(assumed_hist.GetName())
-
-                    # Do not use hist.GetName() as ID because there can be same named plots, give full path name(plot_conf.name)
-                    # ... Also keep in mind that hash can be negative too which includes dash in str
-                    _id = "id" + str(hash(plot_conf.name))
-
-                    data = ""
-                    try:
-                        data = str(TBufferJSON.ToJSON(assumed_hist))  # create json from the obj
-                    except Exception as e:
-                        logging.warning(f"Histogram json convert failed. obj path:{obj_path}, error: {str(e)}")
-
-                    # Add ResponsePlot to ResponsePlotsDict with the key of plot's name in the plots.yaml config file
-                    group_plots_dicts[plot_conf.name] = ResponsePlot(
-                        id=_id,
-                        data=data,
-                        dqm_url=hist_dqm_url,
-                        draw_option=DRAW_OPTIONS[assumed_hist_class],  # draw option depends on histogram class
-                        hist_name=name,
-                        conf_name=plot_conf.name,
-                        run=dqm_meta.run,
-                        type=assumed_hist_class,
-                    )
-                else:
-                    logging.warning(f"Zombie friend => file: {dqm_meta.root_file}, obj path: {obj_path}")
+            # Add ResponsePlot to ResponsePlotsDict with the key of plot's name in the plots.yaml config file
+            # Do not use hist.GetName() as ID because there can be same named plots, give full path name(plot_conf.name)
+            group_plots_dicts[plot_conf.name] = ResponsePlot(
+                id=utils.get_plot_id(plot_conf.name),
+                data=data,
+                data_format=data_format,
+                dqm_url=hist_dqm_url,
+                draw_option=draw_option,
+                hist_name=str(assumed_hist.GetName()),
+                conf_name=plot_conf.name,
+                run=dqm_meta.run,
+                type=assumed_hist_class,
+            )
+
+    if group_plots_dicts:
+        return ResponsePlotsDict(group_plots_dicts)
+    return None
 
-        if group_plots_dicts:
-            return ResponsePlotsDict(group_plots_dicts)
-    except Exception as e:
-        logging.warning(f"Cannot read root => file: {dqm_meta.root_file}, obj path: {obj_path}. error: {str(e)}")
+
+def util_dump_hist(hist) -> bytes:
+    """Serializes a histogram object with ROOT binary streamer, it is much cheaper than JSON to convert back
+
+    Bytes are the object with its class tag as TBufferFile writes it, i.e. as in a TMessage or a TKey
+    """
+    buf = TBufferFile(TBuffer.kWrite)
+    buf.WriteObjectAny(hist, hist.IsA())
+    # Buffer() is converted to a NUL terminated str by PyROOT, its bytes are copied by reading them back
+    data = np.empty(buf.Length(), dtype=np.byte)
+    buf.SetReadMode()
+    buf.SetBufferOffset(0)
+    buf.ReadFastArray(data, len(data))
+    return data.tobytes()
+
+
+def util_load_hist(dumped: bytes):
+    """Creates the histogram object from util_dump_hist bytes, Python owns the object
+
+    Raises:
+        ValueError: If the bytes are not a histogram, ROOT creates any streamed class regardless of the expected one
+    """
+    buf = TBufferFile(TBuffer.kRead, len(dumped), np.frombuffer(dumped, dtype=np.byte), False)
+    hist = buf.ReadObject(TH1.Class())
+    if not hist:
+        raise ValueError("Cannot read histogram object from its streamer bytes")
+    SetOwnership(hist, True)
+    if not hist.InheritsFrom("TH1"):
+        raise ValueError(f"Streamed object is not a histogram: {hist.ClassName()}")
+    return hist
+
+
+def util_read_group_hists_of_one_run_from_root_file(
+    group_config: ConfigPlotsGroup, dqm_meta: DqmMeta
+) -> Union[Dict[str, bytes], None]:
+    """Returns a group's histogram objects of one run serialized with util_dump_hist to overlay them
+
+    Args:
+        group_config: Config of the group to iterate the plots of it
+        dqm_meta: DQM metadata to get root file and run
+    Returns:
+        dict of {key: plot name(name in the config), value: serialized histogram}
+    """
+    group_hists = {}
+    with get_file_pool().open(dqm_meta.root_file) as tf:
+        for plot_conf in group_config.plots:
+            obj_path = utils.get_formatted_hist_path(
+                tdirectory=group_config.tdirectory, name=plot_conf.name, run=dqm_meta.run
+            )
+            with metrics.stage_timer("get", group=group_config.group_name):
+                hist = tf.Get(obj_path)
+            if not hist:
+                logging.warning(f"Zombie friend => file: {dqm_meta.root_file}, obj path: {obj_path}")
+                continue
+            SetOwnership(hist, True)
+            with metrics.stage_timer("dump", group=group_config.group_name):
+                group_hists[plot_conf.name] = util_dump_hist(hist)
+    return group_hists or None
 
 
 # ----------------------------------------------------------------------------
-#  OVERLAY/STACK HISTOGRAMS IF POSSIBLE, USE JSONS COMING FROM ROOT FILES
+#  OVERLAY/STACK HISTOGRAMS IF POSSIBLE, USE HISTOGRAM OBJECTS READ FROM ROOT FILES
 # ----------------------------------------------------------------------------
 
 
-def util_overlay_runs_data_of_one_hist_to_single_thstack(
-    runs_data_of_one_hist: List[ResponsePlot], run_era_map: Dict[int, str]
+def util_overlay_runs_hists_of_one_plot_to_single_thstack(
+    plot_config: ConfigPlotsGroupsHist, runs_hists: List[Tuple[DqmMeta, TH1]], run_era_map: Dict[int, str]
 ) -> ResponsePlot:
-    """Overlay/stack same histogram's different runs/eras data using THStack TCanvas
+    """Overlay/stack same histogram's different runs/eras objects using THStack TCanvas
 
     In ROOT, overlay is possible using THStack. Histograms with different color and line style are added to the THStack
     and appropriate TLegend is created for each of them. Final result is TCanvas JSON to be drawn by JSROOT.
 
     Args:
-        runs_data_of_one_hist: As its name emphasizes, list of histograms data that of same histogram but from different runs.
+        plot_config: Config of the plot
+        runs_hists: As its name emphasizes, list of (DQM metadata of the run, histogram object) of same histogram
+            but from different runs.
         run_era_map: Dictionary of run:era, includes only the runs of the given histograms.
     Notes:
-        - If there are multiple ERAs, LineStyle will be defined by era. If there is one era, LineStyle will be defined by the Run number.
-        - Color will be different for all runs which means all eras too.
+        - Line styles, colors and widths come from utils.get_overlay_styles, same with the client side overlays
     """
-    # Used to set Line Style, their index defines their styles
-    unique_eras = list(set(run_era_map.values()))
-
     # Create THStack
     ths = THStack()
     # Create legend, ref https://gist.github.com/skaplanhex/55982ed5ddcc966dfc2d
@@ -142,44 +317,22 @@ def util_overlay_runs_data_of_one_hist_to_single_thstack(
     # leg.SetTextSize(0.35)
 
     c = TCanvas()
-    line_style_and_width_num = 1  # will control both line style and line width(boldness) depending on ERA count
-    line_color_num = 2  # will control line color of RUNS if there is only 1 ERA. 1 is black, so starts from 2
     title = ""
-    for hist in runs_data_of_one_hist:
-        # TODO: I did't have time to handle None ResponsePlot: If JSON data is not defined or histogram is not stackable, skip
-        # if (not hist.data) or (hist.draw_option not in stackable_draw_opts):
-        if not hist.data:
-            continue
-        # Get ROOT object from its JSON
-        hist_root_obj = TBufferJSON.ConvertFromJSON(hist.data)
-
+    styles = utils.get_overlay_styles(runs=[m.run for m, _ in runs_hists], run_era_map=run_era_map)
+    for (dqm_meta, hist_root_obj), (line_style, line_color, line_width) in zip(runs_hists, styles):
         # Get meta
-        run = hist.run
+        run = dqm_meta.run
         title = str(hist_root_obj.GetTitle()).strip()
 
-        # Differentiate to look better in Stack. Check refs: https://root.cern.ch/doc/master/classTAttLine.html
-        if len(unique_eras) <= 1:
-            # If ERA count is 1, set different line style, line width and line color for each RUN
-            hist_root_obj.SetLineStyle(line_style_and_width_num)
-            hist_root_obj.SetLineWidth(line_style_and_width_num)
-            hist_root_obj.SetLineColor(line_color_num)
-        else:
-            # Set different LineStyle for each RUN of ERA. ERA RUNS will have same colors but different shapes.
-            hist_root_obj.SetLineStyle(line_style_and_width_num)
-            # If ERA count is greater than 1, set same color for same era. ROOT style numbers start from 1 and colors start from 1.
-            # Find the ERA of run and find its index in unique_eras list and assign LineColor according to its index in ERAs list.
-            era_index_of_run = unique_eras.index(run_era_map[run]) + 1
-            hist_root_obj.SetLineColor(era_index_of_run + 1)  # Start colors from 2, because 1 is black
-            # Set the LineWidth(Boldness) depends on ERA name
-            hist_root_obj.SetLineWidth(era_index_of_run)
-
-        leg.AddEntry(hist_root_obj, run_era_map[run] + "-" + str(run), "l")
-        ths.Add(hist_root_obj)
+        # Differentiate to look better in Stack
+        hist_root_obj.SetLineStyle(line_style)
+        hist_root_obj.SetLineColor(line_color)
+        hist_root_obj.SetLineWidth(line_width)
 
-        line_style_and_width_num += 1
-        line_color_num += 1
+        leg.AddEntry(hist_root_obj, utils.get_overlay_legend(run=run, era=run_era_map[run]), "l")
+        ths.Add(hist_root_obj)
 
-    ths.SetName(runs_data_of_one_hist[0].conf_name)  # Set THStack histogram name same as histograms
+    ths.SetName(plot_config.name)  # Set THStack histogram name same as histograms
     ths.SetTitle(title)  # Set THStack histogram title same as histograms
     ths.Draw("nostack,hist")
     leg.Draw()
@@ -192,131 +345,45 @@ def util_overlay_runs_data_of_one_hist_to_single_thstack(
     except Exception as e:
         logging.warning(f"THSack convert to json failed error: {str(e)}")
 
+    first_dqm_meta, first_hist = runs_hists[0]
     return ResponsePlot(
-        id=runs_data_of_one_hist[0].id,
+        id=utils.get_plot_id(plot_config.name),
         data=data,
-        dqm_url=runs_data_of_one_hist[0].dqm_url,
+        dqm_url=utils.get_formatted_hist_dqm_url(
+            conf_url=plot_config.dqm_link, dataset=first_dqm_meta.dataset, run=first_dqm_meta.run
+        ),
         draw_option=DRAW_OPTIONS["THStack"],
-        hist_name=runs_data_of_one_hist[0].hist_name,
-        conf_name=runs_data_of_one_hist[0].conf_name,
+        hist_name=str(first_hist.GetName()),
+        conf_name=plot_config.name,
         run=0,  # it is overlaid with runs
         type="THStack",
     )
 
 
 def util_overlay_group_hists(
-    group_config: ConfigPlotsGroup, runs_plots: List[ResponsePlotsDict], run_era_map: Dict[int, str]
+    group_config: ConfigPlotsGroup, runs_hists: List[Tuple[DqmMeta, Dict[str, bytes]]], run_era_map: Dict[int, str]
 ) -> List[ResponsePlot]:
     """Overlay all histograms of a group
 
     Args:
-        group_config: plots config of a group
-        runs_plots: All runs data of a group. Each item is dict {hist name: ResponsePlot(its data)} of one run.
-        run_era_map:
+        group_config: plots config of a group, only its plots are overlaid
+        runs_hists: All runs' histograms of a group, each item is (DQM metadata of the run, its histograms read by
+            util_read_group_hists_of_one_run_from_root_file)
+        run_era_map: Dictionary of run:era
     """
     resp_overlaid_group_hists = []
     for single_plot_config in group_config.plots:
-        # Get same histogram's json data in each run
-        list_of_runs_data_of_same_histogram = [plots_of_run[single_plot_config.name] for plots_of_run in runs_plots]
-        if list_of_runs_data_of_same_histogram:
-            resp_overlaid_group_hists.append(
-                util_overlay_runs_data_of_one_hist_to_single_thstack(
-                    runs_data_of_one_hist=list_of_runs_data_of_same_histogram, run_era_map=run_era_map
+        # Get same histogram's objects in each run
+        runs_hists_of_same_plot = [
+            (dqm_meta, util_load_hist(hists[single_plot_config.name]))
+            for dqm_meta, hists in runs_hists
+            if single_plot_config.name in hists
+        ]
+        if runs_hists_of_same_plot:
+            with metrics.stage_timer("overlay", group=group_config.group_name):
+                resp_overlaid_group_hists.append(
+                    util_overlay_runs_hists_of_one_plot_to_single_thstack(
+                        plot_config=single_plot_config, runs_hists=runs_hists_of_same_plot, run_era_map=run_era_map
+                    )
                 )
-            )
     return resp_overlaid_group_hists
-
-
-def get_group_histograms(group_conf: ConfigPlotsGroup, run_era_map: Dict[int, str]) -> ResponseGroup:
-    """Returns a group's histograms either overlaid or raw
-
-    Notes:
-        - If there is one run in the runs list, response will be raw histogram JSONs including TH2F(2D)
-        - If there are more than one run, response is overlaid histograms from these runs and their ERAs
-    Args:
-        group_conf: plots config of a group
-        run_era_map: dict of run:era
-    """
-    conf = get_config()
-    dqm_store_client = get_dqm_store(config=conf)
-    runs = run_era_map.keys()
-    # Dict of run: List[ResponsePlot] to easily overlay them
-    raw_runs_plots = []
-
-    # Iterate runs and get their jsons
-    for run in sorted(runs, reverse=True):
-        group_dqm_meta = dqm_store_client.get_meta_by_group_and_run(
-            group_directory=group_conf.eos_directory, run_num=run
-        )
-        if not group_dqm_meta:
-            continue  # Skip if this group and run is not in DQM metadata
-
-        group_runs_hists = util_read_group_plots_of_one_run_from_root_file(group_conf, group_dqm_meta)
-        if group_runs_hists:
-            raw_runs_plots.append(group_runs_hists)
-
-    if len(runs) == 1:
-        # RAW: Return raw histogram jsons including 2D
-        plots = raw_runs_plots[0].get_plots_only()
-    else:
-        # OVERLAID: If there are more than 1 run, it means return overlaid
-        plots = util_overlay_group_hists(group_config=group_conf, runs_plots=raw_runs_plots, run_era_map=run_era_map)
-
-    return ResponseGroup(group_name=group_conf.group_name, plots=plots)
-
-
-def get_histograms(
-    groups: List[str] = None,
-    eras: List[str] = None,
-    runs: List[int] | None = None,
-    max_era_run_size: int = MAX_ERA_RUN_SIZE_PER_GRP,
-) -> ResponseMain:
-    """Main function to get all histograms with provided filters
-
-    Args:
-        runs: Requested runs data
-        groups: Requested groups data, None means all groups
-        eras: Requested ERAs data, None means all ERAs
-        max_era_run_size: Max RUN size in each ERA. If limit is not defined, default calue will come from conf
-    """
-    logging.debug(f"Params: eras: {eras},  groups: {groups},runs:{runs}")
-    conf = get_config()
-    dqm_store_client = get_dqm_store(config=conf)
-
-    # get groups' eos directories from their names in given "groups" argument
-    groups_eos_directories = None
-    if groups:
-        groups_eos_directories = [d for gname, d in conf.get_group_name_eos_directory_map().items() if gname in groups]
-
-    # Get dict of {group: {run: era}} and find runs/eras
-    if eras or runs:
-        # If eras or runs given. If both of them are given, both are applied in the filters
-        # ... which means their "AND" condition will be applied.
-        groups_runs_of_eras_dict = dqm_store_client.get_groups_and_runs_of_eras(
-            groups_eos_dirs=groups_eos_directories, eras=eras, runs=runs, run_limit=max_era_run_size
-        )
-    else:
-        # No runs or ERAs given, so return recent run's results
-        # TODO: find recent run from DQM folks instead of intuitive recent run finding!
-        recent_run = dqm_store_client.get_max_run()
-        logging.debug(f"recent_run: {recent_run}")
-        groups_runs_of_eras_dict = dqm_store_client.get_groups_and_runs_of_eras(
-            groups_eos_dirs=groups, runs=[recent_run], run_limit=max_era_run_size
-        )
-
-    logging.debug(f"groups_runs_of_eras_dict: {groups_runs_of_eras_dict}")
-
-    list_of_groups_results = []
-    # Iterate items of "ConfigDetectorGroup"
-    for group_conf in conf.plots.groups:
-        if groups and (group_conf.group_name not in groups):
-            continue  # skip the group
-        group_result = get_group_histograms(
-            group_conf=group_conf, run_era_map=groups_runs_of_eras_dict[group_conf.eos_directory]
-        )
-        if group_result:
-            list_of_groups_results.append(group_result)
-
-    resp = ResponseMain(runs=runs, eras=eras, groups=groups, groups_data=list_of_groups_results)
-    # logging.debug(resp.model_dump_json())
-    return resp
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : ROOT file reader backends which run in the ROOT worker processes
+How         :
+- A reader is a module which implements the reader interface as functions, they are dispatched as "module:function"
+  tasks, see engine.py:
+    - init_worker(): initializer of the worker process
+    - util_read_group_plots_of_one_run_from_root_file(group_config, dqm_meta, hist_format): ResponsePlotsDict of a
+      group's plots of one run in "json"(JSROOT) or "compact" format, None if nothing is read
+- Error rule of the readers, so the configured reader does not change the plots and the `partial` flag of a response:
+    - A ROOT file which cannot be opened raises OSError, the run is dropped and the response is partial
+    - A plot which cannot be read(missing object, unknown class or failed conversion) is logged and skipped, the other
+      plots of the file are returned
+- Readers:
+    - pyroot: ROOT, TBufferJSON
+    - uproot: pure Python, ROOT is not imported by the workers
+- Reader is selected by `root_workers.reader` config. THStack canvas overlays(server side overlay mode) need PyROOT,
+  so their tasks always use pyroot module, which is imported in a worker on its first overlay task.
+"""
+
+from backend.config import get_config
+
+READER_MODULES = {
+    "pyroot": "backend.client.pyroot",
+    "uproot": "backend.client.uproot_reader",
+}
+
+# Tasks which need PyROOT whatever the reader is
+READ_GROUP_HISTS_TASK = "backend.client.pyroot:util_read_group_hists_of_one_run_from_root_file"
+OVERLAY_GROUP_HISTS_TASK = "backend.client.pyroot:util_overlay_group_hists"
+
+
+def get_reader_name() -> str:
+    """Returns the configured reader name, raises ValueError if it is unknown"""
+    reader = get_config().root_workers.reader
+    if reader not in READER_MODULES:
+        raise ValueError(f"Unknown ROOT file reader: {reader}, available readers: {list(READER_MODULES)}")
+    return reader
+
+
+def get_reader_task(func_name: str) -> str:
+    """Returns "module:function" task string of the reader interface function of the configured reader"""
+    return READER_MODULES[get_reader_name()] + ":" + func_name
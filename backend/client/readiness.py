@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Startup warmup and readiness of the API process
+How         :
+- Liveness("/") is ok as soon as the app serves requests. Readiness("/ready") is ok only after the warmup is done, so
+  Kubernetes does not send traffic to a cold pod in rolling restarts.
+- Warmup runs in a background thread, so the startup event does not block the event loop:
+    - engine: ROOT worker processes are started
+    - workers: a no-op task runs in each worker, which returns only after the worker initializer(i.e. ROOT import) is
+      done
+    - dqm_store: DQM Metadata Store is loaded, i.e. it fails until the store file exists
+    - warmup_read: plots of the latest run of the first group which has data are read through the histogram cache
+- A failed step is retried with exponential backoff up to `startup.max_retry_secs` and "/ready" reports its error
+  meanwhile, so a transient failure(i.e. ROOT worker start) does not keep the pod unready until it is restarted.
+  A failed warmup read is not retried, it does not block readiness.
+- Duration of each step is logged as startup timing report and returned by "/ready".
+"""
+
+import logging
+import threading
+import time
+from typing import Dict
+
+from pydantic import BaseModel
+
+from backend.config import get_config
+from backend.dqm_meta.client import get_dqm_store
+from . import histograms
+from .engine import get_engine
+
+__REPORT = None  # StartupReport of this process
+__WARMUP_THREAD = None  # Background warmup thread
+__WARMUP_STOP = threading.Event()  # Stops store load retries of the warmup thread
+
+PING_TASK = "backend.client.readiness:ping"
+
+
+class StartupReport(BaseModel):
+    """Startup timing report of the API process"""
+
+    ready: bool = False  # True after all warmup steps are done
+    steps: Dict[str, float] = {}  # Duration in seconds of each finished step in run order
+    total_secs: float | None = None  # Seconds from the process start(main.py import) to ready
+    error: str | None = None  # Last error of the warmup, a retried step's error is cleared when it succeeds
+
+
+def ping() -> bool:
+    """No-op worker task, it is answered after the worker initializer is done"""
+    return True
+
+
+def get_startup_report() -> StartupReport:
+    """Returns the startup report, not ready if warmup is not started yet"""
+    return __REPORT or StartupReport()
+
+
+def start_warmup(process_start_time: float):
+    """Starts the background warmup thread, readiness turns ok when it is finished
+
+    Args:
+        process_start_time: time.time() of the process start, used for total startup duration
+    """
+    global __REPORT, __WARMUP_THREAD
+    if __WARMUP_THREAD and __WARMUP_THREAD.is_alive():
+        return
+    __REPORT = StartupReport(steps={"import": time.time() - process_start_time})
+    __WARMUP_STOP.clear()
+    __WARMUP_THREAD = threading.Thread(
+        target=__warmup, args=(__REPORT, process_start_time), name="startup_warmup", daemon=True
+    )
+    __WARMUP_THREAD.start()
+
+
+def stop_warmup():
+    """Stops the background warmup thread"""
+    __WARMUP_STOP.set()
+    if __WARMUP_THREAD:
+        __WARMUP_THREAD.join(timeout=5)
+
+
+def warmup_workers():
+    """Runs a no-op task in each worker, so it returns after all workers are initialized"""
+    get_engine().run_in_each_worker(PING_TASK)
+
+
+def warmup_read() -> str | None:
+    """Reads the plots of the latest run of the first group which has data, returns "group:run" or None if no data"""
+    store = get_dqm_store(config=get_config())
+    for group_conf in get_config().plots.groups:
+        run_era_map = store.get_groups_and_runs_of_eras(groups_eos_dirs=[group_conf.eos_directory], run_limit=1)
+        runs = run_era_map.get(group_conf.eos_directory)
+        if runs:
+            run = max(runs)
+            dqm_meta = store.get_meta_by_group_and_run(group_directory=group_conf.eos_directory, run_num=run)
+            histograms.read_group_plots_of_one_run(group_conf, dqm_meta)
+            return f"{group_conf.group_name}:{run}"
+    return None
+
+
+def __run_step(report: StartupReport, name: str, func):
+    start_time = time.time()
+    result = func()
+    report.steps[name] = time.time() - start_time
+    return result
+
+
+def __run_step_with_retry(report: StartupReport, name: str, func):
+    """Runs the step until it succeeds or warmup is stopped, retry interval is doubled after each failure"""
+    conf = get_config().startup
+    retry_secs = conf.retry_secs
+    while True:
+        try:
+            result = __run_step(report, name, func)
+            report.error = None
+            return result
+        except Exception as e:
+            report.error = f"{name} failed: {str(e)}"
+            logging.warning(f"Startup: {report.error}, retrying in {retry_secs:.1f}s")
+        if __WARMUP_STOP.wait(timeout=retry_secs):
+            raise InterruptedError("warmup is stopped")
+        retry_secs = min(retry_secs * 2, conf.max_retry_secs)
+
+
+def __load_store():
+    return get_dqm_store(config=get_config())
+
+
+def __warmup(report: StartupReport, process_start_time: float):
+    try:
+        __run_step_with_retry(report, "engine", get_engine)
+        __run_step_with_retry(report, "workers", warmup_workers)
+        __run_step_with_retry(report, "dqm_store", __load_store)
+        if get_config().startup.warmup_read:
+            try:
+                warmed = __run_step(report, "warmup_read", warmup_read)
+                logging.info(f"Startup: warmup read of {warmed or 'no data'} is done")
+            except Exception as e:
+                # A broken ROOT file should not keep the pod out of service, requests report their own errors
+                report.error = f"warmup read failed: {str(e)}"
+                logging.warning(f"Startup: {report.error}")
+    except InterruptedError:
+        logging.info("Startup: warmup is stopped before the pod is ready")
+        return
+    report.total_secs = time.time() - process_start_time
+    report.ready = True
+    logging.info(
+        "Startup timing report: "
+        + ", ".join(f"{name}={secs:.3f}s" for name, secs in report.steps.items())
+        + f", total={report.total_secs:.3f}s"
+    )
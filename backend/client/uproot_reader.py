@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Pure Python ROOT file reader using uproot, see readers.py
+How         :
+- Importing ROOT costs seconds and hundreds of MBs in each worker, uproot reads the configured histograms without it.
+- JSON format is made of all streamed members of the object with JSROOT "_typename"s, so JSROOT parses it same with
+  TBufferJSON output. Compact format is same with pyroot, see compact.py.
+- Only reads are done here. THStack canvas overlays need PyROOT, pyroot module is imported on the first overlay task.
+"""
+
+import json
+import logging
+import threading
+from typing import Union
+
+import numpy as np
+import uproot
+from uproot.models.TArray import Model_TArray
+from uproot.models.THashList import Model_THashList
+from uproot.models.TList import Model_TList
+from uproot.models.TObjString import Model_TObjString
+
+from backend.api_v1.models import ResponsePlot, ResponsePlotsDict
+from backend.config import get_config, ConfigPlotsGroup
+from backend.dqm_meta.models import DqmMeta
+from backend import metrics
+from . import compact, utils
+from .file_pool import FileHandlePool
+
+__FILE_POOL = None  # Open uproot file handles of this process
+__FILE_POOL_LOCK = threading.Lock()
+# TObject bits which are set in the files by ROOT I/O and not in TBufferJSON output: kNotDeleted, kIsOnHeap
+_IO_BITS = 0x01000000 | 0x02000000
+
+
+def init_worker():
+    """Initializes uproot worker process, ROOT is not imported"""
+    logging.info("uproot worker is ready")
+
+
+def get_file_pool() -> FileHandlePool:
+    """Returns pool of open uproot file handles of this process"""
+    global __FILE_POOL
+    with __FILE_POOL_LOCK:
+        if __FILE_POOL is None:
+            conf = get_config().root_workers
+            __FILE_POOL = FileHandlePool(
+                opener=open_root_file,
+                closer=lambda f: f.close(),
+                max_handles=conf.file_pool_size,
+                idle_timeout_secs=conf.file_idle_timeout_secs,
+            )
+        return __FILE_POOL
+
+
+def open_root_file(file_path: str):
+    """Opens ROOT file with uproot, raises OSError if it cannot be opened, same with pyroot.open_root_file"""
+    with metrics.stage_timer("file_open"):
+        try:
+            return uproot.open(file_path)
+        except OSError:
+            raise
+        except Exception as e:  # i.e. not a ROOT file
+            raise OSError(f"Cannot open ROOT file: {file_path}, error: {type(e).__name__}: {str(e)}") from e
+
+
+def _get_bin_array(obj) -> np.ndarray | None:
+    """Returns the TArray base of the histogram which holds bin contents, i.e. TArrayF of TH1F"""
+    for base in obj.bases:
+        if isinstance(base, Model_TArray):
+            return np.asarray(base)
+        arr = _get_bin_array(base)
+        if arr is not None:
+            return arr
+    return None
+
+
+def _to_jsroot(obj):
+    """Converts uproot object to JSROOT JSON object: streamed members with "_typename", collections and arrays"""
+    if isinstance(obj, (Model_TList, Model_THashList)):
+        items = list(obj)
+        return {
+            "_typename": obj.classname,
+            "name": obj.classname,
+            "arr": [_to_jsroot(item) for item in items],
+            "opt": [None] * len(items),
+        }
+    if isinstance(obj, Model_TObjString):
+        return {
+            "_typename": "TObjString",
+            "fUniqueID": obj.member("@fUniqueID"),
+            "fBits": obj.member("@fBits") & ~_IO_BITS,
+            "fString": str(obj),
+        }
+    if isinstance(obj, (Model_TArray, np.ndarray)):
+        return np.asarray(obj).tolist()
+    if isinstance(obj, uproot.Model):
+        if obj.classname == "TString":
+            return str(obj)
+        members = {"_typename": obj.classname}
+        members.update({name.lstrip("@"): _to_jsroot(value) for name, value in obj.all_members.items()})
+        if "fBits" in members:
+            members["fBits"] &= ~_IO_BITS
+        return members
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def util_is_compactable(hist) -> bool:
+    """Returns True if the histogram can be converted to the compact format: 1D, 2D histograms and TProfile"""
+    return hist.classname.startswith(("TH1", "TH2")) or hist.classname == "TProfile"
+
+
+def util_hist_to_jsroot_json(hist) -> str:
+    """Returns JSROOT JSON of a histogram, same members with TBufferJSON output"""
+    jsroot_obj = _to_jsroot(hist)
+    jsroot_obj.pop("fN", None)  # Size of the TArray base, JSROOT uses fArray
+    jsroot_obj["fArray"] = _get_bin_array(hist).tolist()
+    return json.dumps(jsroot_obj, separators=(",", ":"))
+
+
+def _compact_axis(axis) -> dict:
+    """Returns compact definition of a TAxis: fixed bins, variable bin edges and bin labels if exist"""
+    labels = axis.member("fLabels")
+    return {
+        "nbins": axis.member("fNbins"),
+        "min": axis.member("fXmin"),
+        "max": axis.member("fXmax"),
+        "title": str(axis.member("fTitle")),
+        "edges": np.asarray(axis.member("fXbins")),
+        "labels": {obj.member("@fUniqueID"): str(obj) for obj in labels} if labels else None,
+    }
+
+
+def util_hist_to_compact_json(hist) -> str:
+    """Returns compact JSON of a 1D/2D histogram or TProfile, see compact.py"""
+    class_name = hist.classname
+    dimension = 2 if class_name.startswith("TH2") else 1
+    sumw2 = np.asarray(hist.member("fSumw2"))
+    fields = {
+        "class": class_name,
+        "name": str(hist.member("fName")),
+        "title": str(hist.member("fTitle")),
+        "entries": hist.member("fEntries"),
+        "minimum": hist.member("fMinimum"),
+        "maximum": hist.member("fMaximum"),
+        "stats": {name: hist.member(name) for name in compact.get_stat_names(class_name, dimension)},
+        "xaxis": _compact_axis(hist.member("fXaxis")),
+        "yaxis": _compact_axis(hist.member("fYaxis")) if dimension == 2 else None,
+        "contents": _get_bin_array(hist),
+        "sumw2": sumw2 if len(sumw2) else None,
+    }
+    if class_name == "TProfile":
+        bin_sumw2 = np.asarray(hist.member("fBinSumw2"))
+        fields.update(
+            {
+                "bin_entries": np.asarray(hist.member("fBinEntries")),
+                "bin_sumw2": bin_sumw2 if len(bin_sumw2) else None,
+                "error_mode": hist.member("fErrorMode"),
+                "ymin": hist.member("fYmin"),
+                "ymax": hist.member("fYmax"),
+            }
+        )
+    return compact.dumps_compact_hist(fields)
+
+
+def util_read_group_plots_of_one_run_from_root_file(
+    group_config: ConfigPlotsGroup, dqm_meta: DqmMeta, hist_format: str = "json"
+) -> Union[ResponsePlotsDict, None]:
+    """Returns a group histogram JSONs of one run, same with pyroot.util_read_group_plots_of_one_run_from_root_file
+
+    Errors follow the reader rule, see readers.py: a plot which cannot be read is skipped.
+
+    Args:
+        group_config: Config of the group to iterate the plots of it
+        dqm_meta: DQM metadata to get root file, dataset, era, run
+        hist_format: "json" or "compact", histograms which cannot be compacted are given as "json"
+    Returns:
+        ResponsePlotsDict: dict of {key: plot name(name in the config), value: its ResponsePlot object}, None if no
+            plot is read
+    Raises:
+        OSError: ROOT file cannot be opened
+    """
+    draw_options = get_config().plots.draw_options
+    group_plots_dicts = {}
+    with get_file_pool().open(dqm_meta.root_file) as f:
+        for plot_conf in group_config.plots:
+            obj_path = utils.get_formatted_hist_path(
+                tdirectory=group_config.tdirectory, name=plot_conf.name, run=dqm_meta.run
+            )
+            try:
+                with metrics.stage_timer("get", group=group_config.group_name):
+                    hist = f[obj_path]
+                draw_option = draw_options[hist.classname]  # draw option depends on histogram class
+                if hist_format == "compact" and util_is_compactable(hist):
+                    with metrics.stage_timer("to_compact", group=group_config.group_name):
+                        data, data_format = util_hist_to_compact_json(hist), "compact"
+                else:
+                    with metrics.stage_timer("to_json", group=group_config.group_name):
+                        data, data_format = util_hist_to_jsroot_json(hist), "json"
+            except Exception as e:
+                logging.warning(
+                    f"Cannot read => file: {dqm_meta.root_file}, obj path: {obj_path}, error: {type(e).__name__}: {str(e)}"
+                )
+                continue
+
+            group_plots_dicts[plot_conf.name] = ResponsePlot(
+                id=utils.get_plot_id(plot_conf.name),
+                data=data,
+                data_format=data_format,
+                dqm_url=utils.get_formatted_hist_dqm_url(
+                    conf_url=plot_conf.dqm_link, dataset=dqm_meta.dataset, run=dqm_meta.run
+                ),
+                draw_option=draw_option,
+                hist_name=str(hist.member("fName")),
+                conf_name=plot_conf.name,
+                run=dqm_meta.run,
+                type=hist.classname,
+            )
+    return ResponsePlotsDict(group_plots_dicts) if group_plots_dicts else None
@@ -4,7 +4,8 @@
 Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
 Description : Client utils
 """
-from typing import List, Dict
+import hashlib
+from typing import List, Dict, Tuple
 
 from backend.config import get_config
 from backend.dqm_meta.client import get_dqm_store
@@ -20,6 +21,35 @@ def get_formatted_hist_dqm_url(conf_url: str, dataset: str, run: int):
     return conf_url.format(run_num_int=run, dataset=dataset)
 
 
+def get_plot_id(conf_name: str) -> str:
+    """Returns DOM id of a plot: sha1 of its config name, it is same in all processes unlike hash()"""
+    return "id" + hashlib.sha1(conf_name.encode()).hexdigest()[:16]
+
+
+def get_overlay_styles(runs: List[int], run_era_map: Dict[int, str]) -> List[Tuple[int, int, int]]:
+    """Returns (line style, line color, line width) of each run of an overlay in the given order
+
+    Used by both server side(THStack) and client side(JSROOT) overlays. Check refs: https://root.cern.ch/doc/master/classTAttLine.html
+    - If ERA count is 1: different line style, line width and line color for each RUN
+    - If ERA count is greater than 1: runs of an ERA have the same color and width, depending on ERA index, and
+      different line styles. Colors start from 2, because 1 is black.
+    """
+    unique_eras = sorted(set(run_era_map.values()))  # Sorted, so colors do not change between processes
+    styles = []
+    for line_num, run in enumerate(runs, start=1):
+        if len(unique_eras) <= 1:
+            styles.append((line_num, line_num + 1, line_num))
+        else:
+            era_index_of_run = unique_eras.index(run_era_map[run]) + 1
+            styles.append((line_num, era_index_of_run + 1, era_index_of_run))
+    return styles
+
+
+def get_overlay_legend(run: int, era: str) -> str:
+    """Returns legend entry of a run in overlays"""
+    return era + "-" + str(run)
+
+
 def get_available_groups() -> List[str]:
     """Get all groups defined in the group"""
     conf = get_config()
@@ -18,11 +18,81 @@ class ConfigDqmMetaStore(BaseModel):
     """DQM meta store config"""
 
     base_dqm_eos_dir: str  # Base DQMGUI EOS directory, currently /eos/cms/store/group/comm_dqm/DQMGUI_data
-    find_tmp_results_file: str  # The file that holds the results of unix find command results: each line is full ROOT file path in the DQM EOS
-    meta_store_json_file: str  # The file that holds DQM Metadata Store JSON which is formatted by eos_grinder.py using of find_tmp_results_file as input
+    meta_store_json_file: str  # The file that holds DQM Metadata Store JSON which is formatted by eos_grinder.py
+    meta_store_snapshot_file: str  # The file that holds DQM Metadata Store binary snapshot which is memory mapped by the client, see dqm_meta/snapshot.py
+    meta_store_json_export: bool = False  # If true, eos_grinder.py writes meta_store_json_file too as JSON export
+    grinder_watermark_file: str  # The file that holds mtimes of scanned EOS directories for incremental eos_grinder.py runs
+    grinder_stats_file: str = "DQM_META.grinder_stats.json"  # The file that holds duration, stage timings and file count of the last eos_grinder.py run, exposed in /metrics
     last_n_run_years: int  # Number of past years to parse EOS directories, important to find "base_dqm_eos_dir/RunYYYY"
     file_suffix_pat: str  # DQM ROOT files has different suffixes, so define them while parsing. Default used is "*DQMIO.root"
-    cache_retention_secs: int  # DQM Metadata Store cache retention time in seconds to update cache object by reading JSON file again
+    walker_threads: int = 16  # Thread pool size of eos_grinder.py directory walker, EOS metadata calls are latency-bound
+    cache_retention_secs: int  # DQM Metadata Store background refresh period in seconds to check the snapshot file and reload it if it is changed
+
+
+class ConfigRootWorkers(BaseModel):
+    """PyROOT worker processes config, see backend/client/engine.py"""
+
+    pool_size: int = 4  # Number of worker processes of the pod that read ROOT files and create overlays, they are divided between uvicorn workers. 0 runs them in the API process
+    task_timeout_secs: float = 60  # Timeout of a single task: a group's plots of one run or a group's overlay
+    start_method: str = "spawn"  # multiprocessing start method of the workers
+    file_pool_size: int = 16  # Max number of open TFile handles in each worker, least recently used ones are closed above it
+    file_idle_timeout_secs: float = 300  # Open TFile handles which are not used in this period are closed
+    max_concurrent_tasks: int = 8  # Bound of concurrently dispatched reads and overlays, effective concurrency is min(pool_size, max_concurrent_tasks)
+    read_batch_window_secs: float = 0.01  # Partial group reads of the same ROOT file(i.e. lazy loaded plots) which arrive in this window are read by one task, 0 disables
+    reader: str = "pyroot"  # ROOT file reader of the plots: "pyroot" or "uproot"(no ROOT import), see backend/client/readers.py
+
+
+class ConfigHistCache(BaseModel):
+    """Persistent histogram JSON cache config, see backend/client/cache.py"""
+
+    enabled: bool = True  # If false, histograms are read from ROOT files in each request
+    backend: str = "sqlite"  # "sqlite": shared by the processes of a pod, "resp": Redis protocol server shared by all pods
+    file: str = "HIST_CACHE.sqlite"  # SQLite file of the cache, should be on a persistent local volume to survive restarts
+    max_bytes: int = 2 * 1024**3  # Size limit of cached JSONs in SQLite, least recently used entries are evicted above it
+    resp_url: str = "redis://localhost:6379/0"  # Redis protocol server url of "resp" backend, it should evict with LRU
+    resp_ttl_secs: int = 0  # Expiry of the entries in "resp" backend, 0 means no expiry
+
+
+class ConfigPrewarm(BaseModel):
+    """Histogram cache pre-warming config, see backend/client/prewarm.py"""
+
+    enabled: bool = True  # If true, new runs found by the DQM Metadata Store refresher are read into the histogram cache
+    max_tasks_per_sec: float = 2  # Rate limit of pre-warming tasks: a group's plots of one run or a group's era overlay
+    max_queue_size: int = 1000  # Tasks of the oldest runs are dropped above this size
+    leader_lock_file: str = "PREWARM.lock"  # Only the uvicorn worker which holds the flock of this local file pre-warms, see backend/client/leader.py
+
+
+class ConfigHttpCache(BaseModel):
+    """HTTP caching headers config of the GET responses which have ETag"""
+
+    max_age_secs: int = 60  # Cache-Control max-age, a reverse proxy serves repeated views in this period
+
+
+class ConfigStartup(BaseModel):
+    """Startup warmup config of the readiness endpoint, see backend/client/readiness.py"""
+
+    warmup_read: bool = True  # If true, plots of the latest run are read before the pod is ready, so ROOT file access is checked
+    retry_secs: float = 5  # First retry interval of a failed warmup step, i.e. DQM Metadata Store file does not exist yet
+    max_retry_secs: float = 60  # Retry interval is doubled after each failure of a step up to this
+
+
+class ConfigProfiling(BaseModel):
+    """On-demand profiling of /get-hists requests, see backend/client/profiling.py"""
+
+    enabled: bool = False  # If false, no request is profiled and nothing is checked in requests
+    admin_token: str = ""  # Requests which have it in X-Profile-Token header are profiled, empty disables on-demand profiling
+    sample_every_n: int = 0  # Profiles 1 in N /get-hists requests of each uvicorn worker automatically, 0 disables sampling
+    mode: str = "cprofile"  # "cprofile": deterministic, pstats dump(.prof). "sampling": stack sampler, collapsed stacks(.collapsed) for flamegraphs
+    sampling_interval_secs: float = 0.005  # Stack sampling interval of "sampling" mode
+    output_dir: str = "profiles"  # Local directory of the profiles, listed in /debug/profiles
+    max_files: int = 50  # Oldest profiles are deleted above it
+
+
+class ConfigMetrics(BaseModel):
+    """Prometheus /metrics config, see backend/metrics.py"""
+
+    multiprocess_dir: str = ""  # Shared local directory of the uvicorn workers' sample files, /metrics sums them. Empty means each worker serves its own metrics, set it if workers > 1
+    flush_secs: float = 5  # A worker writes its samples in this period, so scrapes of the other workers are at most this old
 
 
 class ConfigPlotsGroupsHist(BaseModel):
@@ -62,12 +132,20 @@ class Config(BaseModel):
 
     host: str  # Uvicorn host
     port: int  # Uvicorn port
+    workers: int = 1  # Uvicorn worker processes. They share the memory mapped DQM Metadata Store snapshot and the histogram cache
     base_url: str  # API base url, check for proxy
     api_v1_prefix: str
     loglevel: str
     environment: str  # Dev or prod
     allowed_cors_origins: List[str]  # Middleware green light for the domains/url:ports for CORS
     dqm_meta_store: ConfigDqmMetaStore  # DQM Meta Store configs
+    root_workers: ConfigRootWorkers = ConfigRootWorkers()  # PyROOT worker processes configs
+    hist_cache: ConfigHistCache = ConfigHistCache()  # Persistent histogram JSON cache configs
+    prewarm: ConfigPrewarm = ConfigPrewarm()  # Histogram cache pre-warming configs
+    http_cache: ConfigHttpCache = ConfigHttpCache()  # ETag and Cache-Control configs
+    startup: ConfigStartup = ConfigStartup()  # Startup warmup and readiness configs
+    profiling: ConfigProfiling = ConfigProfiling()  # On-demand request profiling configs
+    metrics: ConfigMetrics = ConfigMetrics()  # Prometheus metrics configs
     plots: ConfigPlots  # plots.yaml config
 
     def get_group_name_eos_directory_map(self) -> Dict[str, str]:
@@ -3,37 +3,167 @@
 """
 Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
 Description : DQM Metadata Store Client
+
+Store is refreshed by a background thread(stale-while-revalidate): it checks the snapshot file identity periodically,
+loads the new store off the request path and swaps it. Until the swap, requests keep getting the previous store.
 """
 
+import json
+import logging
+import os
+import threading
 import time
+from typing import Callable
 
-from backend.config import Config, get_config
-from .models import DqmMetaStore
+from backend import metrics
+from backend.config import Config
+from .models import DqmMetaStore, DqmMetaStoreInfo
+from .snapshot import read_snapshot
 
 __METADATA_CACHE = None  # DQM Metadata Store cache
 __CACHE_UPDATE_TIME = 0  # Last update time in seconds of the cache
-__CACHE_REFRESH_PERIOD_SECS = get_config().dqm_meta_store.cache_retention_secs
+__CACHE_FILE_IDENTITY = None  # (path, inode, size, mtime) of the file that the cache is loaded from
+__STORE_LOCK = threading.Lock()  # Prevents concurrent reloads
+__REFRESHER_STOP = threading.Event()  # Stops background refresher thread
+__REFRESHER_THREAD = None  # Background refresher thread
+__STORE_LISTENERS = []  # Functions which are called with (previous store, new store) after each swap
 
 
 def get_dqm_store(config: Config):
     """DqmMetaStore client to search DQM GUI root files, directories, run numbers and datasets
 
+    It never reloads the store on the request path, except the very first call if background refresher did not load
+    it yet.
+
     Args:
-        config: given Config object to get `dqm_meta_store.meta_store_json_file`
+        config: given Config object to get `dqm_meta_store.meta_store_snapshot_file`
     """
-    global __METADATA_CACHE, __CACHE_UPDATE_TIME
-    # TODO: refresh it in each hour
-    if __need_to_create_new_store_cache():
-        # Get DqmMetaStore from the JSON file which is created by the EOS GRINDER
-        with open(config.dqm_meta_store.meta_store_json_file) as f:
-            __METADATA_CACHE = DqmMetaStore.model_validate_json(f.read())
-            __CACHE_UPDATE_TIME = int(time.time())
-
+    if __METADATA_CACHE is None:
+        refresh_dqm_store(config=config)
     return __METADATA_CACHE
 
 
-def __need_to_create_new_store_cache():
-    if __METADATA_CACHE and __CACHE_UPDATE_TIME > 0:
-        if (int(time.time()) - __CACHE_UPDATE_TIME) < __CACHE_REFRESH_PERIOD_SECS:
+def refresh_dqm_store(config: Config) -> bool:
+    """Loads DqmMetaStore if its file is changed and swaps the cache atomically
+
+    Returns:
+        True if the new store is swapped in
+    """
+    global __METADATA_CACHE, __CACHE_UPDATE_TIME, __CACHE_FILE_IDENTITY
+    with __STORE_LOCK:
+        file_identity = __get_store_file_identity(config)
+        if __METADATA_CACHE is not None and file_identity == __CACHE_FILE_IDENTITY:
             return False
+
+        start_time = time.time()
+        with metrics.stage_timer("dqm_store_load"):
+            store = load_dqm_store(config=config)
+        previous_store = __METADATA_CACHE
+        # Single reference assignment is atomic, requests get either old or new store
+        __METADATA_CACHE, __CACHE_FILE_IDENTITY, __CACHE_UPDATE_TIME = store, file_identity, time.time()
+        logging.info(
+            f"DQM Metadata Store is loaded: version {store.version}, {len(store)} files, "
+            f"{time.time() - start_time:.3f} seconds"
+        )
+
+    for listener in __STORE_LISTENERS:
+        try:
+            listener(previous_store, store)
+        except Exception as e:
+            logging.error(f"DQM Metadata Store listener {listener.__name__} failed. Error: {str(e)}")
     return True
+
+
+def add_dqm_store_listener(listener: Callable[[DqmMetaStore | None, DqmMetaStore], None]):
+    """Adds a function which is called with (previous store, new store) after a new store is swapped in
+
+    Listeners run in the refresher thread, so they should not block, i.e. they can queue background work.
+    """
+    if listener not in __STORE_LISTENERS:
+        __STORE_LISTENERS.append(listener)
+
+
+def remove_dqm_store_listener(listener: Callable):
+    """Removes the store listener"""
+    if listener in __STORE_LISTENERS:
+        __STORE_LISTENERS.remove(listener)
+
+
+def get_dqm_store_info() -> DqmMetaStoreInfo | None:
+    """Returns version and age of the cached store, None if it is not loaded yet"""
+    store = __METADATA_CACHE
+    if store is None:
+        return None
+    return DqmMetaStoreInfo(
+        version=store.version,
+        created_at=store.created_ns / 1e9,
+        loaded_at=__CACHE_UPDATE_TIME,
+        age_secs=time.time() - store.created_ns / 1e9,
+        file_count=len(store),
+    )
+
+
+def get_grinder_stats(config: Config) -> dict | None:
+    """Returns stats of the last EOS grinder run which runs as a separate process, None if it is not written yet"""
+    try:
+        with open(config.dqm_meta_store.grinder_stats_file) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def start_dqm_store_refresher(config: Config):
+    """Starts background thread which refreshes the store in each `dqm_meta_store.cache_retention_secs` seconds"""
+    global __REFRESHER_THREAD
+    if __REFRESHER_THREAD and __REFRESHER_THREAD.is_alive():
+        return
+    __REFRESHER_STOP.clear()
+    __REFRESHER_THREAD = threading.Thread(
+        target=__refresh_loop, args=(config,), name="dqm_store_refresher", daemon=True
+    )
+    __REFRESHER_THREAD.start()
+
+
+def stop_dqm_store_refresher():
+    """Stops background refresher thread"""
+    __REFRESHER_STOP.set()
+    if __REFRESHER_THREAD:
+        __REFRESHER_THREAD.join(timeout=5)
+
+
+def load_dqm_store(config: Config) -> DqmMetaStore:
+    """Loads DqmMetaStore from the snapshot file which is created by the EOS GRINDER
+
+    Snapshot is memory mapped, so loading is almost instant. If there is no snapshot yet, JSON file is used.
+    """
+    snapshot_file = config.dqm_meta_store.meta_store_snapshot_file
+    if os.path.exists(snapshot_file):
+        return read_snapshot(snapshot_file)
+
+    logging.warning(
+        f"DQM Metadata Store snapshot does not exist: {snapshot_file}, reading JSON file. "
+        f"Each of {config.workers} uvicorn workers parses its own copy of it"
+    )
+    with open(config.dqm_meta_store.meta_store_json_file) as f:
+        return DqmMetaStore.from_json(f.read())
+
+
+def __refresh_loop(config: Config):
+    """Refreshes the store until stop event is set, errors are logged and the previous store is kept"""
+    while not __REFRESHER_STOP.is_set():
+        try:
+            refresh_dqm_store(config=config)
+        except Exception as e:
+            logging.error(f"DQM Metadata Store refresh failed, previous store is kept. Error: {str(e)}")
+        __REFRESHER_STOP.wait(timeout=config.dqm_meta_store.cache_retention_secs)
+
+
+def __get_store_file_identity(config: Config):
+    """Returns identity of the file which the store will be loaded from: snapshot or JSON file"""
+    for file_path in (config.dqm_meta_store.meta_store_snapshot_file, config.dqm_meta_store.meta_store_json_file):
+        try:
+            st = os.stat(file_path)
+            return file_path, st.st_ino, st.st_size, st.st_mtime_ns
+        except FileNotFoundError:
+            continue
+    return None
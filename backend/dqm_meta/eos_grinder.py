@@ -4,26 +4,33 @@
 Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
 Description : Stores metadata of DQMGui ROOT files by parsing last N years Runs. Metadata consists of all EOS ROOT files with their paths, run number, dataset name and detector name
 How         :
-- Get the main EOS directory of DQMGUI and `find` all the ROOT files with their full paths depending on Run years, and store them in intermediary txt file
+- Get the main EOS directory of DQMGUI and walk only the configured group directories of the Run years with a bounded thread pool(os.scandir) to find all the ROOT files with their full paths
 - There is a simple regex pattern to extract run year, dataset name, run number, detector group(naming refers to HLT, L1T, etc.)
 - All these metadata are strictly structured using a pydantic model class: DqmFileMetadata
-- And parsed and formatted metadata stored in JSON file.
-- We use this metadata file to find histograms of detector groups or histograms of specific run number. 
-- eos_grinder is runs in the start of the container, and it is added as CRON job with one-hour period.
+- And parsed and formatted metadata stored in a binary snapshot file which is memory mapped by the client, see snapshot.py. JSON export is optional.
+- We use this metadata file to find histograms of detector groups or histograms of specific run number.
+- eos_grinder is runs in the start of the container with full rebuild, and it is added as CRON job in incremental mode.
+- Incremental mode keeps a watermark(mtimes of group and run block directories) and only scans new or changed run block directories, then merges them into the existing store.
 - Process time is less than ~2 minutes and JSON file size is <40 MB for Run2022 and Run2023.
+- Duration, stage timings and file count of each run are written to the grinder stats file, API exposes them in /metrics.
 - In the future, it can be moved to a DB according to requirements.
 """
 
+import fnmatch
+import json
 import logging
 import os
 import re
-import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Union
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+import click
 
 from backend.config import get_config, get_config_group_directories
 from .models import DqmMetaStore, DqmMeta
+from .snapshot import read_snapshot, write_file_atomic, write_snapshot
 
 logging.basicConfig(level=get_config().loglevel.upper())
 CACHE_REFRESH_PERIOD_SECS = 10 * 60  # 10 minutes
@@ -32,10 +39,19 @@ CACHE_REFRESH_PERIOD_SECS = 10 * 60  # 10 minutes
 # EOS GRINDER ----------------------------------------------------------------
 
 
-def run():
+WATERMARK_FORMAT_VERSION = 1
+
+
+def run(full_rebuild: bool = False, export_json: bool = None):
     """Run with given yaml config
 
-    Find DQMGui ROOT files in EOS directories in last N Run years and store them as DqmMetaStore schema
+    Find DQMGui ROOT files in EOS directories in last N Run years and store them as DqmMetaStore binary snapshot.
+    By default, only new or changed run block directories are scanned and merged into the existing store. If there is
+    no watermark or snapshot of a previous run, full rebuild is done.
+
+    Args:
+        full_rebuild: If true, all directories are scanned again instead of incremental update
+        export_json: If true, DqmMetaStore is written to JSON file too. Default value comes from config
     """
     # Get config as object
     __start_time = time.time()
@@ -47,8 +63,11 @@ def run():
 
     # Get values from config file
     dqm_eos_dir = dqm_meta_conf.base_dqm_eos_dir
-    find_tmp_results_file = dqm_meta_conf.find_tmp_results_file
     meta_store_json_file = dqm_meta_conf.meta_store_json_file
+    meta_store_snapshot_file = dqm_meta_conf.meta_store_snapshot_file
+    watermark_file = dqm_meta_conf.grinder_watermark_file
+    if export_json is None:
+        export_json = dqm_meta_conf.meta_store_json_export
     last_n_run_years = dqm_meta_conf.last_n_run_years
     file_suffix_pat = dqm_meta_conf.file_suffix_pat
     allowed_group_directories = conf_group_directories
@@ -66,49 +85,228 @@ def run():
         else:
             logging.warning(f"Run directory not exist: {run_dir}")
 
-    # Run find script and store its data in
-    run_sh_find_cmd(base_eos_run_year_dirs, find_tmp_results_file, file_suffix_pat)
-    dqm_meta_data = get_formatted_meta_from_raw_input(find_tmp_results_file, allowed_group_directories)
-    with open(meta_store_json_file, "w+") as f:
-        f.write(dqm_meta_data.model_dump_json())
+    # Group directories to scan: base_dqm_eos_dir/RunYYYY/GROUP
+    group_dirs = [
+        f"{run_dir}/{group_dir}"
+        for run_dir in base_eos_run_year_dirs
+        for group_dir in allowed_group_directories
+        if os.path.isdir(f"{run_dir}/{group_dir}")
+    ]
+
+    watermark = None
+    if not full_rebuild and os.path.exists(meta_store_snapshot_file):
+        watermark = read_watermark(watermark_file, dqm_eos_dir)
 
+    is_full_rebuild = watermark is None
+    if is_full_rebuild:
+        # Full rebuild is an incremental update of an empty store without watermark: all directories are new
+        logging.info("DQM EOS grinder full rebuild")
+        store, watermark = DqmMetaStore.from_rows([]), {}
+    else:
+        logging.info("DQM EOS grinder incremental update")
+        store = read_snapshot(meta_store_snapshot_file)
+
+    stage_timings = {}  # {stage: elapsed seconds}
+    stage_start_time = time.time()
+    dqm_meta_data, watermark = get_incremental_meta(
+        store, watermark, group_dirs, file_suffix_pat, allowed_group_directories, dqm_meta_conf.walker_threads
+    )
+    stage_timings["scan"] = time.time() - stage_start_time
+
+    # Publish atomically, so the API never reads a half-written file. Watermark is written after the store, if
+    # grinder fails in between, the old watermark causes only a rescan of the same directories.
+    # Unchanged store is not written again, so its version stays same for the API and its caches.
+    stage_start_time = time.time()
+    if dqm_meta_data is not store:
+        write_snapshot(dqm_meta_data, meta_store_snapshot_file)
+    else:
+        logging.info("DQM Metadata Store is not changed, snapshot is not written again")
+    write_watermark(watermark_file, dqm_eos_dir, watermark)
+    stage_timings["write"] = time.time() - stage_start_time
+    if export_json:
+        stage_start_time = time.time()
+        write_file_atomic(meta_store_json_file, lambda f: f.write(dqm_meta_data.to_json().encode()))
+        stage_timings["json_export"] = time.time() - stage_start_time
+
+    write_grinder_stats(
+        dqm_meta_conf.grinder_stats_file,
+        {
+            "finished_at": time.time(),
+            "duration_secs": time.time() - __start_time,
+            "full_rebuild": is_full_rebuild,
+            "changed": dqm_meta_data is not store,
+            "files": len(dqm_meta_data),
+            "group_dirs": len(group_dirs),
+            "stages": stage_timings,
+        },
+    )
     logging.info(f"DQM EOS grinder is finished. Elapsed time : {str(int(time.time() - __start_time))} seconds.")
 
 
-def run_sh_find_cmd(base_search_dirs: list[str], outfile: str, file_suffix_pat: str):
-    """Runs linux find command and saves results to defined outfile
+@click.command()
+@click.option("--full", "full_rebuild", is_flag=True, help="Full rebuild instead of incremental update")
+@click.option("--export-json/--no-export-json", default=None, help="Write JSON export, default comes from config")
+def main(full_rebuild: bool, export_json: bool):
+    """DQM EOS grinder CLI: python -m backend.dqm_meta.eos_grinder [--full]"""
+    run(full_rebuild=full_rebuild, export_json=export_json)
+
+
+# INCREMENTAL UPDATE ---------------------------------------------------------
+
+
+def get_group_dir_watermark(group_dir: str, previous: Dict = None) -> Tuple[Dict, List[str]]:
+    """Returns watermark of a group directory and its run block directory names which are new or changed
+
+    Watermark of a group directory: {"mtime_ns": int, "blocks": {block name: mtime_ns}}
+    A new run block directory changes the mtime of the group directory. If it is not changed, the group directory is
+    not listed again and only the mtimes of the known run block directories are checked.
 
     Args:
-        base_search_dirs: Base EOS directories to run find command
-        outfile: file to store find command results
-        file_suffix_pat: find command "-iname" suffix pattern like '*DQMIO.root'
+        group_dir: Group directory of a run year, i.e. base_dqm_eos_dir/Run2023/JetMET1
+        previous: Watermark of the group directory in the previous run, None means all blocks are new
     """
-    # find "${baseEosDirs[@]}" -iname '*DQMIO.root' | sort -nr >"$outputFile"
-    cmd = f"find {' '.join(base_search_dirs)} -iname '{file_suffix_pat}' | sort -nr>{outfile}"
-    # cmd = f"find {' '.join(base_search_dirs)} \( -path '*/JetMET1/*' -o -path '*/HLTPhysics/*' \) -iname '{file_suffix_pat}' >{outfile}"
-    r = subprocess.run(cmd, capture_output=True, shell=True, check=True)
-    if r.returncode:
-        logging.warning(
-            f"Exit code: {r.returncode} , Stdout: {r.stdout.decode('utf-8')}, Stderr: {r.stderr.decode('utf-8')}"
+    group_mtime = os.stat(group_dir).st_mtime_ns
+    prev_blocks = previous["blocks"] if previous else {}
+    if previous and previous["mtime_ns"] == group_mtime:
+        blocks = {}
+        for block in prev_blocks:
+            try:
+                blocks[block] = os.stat(f"{group_dir}/{block}").st_mtime_ns
+            except FileNotFoundError:
+                continue  # Removed meanwhile, it will be seen in the next run because group mtime is changed
+    else:
+        with os.scandir(group_dir) as it:
+            blocks = {entry.name: entry.stat().st_mtime_ns for entry in it if entry.is_dir()}
+
+    changed_blocks = sorted(block for block, mtime in blocks.items() if prev_blocks.get(block) != mtime)
+    logging.debug(f"{group_dir}: changed blocks: {changed_blocks}")
+    return {"mtime_ns": group_mtime, "blocks": blocks}, changed_blocks
+
+
+def get_incremental_meta(
+    store: DqmMetaStore,
+    watermark: Dict[str, Dict],
+    group_dirs: List[str],
+    file_suffix_pat: str,
+    allowed_group_directories: List[str],
+    max_workers: int = 16,
+) -> Tuple[DqmMetaStore, Dict[str, Dict]]:
+    """Scans only new or changed run block directories and merges them into existing store
+
+    Rows of unchanged run block directories are kept. Rows of changed block directories are replaced with the new scan
+    results. Rows of removed block directories and group directories which are not scanned anymore(out of
+    last_n_run_years or removed from config) are dropped.
+    Group directories and run block directories are scanned in a bounded thread pool because EOS metadata calls are
+    latency-bound, and listed file names are parsed as soon as their directory listing is ready.
+
+    Args:
+        store: Existing DqmMetaStore, empty store means full rebuild
+        watermark: Watermark of the previous run, {group directory: its watermark}, empty dict means full rebuild
+        group_dirs: Group directories to scan
+        file_suffix_pat: ROOT file name pattern like '*DQMIO.root', case-insensitive like "find -iname"
+        allowed_group_directories: group directories from config
+        max_workers: Thread pool size of the directory walker
+    Returns:
+        New DqmMetaStore and new watermark. If nothing is changed, given store object is returned
+    """
+    dir_timings = {}  # {directory: elapsed seconds of its metadata calls}
+    new_watermark, rescan_dirs, kept_dirs = {}, [], set()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="eos_walker") as pool:
+        group_results = pool.map(
+            lambda d: _timed(dir_timings, d, get_group_dir_watermark, d, watermark.get(d)), group_dirs
         )
-    r.check_returncode()
+        for group_dir, (new_watermark[group_dir], changed_blocks) in zip(group_dirs, group_results):
+            for block in new_watermark[group_dir]["blocks"]:
+                if block in changed_blocks:
+                    rescan_dirs.append(f"{group_dir}/{block}")
+                else:
+                    kept_dirs.add(f"{group_dir}/{block}")
+
+        dqm_main_meta_list = [meta for meta in store if os.path.dirname(meta.root_file) in kept_dirs]
+        kept_count = len(dqm_main_meta_list)
+
+        # Stream listed ROOT file names of each run block directory to the parser
+        futures = [pool.submit(_timed, dir_timings, d, list_root_files, d, file_suffix_pat) for d in rescan_dirs]
+        for future in as_completed(futures):
+            dqm_main_meta_list.extend(get_group_metas(future.result(), allowed_group_directories))
+
+    logging.info(
+        f"Rescanned {len(rescan_dirs)} run block directories: kept {kept_count} of {len(store)} files, "
+        f"added {len(dqm_main_meta_list) - kept_count} files"
+    )
+    log_dir_timings(dir_timings)
+    if not rescan_dirs and kept_count == len(store):
+        return store, new_watermark
+    return DqmMetaStore.from_metas(dqm_main_meta_list), new_watermark
+
+
+# DIRECTORY WALKER -----------------------------------------------------------
+
+
+def list_root_files(block_dir: str, file_suffix_pat: str) -> List[str]:
+    """Returns full paths of ROOT files in a run block directory which match the case-insensitive suffix pattern"""
+    pattern = file_suffix_pat.lower()
+    with os.scandir(block_dir) as it:
+        return [entry.path for entry in it if fnmatch.fnmatch(entry.name.lower(), pattern) and entry.is_file()]
+
+
+def _timed(dir_timings: Dict[str, float], directory: str, func: Callable, *args):
+    """Calls func with args and adds its elapsed time to dir_timings of the directory"""
+    start_time = time.time()
+    try:
+        return func(*args)
+    finally:
+        dir_timings[directory] = time.time() - start_time
+
+
+def log_dir_timings(dir_timings: Dict[str, float], top_n: int = 10):
+    """Logs per-directory timings of the walker: all at debug level and the slowest ones at info level"""
+    for directory, elapsed in dir_timings.items():
+        logging.debug(f"Walker directory timing: {elapsed:.3f}s {directory}")
+    slowest = sorted(dir_timings.items(), key=lambda kv: kv[1], reverse=True)[:top_n]
+    logging.info(
+        f"Walker scanned {len(dir_timings)} directories in {sum(dir_timings.values()):.1f}s total, slowest: "
+        + ", ".join(f"{directory}={elapsed:.3f}s" for directory, elapsed in slowest)
+    )
+
+
+def write_grinder_stats(stats_file: str, stats: Dict):
+    """Writes stats of the grinder run, it does not fail the run because they are only for monitoring"""
+    try:
+        write_file_atomic(stats_file, lambda f: f.write(json.dumps(stats).encode()))
+    except Exception as e:
+        logging.warning(f"Cannot write grinder stats file: {stats_file}. Error: {str(e)}")
+
+
+def read_watermark(watermark_file: str, base_dqm_eos_dir: str) -> Union[Dict[str, Dict], None]:
+    """Returns watermark of the previous run, None if it does not exist or it is not compatible"""
+    try:
+        with open(watermark_file) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    if data.get("format_version") != WATERMARK_FORMAT_VERSION or data.get("base_dqm_eos_dir") != base_dqm_eos_dir:
+        logging.warning(f"Watermark file is not compatible, it will be ignored: {watermark_file}")
+        return None
+    return data["group_dirs"]
+
+
+def write_watermark(watermark_file: str, base_dqm_eos_dir: str, watermark: Dict[str, Dict]):
+    """Writes watermark atomically"""
+    data = {"format_version": WATERMARK_FORMAT_VERSION, "base_dqm_eos_dir": base_dqm_eos_dir, "group_dirs": watermark}
+    write_file_atomic(watermark_file, lambda f: f.write(json.dumps(data).encode()))
 
 
 def get_formatted_meta_from_raw_input(input_file, allowed_group_directories) -> DqmMetaStore:
     """Read raw ROOT file names from input file and format them in DqmMetaStore schema and return
 
     Args:
-        input_file: file that stores raw output of find results
+        input_file: file that stores ROOT file names, one full path per line(i.e. output of find)
         allowed_group_directories: group directories from config
     """
     try:
         with open(input_file) as fin:
-            dqm_main_meta_list = [
-                get_group_meta(root_file_name, allowed_group_directories) for root_file_name in fin.readlines()
-            ]
-            # Remove None
-            dqm_main_meta_list = [item for item in dqm_main_meta_list if item is not None]
-            return DqmMetaStore(dqm_main_meta_list)
+            return DqmMetaStore.from_metas(get_group_metas(fin, allowed_group_directories))
     except Exception as e:
         logging.error(f"Cannot parse data of given input file. input file:{input_file}. Error: {str(e)}")
         raise
@@ -122,6 +320,13 @@ DQM_EOS_ROOT_RE = re.compile(
 )
 
 
+def get_group_metas(file_names: Iterable[str], allowed_group_directories) -> List[DqmMeta]:
+    """Parses and formats DQM EOS ROOT file names, and skips the ones which are not in allowed group directories"""
+    dqm_main_meta_list = [get_group_meta(file_name, allowed_group_directories) for file_name in file_names]
+    # Remove None
+    return [item for item in dqm_main_meta_list if item is not None]
+
+
 def get_group_meta(file_name, allowed_group_directories) -> Union[DqmMeta, None]:
     """Parsea and formats single DQM EOS ROOT file name
 
@@ -148,3 +353,7 @@ def get_group_meta(file_name, allowed_group_directories) -> Union[DqmMeta, None]
         )
     else:
         return None
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,16 @@ Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
 Description : DQM Metadata Store Schema
 """
 
+import json
 import logging
-from typing import List, Union, Dict
+import time
 from collections import defaultdict
-from pydantic import BaseModel, RootModel
+from typing import Dict, Iterable, List, Tuple, Union
 
-from backend.config import get_config
+import numpy as np
+from pydantic import BaseModel
 
-logging.basicConfig(level=get_config().loglevel.upper())
+from backend.config import get_config
 
 
 class DqmMeta(BaseModel):
@@ -30,27 +32,167 @@ class DqmMeta(BaseModel):
         return hash((type(self),) + tuple(self.__dict__.values()))
 
 
-class DqmMetaStore(RootModel):
-    """DQM main metadata format: list of DqmMeta"""
+class DqmMetaStoreInfo(BaseModel):
+    """Version and age of the loaded DQM Metadata Store, clients and caches can key on its version"""
+
+    version: str  # Store version, changes only when eos_grinder publishes a changed store
+    created_at: float  # Creation time of the store content in seconds since epoch
+    loaded_at: float  # Load time of the store by the API in seconds since epoch
+    age_secs: float  # Seconds since creation of the store content
+    file_count: int  # Number of DQM ROOT files in the store
+
+
+class DqmMetaStore:
+    """DQM main metadata store in columnar format
+
+    Each row is a DQM ROOT file. Run numbers are stored in a NumPy column, and era, group(eos directory) and dataset
+    are small integer codes into interned string tables. ROOT file paths are stored once in a single bytes blob with
+    their offsets. Rows are sorted by group and run, so a group is a contiguous slice of rows.
+    Columns can be in-memory arrays or arrays on top of a memory mapped snapshot, see snapshot.py.
+    DqmMeta objects are only created for the rows a query returns.
+    """
+
+    def __init__(
+        self,
+        runs: np.ndarray,
+        group_codes: np.ndarray,
+        era_codes: np.ndarray,
+        dataset_codes: np.ndarray,
+        root_file_offsets: np.ndarray,
+        root_files_blob: bytes | memoryview,
+        groups: List[str],
+        eras: List[str],
+        datasets: List[str],
+        created_ns: int = 0,
+    ):
+        """Use "from_metas" or "from_json" to create the store, rows should already be sorted by (group, run)"""
+        self.runs = runs  # Run numbers
+        self.group_codes = group_codes  # Indexes of "groups" string table
+        self.era_codes = era_codes  # Indexes of "eras" string table
+        self.dataset_codes = dataset_codes  # Indexes of "datasets" string table
+        self.root_file_offsets = root_file_offsets  # Row i ROOT file path is blob[offsets[i]:offsets[i + 1]]
+        self.root_files_blob = root_files_blob  # UTF-8 encoded ROOT file paths
+        self.groups = groups  # Interned group eos directories
+        self.eras = eras  # Interned eras
+        self.datasets = datasets  # Interned datasets
+        self.created_ns = created_ns or time.time_ns()  # Creation time of the store content
+
+        # Row slice of each group: {group code: (start, stop)}
+        group_bounds = np.searchsorted(self.group_codes, np.arange(len(self.groups) + 1))
+        self._group_slices = {c: (int(group_bounds[c]), int(group_bounds[c + 1])) for c in range(len(self.groups))}
+        # {string: code} maps of the small string tables to convert query filters to codes
+        self._group_index = {s: i for i, s in enumerate(self.groups)}
+        self._era_index = {s: i for i, s in enumerate(self.eras)}
+        # Era codes of each group: {group code: set of era codes}
+        self._group_era_codes = defaultdict(set)
+        for group_code, era_code in np.unique(np.stack([self.group_codes, self.era_codes]), axis=1).T.tolist():
+            self._group_era_codes[group_code].add(era_code)
+
+    @classmethod
+    def from_metas(cls, metas: Iterable[DqmMeta]) -> "DqmMetaStore":
+        """Creates the store from DqmMeta objects"""
+        return cls.from_rows((m.run, m.eos_directory, m.era, m.dataset, m.root_file) for m in metas)
+
+    @classmethod
+    def from_json(cls, json_data: str | bytes) -> "DqmMetaStore":
+        """Creates the store from JSON list of DqmMeta dicts, the format of "to_json" output"""
+        return cls.from_rows(
+            (int(m["run"]), m["eos_directory"], m["era"], m["dataset"], m["root_file"]) for m in json.loads(json_data)
+        )
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, str, str, str, str]]) -> "DqmMetaStore":
+        """Creates the store from (run, eos_directory, era, dataset, root_file) tuples
+
+        Strings are interned to integer codes while iterating, so no DqmMeta object is created.
+        """
+        tables = {"groups": {}, "eras": {}, "datasets": {}}  # {string: code}, code is the insertion order
+        runs, group_codes, era_codes, dataset_codes, root_files = [], [], [], [], []
+        for run, eos_directory, era, dataset, root_file in rows:
+            runs.append(run)
+            group_codes.append(tables["groups"].setdefault(eos_directory, len(tables["groups"])))
+            era_codes.append(tables["eras"].setdefault(era, len(tables["eras"])))
+            dataset_codes.append(tables["datasets"].setdefault(dataset, len(tables["datasets"])))
+            root_files.append(root_file.encode())
+
+        # Re-code the string tables in sorted order, so codes are ordered like strings
+        sorted_tables, recode = {}, {}
+        for name, table in tables.items():
+            sorted_tables[name] = sorted(table)
+            recode[name] = np.zeros(len(table), dtype=np.int32)
+            recode[name][[table[s] for s in sorted_tables[name]]] = np.arange(len(table), dtype=np.int32)
+
+        runs = np.asarray(runs, dtype=np.int64)
+        group_codes = recode["groups"][np.asarray(group_codes, dtype=np.int64)].astype(np.int32)
+        era_codes = recode["eras"][np.asarray(era_codes, dtype=np.int64)].astype(np.int32)
+        dataset_codes = recode["datasets"][np.asarray(dataset_codes, dtype=np.int64)].astype(np.int32)
+
+        # Sort rows by (group, run), stable so that the first given row of same (group, run) stays first
+        order = np.lexsort((runs, group_codes))
+        root_files = [root_files[i] for i in order.tolist()]
+        root_file_offsets = np.zeros(len(root_files) + 1, dtype=np.int64)
+        np.cumsum([len(f) for f in root_files], out=root_file_offsets[1:])
 
-    root: List[DqmMeta]
+        return cls(
+            runs=runs[order],
+            group_codes=group_codes[order],
+            era_codes=era_codes[order],
+            dataset_codes=dataset_codes[order],
+            root_file_offsets=root_file_offsets,
+            root_files_blob=b"".join(root_files),
+            groups=sorted_tables["groups"],
+            eras=sorted_tables["eras"],
+            datasets=sorted_tables["datasets"],
+        )
+
+    def to_json(self) -> str:
+        """Returns JSON list of DqmMeta dicts"""
+        return "[" + ",".join(meta.model_dump_json() for meta in self) + "]"
+
+    @property
+    def version(self) -> str:
+        """Store version, it is the hex creation time of the store content"""
+        return format(self.created_ns, "x")
+
+    def __len__(self):
+        return len(self.runs)
 
     def __iter__(self):
-        return iter(self.root)
+        return (self.get_meta(i) for i in range(len(self)))
 
     def __getitem__(self, item):
-        return self.root[item]
+        return self.get_meta(item)
+
+    def get_root_file(self, row: int) -> str:
+        """Get ROOT file path of a row from the blob"""
+        return bytes(self.root_files_blob[self.root_file_offsets[row] : self.root_file_offsets[row + 1]]).decode()
+
+    def get_meta(self, row: int) -> DqmMeta:
+        """Creates DqmMeta of a row"""
+        row = range(len(self))[row]  # supports negative index and raises IndexError
+        return DqmMeta.model_construct(
+            dataset=self.datasets[self.dataset_codes[row]],
+            eos_directory=self.groups[self.group_codes[row]],
+            era=self.eras[self.era_codes[row]],
+            root_file=self.get_root_file(row),
+            run=int(self.runs[row]),
+        )
+
+    @staticmethod
+    def _get_codes(index: Dict[str, int], values: Iterable[str]) -> np.ndarray:
+        """Get integer codes of the given strings using a string table index, unknown strings are skipped"""
+        return np.asarray([index[v] for v in values if v in index], dtype=np.int32)
 
     def get_eras_filtered(self, group_names: List[str] = ()) -> List[str]:
         """Get all available era names available for the given group names"""
         conf = get_config()
         if not group_names:  # Return all
-            return list(set([item.era for item in self.root]))
+            return list(self.eras)
         else:  # Filter by group name
             available_eos_directories = conf.get_eos_directories_of_groups(group_names=group_names)
-            return sorted(
-                list(set([item.era for item in self.root if item.eos_directory in available_eos_directories]))
-            )
+            group_codes = self._get_codes(self._group_index, available_eos_directories).tolist()
+            era_codes = set().union(*[self._group_era_codes[c] for c in group_codes])
+            return [self.eras[c] for c in sorted(era_codes)]
 
     def get_runs_era_tuples(self, limit: int, groups: List[str] = (), eras: List[str] = ()) -> Dict[int, str]:
         """Get all run:era couple with given filters. Limit is applied to RUN size of per ERA"""
@@ -67,60 +209,92 @@ class DqmMetaStore(RootModel):
 
     def get_datasets(self) -> List[str]:
         """Get all available dataset names"""
-        return list(set([m.dataset for m in self.root]))
+        return list(self.datasets)
 
     def get_groups_and_runs_of_eras(
         self, eras: List[str] = None, groups_eos_dirs: List[str] = None, runs: List[int] = None, run_limit: int = 1000
     ) -> Dict[str, Dict[int, str]]:
         """Finds runs of eras for the given eras, groups and runs, and returns |-- {group eos dir:{run: era}} --| map
 
+        Runs of each group are in descending order and each era of a group can have at most "run_limit" runs,
+        the most recent ones. Filters are applied as vectorized masks on the columns.
+
         Args:
             eras: DQM Metadata Store results filtered with given ERA list. If None, no filter
             groups_eos_dirs: DQM Metadata Store results filtered with given eos_directory list. If None, no filter
             runs: DQM Metadata Store results filtered with given RUN list. If None, no filter
             run_limit: To filter number of runs in a group's ERA result: run_era map
         """
+        mask = np.ones(len(self), dtype=bool)
+        if eras:
+            mask &= np.isin(self.era_codes, self._get_codes(self._era_index, eras))
+        if groups_eos_dirs:
+            mask &= np.isin(self.group_codes, self._get_codes(self._group_index, groups_eos_dirs))
+        if runs:
+            mask &= np.isin(self.runs, np.asarray(runs, dtype=np.int64))
+        # Same (group, run) rows are adjacent, keep only the first one
+        mask[1:] &= (self.group_codes[1:] != self.group_codes[:-1]) | (self.runs[1:] != self.runs[:-1])
+
+        rows = np.flatnonzero(mask)
+        sel_groups, sel_eras, sel_runs = self.group_codes[rows], self.era_codes[rows], self.runs[rows]
+
+        # Rank runs in each (group, era) by descending run number and keep the first "run_limit" of them
+        order = np.lexsort((-sel_runs, sel_eras, sel_groups))
+        sel_groups, sel_eras, sel_runs = sel_groups[order], sel_eras[order], sel_runs[order]
+        is_first = np.ones(len(order), dtype=bool)
+        is_first[1:] = (sel_groups[1:] != sel_groups[:-1]) | (sel_eras[1:] != sel_eras[:-1])
+        positions = np.arange(len(order))
+        ranks = positions - np.maximum.accumulate(np.where(is_first, positions, 0))
+        keep = ranks < run_limit
+        sel_groups, sel_eras, sel_runs = sel_groups[keep], sel_eras[keep], sel_runs[keep]
+
+        # Most recent run first in each group
+        result = {}
+        order = np.lexsort((-sel_runs, sel_groups))
+        for group_code, era_code, run in zip(
+            sel_groups[order].tolist(), sel_eras[order].tolist(), sel_runs[order].tolist()
+        ):
+            result.setdefault(self.groups[group_code], {})[run] = self.eras[era_code]
+
+        logging.debug(f"Group eras run counts for run limit: { {g: len(r) for g, r in result.items()} }")
+        return result
+
+    def get_new_group_runs(self, previous: Union["DqmMetaStore", None]) -> Dict[str, Dict[int, str]]:
+        """Returns |-- {group eos dir:{run: era}} --| map of the (group, run) entries which are not in the previous store
+
+        Runs of each group are in descending order. If there is no previous store, all entries are new.
+        """
         result = {}
-        group_era_run_counts = {}  # {group: {era: run count}} to limit number of runs in each era of a group
-        for item in self.root:
-            # "eras" is None or item era is in "eras" list to filter. Same for runs and groups
-            cond = (
-                ((not eras) or (item.era in eras))
-                and ((not groups_eos_dirs) or (item.eos_directory in groups_eos_dirs))
-                and ((not runs) or (item.run in runs))
-            )
-            if cond:
-                if item.eos_directory in result:
-                    # If eos directory in result, it should be in group_era_run_counts too because they are initialized together(else cond.)
-                    # If one era's run count for a group is less than max limit, allow it. Else there is nothing to do and skip it.
-                    if group_era_run_counts[item.eos_directory][item.era] < run_limit:
-                        result[item.eos_directory][item.run] = item.era
-                        # Increment the group's era run count by one
-                        group_era_run_counts[item.eos_directory][item.era] += 1
-                    else:
-                        continue
-                else:
-                    # Initialize dict(run:era) of eos_directory, it's apperaing first time since it is not in "result" dict
-                    result[item.eos_directory] = {item.run: item.era}
-                    # Set new group as deaultdict in the dict
-                    group_era_run_counts[item.eos_directory] = defaultdict(int)
-                    # Increment the group's era run count by one
-                    group_era_run_counts[item.eos_directory][item.era] += 1
-
-        logging.debug(f"Group eras run count for run limit: {group_era_run_counts}")
+        for group_code, group in enumerate(self.groups):
+            start, stop = self._group_slices[group_code]
+            runs = self.runs[start:stop]
+            if previous is not None and group in previous._group_index:
+                prev_start, prev_stop = previous._group_slices[previous._group_index[group]]
+                is_new = ~np.isin(runs, previous.runs[prev_start:prev_stop])
+            else:
+                is_new = np.ones(len(runs), dtype=bool)
+            rows = start + np.flatnonzero(is_new)
+            if len(rows):
+                # Rows are in ascending run order, same (group, run) rows keep the first one like other queries
+                result[group] = {
+                    run: self.eras[era]
+                    for run, era in reversed(list(zip(self.runs[rows].tolist(), self.era_codes[rows].tolist())))
+                }
         return result
 
     def get_max_run(self) -> int:
         """Get max run number"""
-        return max(m.run for m in self.root)
+        if not len(self):
+            raise ValueError("DQM Metadata Store is empty")
+        return int(self.runs.max())
 
     def get_meta_by_group_and_run(self, group_directory: str, run_num: int) -> Union[DqmMeta, None]:
         """Get metadata of a group and run"""
-        # For a single run+group couple there should be single ROOT file
-        try:
-            return [m for m in self.root if (m.run == run_num and m.eos_directory == group_directory)][0]
-        except Exception as e:
-            logging.warning(
-                f"No dqm meta found for the given group and run: {group_directory} - {run_num}. error:{str(e)}"
-            )
-            return None
+        # For a single run+group couple there should be single ROOT file, first one is used
+        if group_directory in self._group_index:
+            start, stop = self._group_slices[self._group_index[group_directory]]
+            row = start + int(np.searchsorted(self.runs[start:stop], run_num))
+            if row < stop and self.runs[row] == run_num:
+                return self.get_meta(row)
+        logging.warning(f"No dqm meta found for the given group and run: {group_directory} - {run_num}")
+        return None
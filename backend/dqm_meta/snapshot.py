@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Versioned binary snapshot of the DQM Metadata Store which can be memory mapped
+How         :
+- Snapshot is the columns of DqmMetaStore written as fixed-width little-endian arrays plus a string table section.
+- Layout: header | section table | sections. Each section starts at an 8 bytes aligned offset.
+    - header        : magic(8s) format_version(I) section_count(I) row_count(Q) created_ns(Q)
+    - section table : section_count x [ name(24s) offset(Q) length(Q) ]
+    - sections      : runs(<i8), group_codes(<i4), era_codes(<i4), dataset_codes(<i4), root_file_offsets(<i8),
+                      root_files_blob(bytes), strings(JSON: {"groups": [], "eras": [], "datasets": []})
+- Reader mmaps the file and creates NumPy arrays on top of the mapped memory without copying columns.
+- Writer publishes the file atomically: it writes to a temporary file in the same directory and renames it.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Callable, IO
+
+import numpy as np
+
+from .models import DqmMetaStore
+
+SNAPSHOT_MAGIC = b"DQMSNAP\0"
+SNAPSHOT_FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<8sIIQQ")
+_SECTION = struct.Struct("<24sQQ")
+_ALIGNMENT = 8
+
+# Column section names, they are same with the DqmMetaStore attribute names, and their NumPy dtypes
+_COLUMN_SECTIONS = {
+    "runs": np.dtype("<i8"),
+    "group_codes": np.dtype("<i4"),
+    "era_codes": np.dtype("<i4"),
+    "dataset_codes": np.dtype("<i4"),
+    "root_file_offsets": np.dtype("<i8"),
+}
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is not valid or has an unsupported format version"""
+
+
+def write_file_atomic(file_path: str, write_func: Callable[[IO[bytes]], None]):
+    """Writes a file using write_func to a temporary file in the same directory and renames it to file_path
+
+    Readers either see the previous file or the complete new file, never a half written one.
+    """
+    dir_name = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(file_path) + ".", suffix=".tmp", dir=dir_name)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write_func(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_snapshot(store: DqmMetaStore, file_path: str):
+    """Writes DqmMetaStore as binary snapshot atomically"""
+    strings = json.dumps({"groups": store.groups, "eras": store.eras, "datasets": store.datasets}).encode()
+    sections = [
+        (name, np.ascontiguousarray(getattr(store, name), dtype=dt).tobytes()) for name, dt in _COLUMN_SECTIONS.items()
+    ]
+    sections += [("root_files_blob", bytes(store.root_files_blob)), ("strings", strings)]
+
+    # Find aligned offsets of the sections
+    offset = _align(_HEADER.size + _SECTION.size * len(sections))
+    section_table = []
+    for name, data in sections:
+        section_table.append((name, offset, len(data)))
+        offset = _align(offset + len(data))
+
+    def _write(f: IO[bytes]):
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(sections), len(store), store.created_ns))
+        for name, sec_offset, length in section_table:
+            f.write(_SECTION.pack(name.encode(), sec_offset, length))
+        for (_, data), (_, sec_offset, _) in zip(sections, section_table):
+            f.write(b"\0" * (sec_offset - f.tell()))
+            f.write(data)
+
+    write_file_atomic(file_path, _write)
+
+
+def read_snapshot(file_path: str) -> DqmMetaStore:
+    """Memory maps the binary snapshot and returns DqmMetaStore which uses the mapped memory
+
+    Mapping stays open as long as the store columns are referenced, file can be replaced by the writer meanwhile.
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            raise SnapshotError(f"Snapshot file is too small: {file_path}")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, format_version, section_count, row_count, created_ns = _HEADER.unpack_from(mm, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError(f"Not a DQM Metadata Store snapshot: {file_path}")
+    if format_version != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format version {format_version}: {file_path}")
+
+    if _HEADER.size + section_count * _SECTION.size > mm.size():
+        raise SnapshotError(f"Snapshot section table is truncated: {file_path}")
+    sections = {}
+    for i in range(section_count):
+        name, offset, length = _SECTION.unpack_from(mm, _HEADER.size + i * _SECTION.size)
+        if offset + length > mm.size():
+            raise SnapshotError(f"Snapshot file is truncated: {file_path}")
+        sections[name.rstrip(b"\0").decode(errors="replace")] = (offset, length)
+    missing_sections = [n for n in list(_COLUMN_SECTIONS) + ["root_files_blob", "strings"] if n not in sections]
+    if missing_sections:
+        raise SnapshotError(f"Snapshot sections are missing: {missing_sections}, file: {file_path}")
+
+    columns = {}
+    for name, dt in _COLUMN_SECTIONS.items():
+        offset, length = sections[name]
+        columns[name] = np.frombuffer(mm, dtype=dt, count=length // dt.itemsize, offset=offset)
+    if len(columns["runs"]) != row_count:
+        raise SnapshotError(f"Snapshot row count does not match with its columns: {file_path}")
+
+    offset, length = sections["root_files_blob"]
+    root_files_blob = memoryview(mm)[offset : offset + length]
+    offset, length = sections["strings"]
+    try:
+        strings = json.loads(mm[offset : offset + length])
+        groups, eras, datasets = strings["groups"], strings["eras"], strings["datasets"]
+    except (ValueError, TypeError, KeyError) as e:  # JSONDecodeError is a ValueError
+        raise SnapshotError(f"Snapshot strings section is not valid: {file_path}, error: {str(e)}") from e
+
+    return DqmMetaStore(
+        **columns,
+        root_files_blob=root_files_blob,
+        groups=groups,
+        eras=eras,
+        datasets=datasets,
+        created_ns=created_ns,
+    )
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
@@ -3,17 +3,49 @@
 """
 Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
 Description : FastAPI main.py
+How         :
+- Importing the app is cheap: ROOT is imported only by the worker processes and the DQM Metadata Store is loaded in
+  background, so the startup event does not block. See backend/client/readiness.py
+- "/" is the liveness and "/ready" is the readiness endpoint, "/ready" returns 503 until the startup warmup is done.
+- "/debug/profiles" lists and downloads the profiles of /get-hists requests with the admin token, see
+  backend/client/profiling.py
+- `workers` config runs multiple uvicorn worker processes. Each one maps the same DQM Metadata Store snapshot, so the
+  store pages are shared, and starts its share of the ROOT workers. Only one of them pre-warms the histogram cache.
+  "/metrics" of any of them sums the metrics of all of them if `metrics.multiprocess_dir` is set.
 """
+
+import time
+
+PROCESS_START_TIME = time.time()  # Before the heavy imports, used in startup timing report
+
+import logging
+
 import uvicorn
-from fastapi import FastAPI, __version__ as fastapi_version
+from fastapi import FastAPI, HTTPException, Request, __version__ as fastapi_version
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 
 from backend.api_v1.routes import router
+from backend import metrics
+from backend.client import profiling
+from backend.client.cache import close_hist_cache, get_hist_cache
+from backend.client.engine import get_engine, shutdown_engine
+from backend.client.prewarm import start_prewarmer, stop_prewarmer
+from backend.client.readiness import get_startup_report, start_warmup, stop_warmup
 from backend.config import get_config
+from backend.dqm_meta.client import (
+    get_dqm_store_info,
+    get_grinder_stats,
+    start_dqm_store_refresher,
+    stop_dqm_store_refresher,
+)
 
 # Get config as object
 CONFIG = get_config()
-print(CONFIG.model_dump())
+logging.basicConfig(level=CONFIG.loglevel.upper())
+logging.debug(f"Config: {CONFIG.model_dump()}")
+metrics.enable_multiprocess(CONFIG.metrics.multiprocess_dir)
 
 # Production: https://fastapi.tiangolo.com/advanced/path-operation-advanced-configuration/
 app = FastAPI(title="FastAPI")
@@ -23,28 +55,208 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Dqm-Store-Version", "X-Dqm-Store-Age", "X-Profile"],
 )
+# Histogram JSONs compress well. Streamed responses set their own Content-Encoding and are passed as is
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 # Add router
 app.include_router(router=router, prefix=CONFIG.api_v1_prefix, tags=["v1"])
 
 
+@app.on_event("startup")
+async def startup():
+    # ROOT worker processes, DQM Metadata Store and a warmup read are started in background, "/ready" waits them
+    start_warmup(process_start_time=PROCESS_START_TIME)
+    # New runs found by the store refresher are read into the histogram cache in background
+    start_prewarmer()
+    # DQM Metadata Store is loaded and refreshed in background, off the request path
+    start_dqm_store_refresher(CONFIG)
+    # Samples of this process are written for the scrapes of the other uvicorn workers
+    metrics.start_flusher(CONFIG.metrics.flush_secs)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    stop_warmup()
+    stop_dqm_store_refresher()
+    stop_prewarmer()
+    shutdown_engine()
+    metrics.stop_flusher()
+    close_hist_cache()
+
+
+@app.middleware("http")
+async def observe_request_duration(request: Request, call_next):
+    """Observes request duration, endpoint label is the route path, so path parameters do not create new labels"""
+    start_time = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.observe(
+        "ppd_http_request_seconds",
+        time.perf_counter() - start_time,
+        endpoint=route.path if route else "unmatched",
+        method=request.method,
+        status=response.status_code,
+    )
+    return response
+
+
+@app.middleware("http")
+async def add_store_version_headers(request: Request, call_next):
+    """Adds DQM Metadata Store version and age headers, so clients and caches can key on them"""
+    response = await call_next(request)
+    store_info = get_dqm_store_info()
+    if store_info is not None:
+        response.headers["X-Dqm-Store-Version"] = store_info.version
+        response.headers["X-Dqm-Store-Age"] = str(int(store_info.age_secs))
+    return response
+
+
 @app.get("/")
 async def health():
+    """Liveness: ok as soon as the app serves requests"""
     return "ok"
 
 
+@app.get("/ready")
+async def ready():
+    """Readiness: 503 until ROOT workers, DQM Metadata Store and the warmup read are ready, returns startup timings"""
+    report = get_startup_report()
+    return JSONResponse(status_code=200 if report.ready else 503, content=report.model_dump())
+
+
+def collect_process_metrics() -> list:
+    """Collects the metrics of this process: histogram cache hits and misses, startup and ROOT workers
+
+    They are summed over the uvicorn workers in multiprocess mode, see backend/metrics.py
+    """
+    collected = []
+    cache = get_hist_cache()
+    if cache is not None:
+        # Counters of this process, cache.stats() is not called: it queries the shared cache, see collect_metrics
+        labels = {"backend": cache.name}
+        collected += [
+            ("ppd_hist_cache_hits_total", "counter", "Histogram cache hits", [(labels, cache.hits)]),
+            ("ppd_hist_cache_misses_total", "counter", "Histogram cache misses", [(labels, cache.misses)]),
+        ]
+    report = get_startup_report()
+    collected.append(("ppd_ready", "gauge", "API processes whose startup warmup is done", [({}, int(report.ready))]))
+    if report.ready:
+        collected.append(
+            ("ppd_worker_pool_size", "gauge", "ROOT workers of the API processes", [({}, get_engine().size)])
+        )
+    return collected
+
+
+metrics.set_process_collector(collect_process_metrics)
+
+
+def collect_metrics() -> list:
+    """Collects gauges of the histogram cache, DQM Metadata Store and EOS grinder, they are same for all processes"""
+    collected = []
+    cache = get_hist_cache()
+    if cache is not None:
+        stats = cache.stats()
+        labels = {"backend": stats.backend}
+        collected.append(
+            ("ppd_hist_cache_entries", "gauge", "Entries in the histogram cache", [(labels, stats.entries)])
+        )
+        if stats.size_bytes is not None:
+            collected.append(
+                ("ppd_hist_cache_size_bytes", "gauge", "Histogram cache size", [(labels, stats.size_bytes)])
+            )
+    store_info = get_dqm_store_info()
+    if store_info is not None:
+        collected += [
+            (
+                "ppd_dqm_store_age_seconds",
+                "gauge",
+                "Age of the loaded DQM Metadata Store",
+                [({}, store_info.age_secs)],
+            ),
+            ("ppd_dqm_store_files", "gauge", "ROOT files in the DQM Metadata Store", [({}, store_info.file_count)]),
+        ]
+    grinder_stats = get_grinder_stats(CONFIG)
+    if grinder_stats is not None:
+        collected += [
+            (
+                "ppd_grinder_last_duration_seconds",
+                "gauge",
+                "Duration of the last EOS grinder run",
+                [({"full_rebuild": str(grinder_stats["full_rebuild"]).lower()}, grinder_stats["duration_secs"])],
+            ),
+            (
+                "ppd_grinder_last_stage_seconds",
+                "gauge",
+                "Stage durations of the last EOS grinder run",
+                [({"stage": stage}, secs) for stage, secs in grinder_stats["stages"].items()],
+            ),
+            (
+                "ppd_grinder_last_files",
+                "gauge",
+                "ROOT files found by the last EOS grinder run",
+                [({}, grinder_stats["files"])],
+            ),
+            (
+                "ppd_grinder_last_finished_timestamp_seconds",
+                "gauge",
+                "Finish time of the last EOS grinder run",
+                [({}, grinder_stats["finished_at"])],
+            ),
+        ]
+    return collected
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics: request stage latencies of the API and its ROOT workers, and gauges
+
+    They are of all uvicorn workers if `metrics.multiprocess_dir` is set, otherwise of the process which gets the
+    scrape. It is not async: process files, grinder stats and cache size are read in the threadpool, not in the loop
+    """
+    return PlainTextResponse(metrics.render(collect_metrics()), media_type="text/plain; version=0.0.4")
+
+
+def check_profiling_admin(request: Request):
+    """Raises 404 if profiling is disabled and 403 if the request does not have the admin token"""
+    if not CONFIG.profiling.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not profiling.is_admin_token(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling admin token is required")
+
+
+@app.get("/debug/profiles")
+async def list_profiles(request: Request):
+    """Admin: infos of the written request profiles, newest first. Profiles are local to the pod"""
+    check_profiling_admin(request)
+    return profiling.list_profiles()
+
+
+@app.get("/debug/profiles/{name}")
+async def get_profile(request: Request, name: str):
+    """Admin: downloads a profile: pstats dump(.prof) or collapsed stacks(.collapsed) for flamegraphs"""
+    check_profiling_admin(request)
+    file_path = profiling.get_profile_path(name)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail=f"Profile is not found: {name}")
+    return FileResponse(file_path, media_type="application/octet-stream", filename=name)
+
+
 @app.get("/version")
 async def version():
     return fastapi_version
 
 
 if __name__ == "__main__":
+    if CONFIG.metrics.multiprocess_dir:
+        metrics.clear_multiprocess_dir(CONFIG.metrics.multiprocess_dir)
     uvicorn.run(
         "main:app",
         host=CONFIG.host,
         port=CONFIG.port,
         log_level=CONFIG.loglevel,
+        workers=CONFIG.workers,
         # reload=True if CONFIG.environment == "dev" else False,
         reload=False,
     )
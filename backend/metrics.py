@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Latency metrics of the request stages in Prometheus text format
+How         :
+- Metrics are declared in METRICS, histograms and counters are kept in a process local registry.
+- Stages are timed with `timer(name, **labels)` in the API process and in the ROOT worker processes. A worker sends
+  its registry delta with each task result and the API process merges it, see engine.py. So /metrics of the API
+  process has the stages of its workers too.
+- Gauges and counters of other components(cache size, DQM Metadata Store age, EOS grinder stats) are collected at
+  scrape time and given to render. Per-process ones(cache hits, readiness) are collected by the process collector.
+- Multiprocess mode, like prometheus_client's: each uvicorn worker writes its samples and its process collector's
+  samples to its own file in a shared directory, at each scrape and every `metrics.flush_secs`. "/metrics" of any
+  worker sums the files, so it covers all workers of the pod. Counters and histograms of exited processes are kept,
+  so they never decrease, gauges are only of the live ones. The directory is emptied before the workers start.
+"""
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Upper bounds of the histogram buckets in seconds: from a cached lookup to a hung EOS FUSE read
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# {name: (type, help, label names)}
+METRICS = {
+    "ppd_stage_seconds": (
+        "histogram",
+        "Duration of a stage of histogram requests, group is empty for the stages which are not per group",
+        ("stage", "group"),
+    ),
+    "ppd_http_request_seconds": (
+        "histogram",
+        "Duration of HTTP requests until the response headers, streamed bodies are not included",
+        ("endpoint", "method", "status"),
+    ),
+    "ppd_worker_task_seconds": ("histogram", "Duration of ROOT worker tasks in the API process", ("task",)),
+    "ppd_worker_restarts_total": ("counter", "Number of ROOT workers replaced because of crash or timeout", ()),
+    "ppd_coalesced_total": (
+        "counter",
+        "Reads and overlays which waited a concurrent identical one(read, overlay) or joined a batch of the same file",
+        ("kind",),
+    ),
+}
+
+__SAMPLES = {}  # {(name, label values): [bucket counts..., sum, count] of histogram or [value] of counter}
+__SAMPLES_LOCK = threading.Lock()
+__PROCESS_COLLECTOR = None  # Returns the per-process collected metrics, they are summed over processes
+__MULTIPROCESS_DIR = None  # Shared directory of the per-process sample files, None in single process mode
+__FLUSHER_STOP = threading.Event()
+__FLUSHER_THREAD = None  # Writes the process file periodically in multiprocess mode
+
+Collected = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]  # (name, type, help, [(labels, value)])
+PROCESS_FILE_PREFIX = "metrics_"
+
+
+def _label_values(name: str, labels: Dict[str, str]) -> tuple:
+    return tuple(str(labels.get(label, "")) for label in METRICS[name][2])
+
+
+def _new_sample(name: str) -> list:
+    return [0] * (len(BUCKETS) + 2) if METRICS[name][0] == "histogram" else [0]
+
+
+def observe(name: str, value: float, **labels):
+    """Adds the value to the histogram"""
+    key = (name, _label_values(name, labels))
+    with __SAMPLES_LOCK:
+        sample = __SAMPLES.setdefault(key, _new_sample(name))
+        for i, upper_bound in enumerate(BUCKETS):
+            if value <= upper_bound:
+                sample[i] += 1
+        sample[-2] += value
+        sample[-1] += 1
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Increments the counter"""
+    key = (name, _label_values(name, labels))
+    with __SAMPLES_LOCK:
+        __SAMPLES.setdefault(key, _new_sample(name))[0] += value
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """Observes the duration of the block to the histogram, it is observed if the block raises too"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start_time, **labels)
+
+
+def stage_timer(stage: str, group: str = ""):
+    """Times a stage of histogram requests: ppd_stage_seconds"""
+    return timer("ppd_stage_seconds", stage=stage, group=group)
+
+
+def take_delta() -> Dict[tuple, list]:
+    """Returns the samples which are collected since the last call and resets them, used by the worker processes"""
+    global __SAMPLES
+    with __SAMPLES_LOCK:
+        delta, __SAMPLES = __SAMPLES, {}
+    return delta
+
+
+def merge(delta: Dict[tuple, list]):
+    """Adds the samples of a worker process delta"""
+    with __SAMPLES_LOCK:
+        for key, values in delta.items():
+            sample = __SAMPLES.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                sample[i] += value
+
+
+def set_process_collector(collector: Callable[[], List[Collected]] | None):
+    """Sets the function which collects the per-process gauges and counters, i.e. cache hits of the process"""
+    global __PROCESS_COLLECTOR
+    __PROCESS_COLLECTOR = collector
+
+
+def _collect_process() -> List[Collected]:
+    return __PROCESS_COLLECTOR() if __PROCESS_COLLECTOR else []
+
+
+def enable_multiprocess(directory: str | None):
+    """Sets the shared directory of the uvicorn workers' sample files, None disables multiprocess mode"""
+    global __MULTIPROCESS_DIR
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    __MULTIPROCESS_DIR = directory or None
+
+
+def clear_multiprocess_dir(directory: str):
+    """Deletes sample files of the previous server run, it is called before uvicorn workers start"""
+    for file_path in glob.glob(os.path.join(directory, PROCESS_FILE_PREFIX + "*.json")):
+        os.remove(file_path)
+
+
+def write_process_file():
+    """Writes the samples and the process collector's samples of this process to its file in multiprocess mode"""
+    if __MULTIPROCESS_DIR is None:
+        return
+    with __SAMPLES_LOCK:
+        samples = [[name, list(label_values), list(values)] for (name, label_values), values in __SAMPLES.items()]
+    content = json.dumps({"samples": samples, "collected": _collect_process()})
+    file_path = os.path.join(__MULTIPROCESS_DIR, f"{PROCESS_FILE_PREFIX}{os.getpid()}.json")
+    # Written to a temporary file and renamed, so a scrape of another worker never reads a partial file
+    with open(file_path + ".tmp", "w") as f:
+        f.write(content)
+    os.replace(file_path + ".tmp", file_path)
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_process_files() -> Tuple[Dict[tuple, list], List[Collected]]:
+    """Returns the samples and the process collected metrics summed over the process files"""
+    samples, collected = {}, {}  # collected: {(name, type, help): {labels tuple: value}}
+    for file_path in glob.glob(os.path.join(__MULTIPROCESS_DIR, PROCESS_FILE_PREFIX + "*.json")):
+        pid = int(os.path.basename(file_path)[len(PROCESS_FILE_PREFIX) : -len(".json")])
+        try:
+            with open(file_path) as f:
+                content = json.load(f)
+        except (OSError, ValueError) as e:  # Deleted by the cleanup of a new server run
+            logging.debug(f"Cannot read metrics file {file_path}: {str(e)}")
+            continue
+        for name, label_values, values in content["samples"]:
+            if name not in METRICS:  # Written by another version of the app
+                continue
+            sample = samples.setdefault((name, tuple(label_values)), [0] * len(values))
+            for i, value in enumerate(values):
+                sample[i] += value
+        is_alive = _is_process_alive(pid)
+        for name, metric_type, help_text, process_samples in content["collected"]:
+            metric_samples = collected.setdefault((name, metric_type, help_text), {})
+            if metric_type == "gauge" and not is_alive:
+                continue
+            for labels, value in process_samples:
+                key = tuple(labels.items())
+                metric_samples[key] = metric_samples.get(key, 0) + value
+    return samples, [
+        (name, metric_type, help_text, [(dict(labels), value) for labels, value in sorted(metric_samples.items())])
+        for (name, metric_type, help_text), metric_samples in collected.items()
+    ]
+
+
+def _flush_loop(interval_secs: float):
+    while not __FLUSHER_STOP.wait(interval_secs):
+        try:
+            write_process_file()
+        except Exception as e:
+            logging.warning(f"Cannot write metrics file: {str(e)}")
+
+
+def start_flusher(interval_secs: float):
+    """Starts the thread which writes the process file periodically in multiprocess mode"""
+    global __FLUSHER_THREAD
+    if __MULTIPROCESS_DIR is None or (__FLUSHER_THREAD and __FLUSHER_THREAD.is_alive()):
+        return
+    __FLUSHER_STOP.clear()
+    __FLUSHER_THREAD = threading.Thread(target=_flush_loop, args=(interval_secs,), name="metrics_flusher", daemon=True)
+    __FLUSHER_THREAD.start()
+
+
+def stop_flusher():
+    """Stops the flusher thread and writes the last samples of the process"""
+    __FLUSHER_STOP.set()
+    if __FLUSHER_THREAD:
+        __FLUSHER_THREAD.join(timeout=5)
+    write_process_file()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + text + "}" if text else ""
+
+
+def render(collected: List[Collected] = ()) -> str:
+    """Returns all metrics, the process collector's and the collected ones in Prometheus text exposition format
+
+    In multiprocess mode, samples and the process collector's metrics are summed over all processes' files
+    """
+    if __MULTIPROCESS_DIR is not None:
+        write_process_file()  # This process is up to date, others are at most flush_secs old
+        samples, process_collected = _read_process_files()
+    else:
+        with __SAMPLES_LOCK:
+            samples = {key: list(values) for key, values in __SAMPLES.items()}
+        process_collected = _collect_process()
+    collected = list(process_collected) + list(collected)
+    lines = []
+    for name, (metric_type, help_text, label_names) in METRICS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for (sample_name, label_values), values in sorted(samples.items()):
+            if sample_name != name:
+                continue
+            if metric_type == "counter":
+                lines.append(f"{name}{_format_labels(label_names, label_values)} {values[0]}")
+                continue
+            for upper_bound, count in zip(BUCKETS + ("+Inf",), values[: len(BUCKETS)] + [values[-1]]):
+                labels = _format_labels(label_names + ("le",), label_values + (str(upper_bound),))
+                lines.append(f"{name}_bucket{labels} {count}")
+            labels = _format_labels(label_names, label_values)
+            lines += [f"{name}_sum{labels} {values[-2]}", f"{name}_count{labels} {values[-1]}"]
+    for name, metric_type, help_text, collected_samples in collected:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+        for labels, value in collected_samples:
+            lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {value}")
+    return "\n".join(lines) + "\n"
@@ -42,16 +42,16 @@ echo "Cron PID:${pid}"
 backend/kerberos.sh "$keytab"
 
 # Add daily kerberos ticket update cron job to crontab
-# Add hourly eos grinder cron job to crontab
+# Add incremental eos grinder cron job to crontab, it runs in every 10 minutes
 export >/etc/environment
 (
     crontab -l 2>/dev/null
     echo "00 3 * * * . /etc/environment; $WDIR/backend/kerberos.sh /etc/secrets/keytab >>/proc/$(cat /var/run/crond.pid)/fd/1 2>&1"
-    echo "00 * * * * . /etc/environment; python -c 'from backend.dqm_meta.eos_grinder import run; run()' >>/proc/$(cat /var/run/crond.pid)/fd/1 2>&1"
+    echo "*/10 * * * * . /etc/environment; python -m backend.dqm_meta.eos_grinder >>/proc/$(cat /var/run/crond.pid)/fd/1 2>&1"
 ) | crontab -
 
-# Initialize metadata: Run DQM EOS grinder to fetch and format DQM EOS metadata befor start backend service
-python -c 'from backend.dqm_meta.eos_grinder import run; run()'
+# Initialize metadata: Run DQM EOS grinder full rebuild to fetch and format DQM EOS metadata befor start backend service
+python -m backend.dqm_meta.eos_grinder --full
 
 # START FastAPI
 echo "Successful initializaion, starting FastAPI..."
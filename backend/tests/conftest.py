@@ -9,24 +9,38 @@ from typing import Any, Generator, List
 from datetime import datetime
 
 
-from ROOT import TFile, TH1F
 import pytest
 from fastapi.testclient import TestClient
 
+from backend.benchmarks.synthetic import create_root_file_hists
 from backend.main import app
-from backend.config import get_config, Config, ConfigPlotsGroup
+from backend.config import get_config, Config
+from backend.dqm_meta import eos_grinder
+from backend.dqm_meta.client import get_dqm_store, refresh_dqm_store
+from backend.dqm_meta.models import DqmMetaStore
 
 
 @pytest.fixture(scope="session")
-def config_test() -> Generator[Config, Any, None]:
+def config_test(tmp_path_factory) -> Generator[Config, Any, None]:
     """Create modified Config for test"""
     conf = get_config()
     conf.dqm_meta_store.base_dqm_eos_dir = "backend/tests/DQMGUI_data"
+    # DQM Metadata Store files of the test data
+    meta_dir = tmp_path_factory.mktemp("dqm_meta")
+    conf.dqm_meta_store.meta_store_json_file = str(meta_dir / "DQM_META.json")
+    conf.dqm_meta_store.meta_store_snapshot_file = str(meta_dir / "DQM_META.snapshot")
+    conf.dqm_meta_store.grinder_watermark_file = str(meta_dir / "DQM_META.watermark.json")
+    conf.dqm_meta_store.grinder_stats_file = str(meta_dir / "DQM_META.grinder_stats.json")
+    conf.root_workers.pool_size = 2
+    conf.prewarm.enabled = False  # Tests use their own Prewarmer
+    conf.startup.warmup_read = False  # Keeps histogram cache counts of the tests deterministic
+    conf.startup.retry_secs = 0.1  # Store is created after the app starts
+    conf.hist_cache.file = str(tmp_path_factory.mktemp("hist_cache") / "HIST_CACHE.sqlite")
     yield conf
 
 
 @pytest.fixture(scope="session")
-def fast_api_client_test() -> Generator[TestClient, Any, None]:
+def fast_api_client_test(config_test) -> Generator[TestClient, Any, None]:
     """Create a new FastAPI TestClient"""
     with TestClient(app) as client:
         yield client
@@ -66,7 +80,7 @@ def create_histograms_for_test(config_test) -> List[str]:
                 root_f = run_xx_dir / root_file_fmt.format(
                     run9d=str(run).zfill(9), eosdir=group_conf.eos_directory, era=era
                 )
-                util_create_root_hist(root_file=str(root_f), group_conf=group_conf, run=run)
+                create_root_file_hists(root_file=str(root_f), group_conf=group_conf, run=run)
                 all_created_files.append(root_f)
             first_run += era_run_jump  # to change run_xx directory which depends on last 2 digit of the run number
 
@@ -75,26 +89,9 @@ def create_histograms_for_test(config_test) -> List[str]:
     # shutil.rmtree(base_directory.parent)  # DQMGUI_data is parent
 
 
-def util_create_root_hist(root_file: str, group_conf: ConfigPlotsGroup, run: int):
-    """Creates test histograms in th root file with the definitions in plots.yaml config only for TH1F"""
-    tdirectory = group_conf.tdirectory.format(run_num_int=run)
-
-    # PYROOT's limited functionality force to create directory only once
-    plot_dirs = set([tdirectory + "/" + p.name for p in group_conf.plots])
-    for dir_str in plot_dirs:
-        with TFile(root_file, "UPDATE") as tf:
-            for dir in dir_str.split("/")[:-1]:
-                if not tf.Get(dir):  # If subdir is not created before
-                    subdir = tf.mkdir(dir)
-                    tf.cd(dir)
-
-    for dir_str in plot_dirs:
-        dir = "".join(dir_str.split("/")[:-1])  # before last
-        name = dir_str.split("/")[-1]  # last
-        with TFile(root_file, "UPDATE") as tf:
-            tf.cd(dir)
-            h = TH1F(name, name, 64, -4, 4)
-            h.FillRandom("gaus")
-            tf.WriteObject(h, "myHist")
-            tf.Save()
-            del h
+@pytest.fixture(scope="session")
+def dqm_store_test(config_test, create_histograms_for_test) -> DqmMetaStore:
+    """Run EOS grinder on the test histograms and load its DQM Metadata Store"""
+    eos_grinder.run(full_rebuild=True)
+    refresh_dqm_store(config=config_test)
+    yield get_dqm_store(config=config_test)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Histogram cache tests
+"""
+import socketserver
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend.client.cache import RespCache, SqliteCache
+
+
+class RespStandInHandler(socketserver.StreamRequestHandler):
+    """Stand-in Redis protocol server which supports GET, SET, DBSIZE commands of RespCache"""
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            cmd = args[0].upper()
+            if cmd == b"GET":
+                value = store.get(args[1])
+                self.wfile.write(b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value))
+            elif cmd == b"SET":
+                store[args[1]] = args[2]
+                self.wfile.write(b"+OK\r\n")
+            elif cmd == b"DBSIZE":
+                self.wfile.write(b":%d\r\n" % len(store))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def resp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), RespStandInHandler)
+    server.daemon_threads = True
+    server.store = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_sqlite_cache_lru_eviction(tmp_path):
+    cache = SqliteCache(file_path=str(tmp_path / "cache.sqlite"), max_bytes=30)
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)
+    cache.put("c", b"c" * 10)
+    assert cache.get("a") == b"a" * 10  # "b" is the least recently used now
+
+    cache.put("d", b"d" * 10)
+    assert cache.get("b") is None
+    assert [cache.get(k) is not None for k in "acd"] == [True, True, True]
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries, stats.size_bytes) == (4, 1, 3, 30)
+
+    cache.put("e", b"e" * 31)  # larger than the cache
+    assert cache.get("e") is None
+    cache.close()
+
+
+def test_sqlite_cache_warm_start(tmp_path):
+    cache = SqliteCache(file_path=str(tmp_path / "cache.sqlite"), max_bytes=100)
+    cache.put("a", b"value")
+    cache.close()
+
+    cache = SqliteCache(file_path=str(tmp_path / "cache.sqlite"), max_bytes=100)
+    assert cache.stats().entries == 1 and cache.stats().size_bytes == 5
+    assert cache.get("a") == b"value"
+    cache.close()
+
+
+def test_sqlite_cache_shared_by_processes(tmp_path):
+    # Two caches on the same file behave like two worker processes of a pod
+    cache_1 = SqliteCache(file_path=str(tmp_path / "cache.sqlite"), max_bytes=25)
+    cache_2 = SqliteCache(file_path=str(tmp_path / "cache.sqlite"), max_bytes=25)
+    cache_1.put("a", b"a" * 10)
+    assert cache_2.get("a") == b"a" * 10
+
+    cache_2.put("b", b"b" * 10)
+    cache_1.put("c", b"c" * 10)  # evicts "a", size is shared
+    assert cache_2.get("a") is None
+    assert cache_1.stats().size_bytes == cache_2.stats().size_bytes == 20
+    cache_1.close()
+    cache_2.close()
+
+
+def test_resp_cache(resp_server):
+    host, port = resp_server.server_address
+    cache_1 = RespCache(url=f"redis://{host}:{port}")
+    cache_2 = RespCache(url=f"redis://{host}:{port}")
+    assert cache_1.get("a") is None
+    cache_1.put("a", b"\x00binary\r\nvalue")
+    assert cache_2.get("a") == b"\x00binary\r\nvalue"
+    assert list(resp_server.store) == [b"ppd:hist:a"]
+
+    stats = cache_1.stats()
+    assert (stats.backend, stats.hits, stats.misses, stats.entries) == ("resp", 0, 1, 1)
+
+    # Dispatch threads count concurrently, no hit is lost
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: cache_2.get("a"), range(200)))
+    assert cache_2.stats().hits == 201
+    cache_1.close()
+    cache_2.close()
+
+
+def test_resp_cache_server_down(resp_server):
+    host, port = resp_server.server_address
+    cache = RespCache(url=f"redis://{host}:{port}", socket_timeout_secs=0.5)
+    cache.put("a", b"value")
+    resp_server.shutdown()
+    resp_server.server_close()
+    cache.close()  # Closes the connection, reconnect fails
+
+    # Errors are misses, requests fall back to ROOT file reads
+    assert cache.get("a") is None
+    cache.put("b", b"value")
+    assert cache.misses == 1
+
+
+def test_sqlite_cache_errors(tmp_path):
+    # Hits do not write, their access times are written with the next put
+    file_path = str(tmp_path / "cache.sqlite")
+    cache = SqliteCache(file_path=file_path, max_bytes=100)
+    cache.put("a", b"value")
+    reader = sqlite3.connect(file_path)
+
+    def get_last_access() -> float:
+        return reader.execute("SELECT last_access FROM cache WHERE key = 'a'").fetchone()[0]
+
+    put_time = get_last_access()
+    time.sleep(0.01)
+    assert cache.get("a") == b"value"
+    assert get_last_access() == put_time
+    cache.put("b", b"value")
+    assert get_last_access() > put_time
+    reader.close()
+
+    # Locked or broken database: get is a miss and put is skipped, they do not raise
+    cache.close()
+    assert cache.get("a") is None
+    cache.put("c", b"value")
+    assert cache.misses == 1
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries, stats.size_bytes) == (1, 1, 0, None)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Single-flight coalescing and same file batching tests
+"""
+
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from backend import metrics
+from backend.client import histograms
+from backend.client.coalesce import ReadBatcher, SingleFlight, then
+
+
+def get_coalesced_count(kind: str) -> int:
+    match = re.search(rf'^ppd_coalesced_total{{kind="{kind}"}} (\S+)$', metrics.render(), re.MULTILINE)
+    return int(float(match.group(1))) if match else 0
+
+
+def test_single_flight():
+    flights, calls = SingleFlight("test"), []
+    release_event = threading.Event()
+
+    def slow_read(value):
+        calls.append(value)
+        release_event.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # Followers get the shared future without holding a thread
+        futures = [flights.submit("key", lambda: executor.submit(slow_read, 21)) for _ in range(5)]
+        assert len(set(map(id, futures))) == 1 and not futures[0].done()
+        release_event.set()
+        assert [f.result() for f in futures] == [42] * 5
+        assert calls == [21]
+        # Done calls are not kept
+        assert flights.submit("key", lambda: executor.submit(slow_read, 1)).result() == 2
+        assert calls == [21, 1]
+
+        def failing_read():
+            time.sleep(0.3)
+            raise ValueError("cannot read")
+
+        futures = [flights.submit("key", lambda: executor.submit(failing_read)) for _ in range(3)]
+        for future in futures:
+            with pytest.raises(ValueError, match="cannot read"):
+                future.result()
+
+
+def test_then():
+    future = Future()
+    doubled = then(future, lambda value: value * 2)
+    future.set_result(21)
+    assert doubled.result(timeout=0) == 42
+
+    failed = then(doubled, lambda _: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        failed.result(timeout=0)
+    with pytest.raises(ZeroDivisionError):
+        then(failed, lambda value: value).result(timeout=0)
+
+
+def test_read_batcher():
+    batcher, batches = ReadBatcher("test"), []
+
+    def read_batch(items):
+        batches.append(sorted(items))
+        return {item: item.upper() for item in items}
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # The window is a timer, callers return immediately with the future of their batch
+        start_time = time.time()
+        futures = [batcher.submit("file", item, read_batch, 0.2, executor.submit) for item in "abc"]
+        assert time.time() - start_time < 0.2 and not futures[0].done()
+        assert [f.result()[item] for f, item in zip(futures, "abc")] == ["A", "B", "C"]
+        assert batches == [["a", "b", "c"]]
+
+        assert batcher.submit("file", "d", read_batch, 0, executor.submit).result() == {"d": "D"}
+        assert batches[-1] == ["d"]
+
+
+def test_single_plot_reads_are_batched(config_test, dqm_store_test):
+    # Concurrent single plot reads of the same ROOT file are read by one task, each one gets only its plot
+    group_conf = config_test.plots.groups[1]
+    run_era_map = histograms.get_groups_run_era_maps(groups=[group_conf.group_name], runs=[100201])[0][1]
+    [dqm_meta] = histograms.get_group_dqm_metas(group_conf, run_era_map)
+    plot_group_confs = [
+        histograms.get_single_plot_group_config(group_conf.group_name, p.name) for p in group_conf.plots[:3]
+    ]
+    start_event, batched_count = threading.Event(), get_coalesced_count("batch")
+
+    def read(plot_group_conf):
+        start_event.wait()
+        return histograms.read_group_plots_of_one_run(plot_group_conf, dqm_meta)
+
+    with ThreadPoolExecutor(max_workers=len(plot_group_confs)) as executor:
+        futures = [executor.submit(read, c) for c in plot_group_confs]
+        start_event.set()
+        results = [f.result() for f in futures]
+    assert [list(r) for r in results] == [[c.plots[0].name] for c in plot_group_confs]
+    assert get_coalesced_count("batch") == batched_count + 2
@@ -37,3 +37,174 @@
 
 #     assert store_client.get_last_run() == test_data_last_run_in_DQMGUI_data
 #     assert store_client.get_last_run_root_files() == test_data_last_run_root_files
+
+import os
+
+import pytest
+
+from backend.benchmarks.synthetic import get_synthetic_root_file_names, get_synthetic_runs
+from backend.config import get_config
+from backend.dqm_meta.client import get_dqm_store, get_dqm_store_info, refresh_dqm_store
+from backend.dqm_meta.eos_grinder import get_group_dir_watermark, get_group_meta, get_incremental_meta
+from backend.dqm_meta.models import DqmMetaStore
+from backend.dqm_meta import client as dqm_client, snapshot
+from backend.dqm_meta.snapshot import SnapshotError, read_snapshot, write_snapshot
+
+test_eos_file_fmt = (
+    "/eos/DQMGUI_data/Run2023/{eosdir}/{block}/DQM_V0001_R{run9d}__{eosdir}__{era}-TEST-DATASET__DQMIO.root"
+)
+
+
+def util_create_dqm_meta_store() -> DqmMetaStore:
+    """Creates a DqmMetaStore with 2 groups, 2 eras per group and 3 runs per era in `find | sort -nr` order"""
+    file_names = []
+    for eosdir, first_run in [("JetMET1", 100000), ("Muon1", 100001)]:
+        for era, era_first_run in [("Run2023A", first_run), ("Run2023B", first_run + 100)]:
+            for run in range(era_first_run, era_first_run + 6, 2):
+                file_names.append(
+                    test_eos_file_fmt.format(
+                        eosdir=eosdir, block=f"{str(run // 100)}xx".zfill(9), run9d=str(run).zfill(9), era=era
+                    )
+                )
+    metas = [get_group_meta(f, ["JetMET1", "Muon1"]) for f in sorted(file_names, reverse=True)]
+    return DqmMetaStore.from_metas(metas)
+
+
+def test_dqm_meta_store_indexes():
+    store = util_create_dqm_meta_store()
+    assert store.get_max_run() == 100105
+    assert store.get_eras_filtered() == ["Run2023A", "Run2023B"]
+
+    meta = store.get_meta_by_group_and_run(group_directory="Muon1", run_num=100003)
+    assert (meta.eos_directory, meta.run, meta.era) == ("Muon1", 100003, "Run2023A")
+    assert store.get_meta_by_group_and_run(group_directory="Muon1", run_num=100002) is None
+
+    result = store.get_groups_and_runs_of_eras(eras=["Run2023B"], groups_eos_dirs=["JetMET1"], run_limit=2)
+    assert result == {"JetMET1": {100104: "Run2023B", 100102: "Run2023B"}}
+    assert list(result["JetMET1"]) == [100104, 100102]  # most recent run first
+
+    result = store.get_groups_and_runs_of_eras(runs=[100000, 100105])
+    assert result == {"JetMET1": {100000: "Run2023A"}, "Muon1": {100105: "Run2023B"}}
+
+    # Loading from JSON builds the same store
+    store_from_json = DqmMetaStore.from_json(store.to_json())
+    assert store_from_json.get_groups_and_runs_of_eras() == store.get_groups_and_runs_of_eras()
+    assert list(store_from_json) == list(store)
+    assert len(store) == 12 and store[-1].root_file.endswith("__DQMIO.root")
+
+
+def test_dqm_meta_store_snapshot(tmp_path):
+    store = util_create_dqm_meta_store()
+    snapshot_file = str(tmp_path / "DQM_META.snapshot")
+    write_snapshot(store, snapshot_file)
+
+    store_from_snapshot = read_snapshot(snapshot_file)
+    assert store_from_snapshot.created_ns == store.created_ns
+    assert list(store_from_snapshot) == list(store)
+    assert store_from_snapshot.get_groups_and_runs_of_eras(run_limit=1) == store.get_groups_and_runs_of_eras(
+        run_limit=1
+    )
+    assert os.listdir(tmp_path) == ["DQM_META.snapshot"]  # no temporary file is left
+
+    (tmp_path / "not_snapshot").write_bytes(b"x" * 100)
+    with pytest.raises(SnapshotError):
+        read_snapshot(str(tmp_path / "not_snapshot"))
+
+    # Old or partially written snapshot which does not have all sections
+    data = bytearray((tmp_path / "DQM_META.snapshot").read_bytes())
+    header = list(snapshot._HEADER.unpack_from(data, 0))
+    header[2] -= 1  # section count, last section "strings" is missing
+    snapshot._HEADER.pack_into(data, 0, *header)
+    (tmp_path / "missing_section").write_bytes(bytes(data))
+    with pytest.raises(SnapshotError, match="strings"):
+        read_snapshot(str(tmp_path / "missing_section"))
+
+    # Corrupt section count, the section table is beyond the end of the file
+    header[2] = 2**20
+    snapshot._HEADER.pack_into(data, 0, *header)
+    (tmp_path / "truncated_section_table").write_bytes(bytes(data))
+    with pytest.raises(SnapshotError, match="section table"):
+        read_snapshot(str(tmp_path / "truncated_section_table"))
+
+    # Damaged strings section
+    data = bytearray((tmp_path / "DQM_META.snapshot").read_bytes())
+    data[-1:] = b"\xff"
+    (tmp_path / "damaged_strings").write_bytes(bytes(data))
+    with pytest.raises(SnapshotError, match="strings"):
+        read_snapshot(str(tmp_path / "damaged_strings"))
+
+
+def test_eos_grinder_incremental(tmp_path):
+    def create_root_file(run: int):
+        block_dir = tmp_path / "Run2023" / "JetMET1" / f"{str(run // 100)}xx".zfill(9)
+        block_dir.mkdir(parents=True, exist_ok=True)
+        (block_dir / f"DQM_V0001_R{str(run).zfill(9)}__JetMET1__Run2023A-TEST-DATASET__DQMIO.root").touch()
+
+    group_dir = str(tmp_path / "Run2023" / "JetMET1")
+    create_root_file(100000)
+    create_root_file(100001)
+    store, watermark = get_incremental_meta(DqmMetaStore.from_rows([]), {}, [group_dir], "*DQMIO.root", ["JetMET1"])
+    assert store.runs.tolist() == [100000, 100001]
+    assert watermark[group_dir]["blocks"].keys() == {"0001000xx"}
+
+    # Nothing changed, nothing is rescanned
+    assert get_group_dir_watermark(group_dir, watermark[group_dir]) == (watermark[group_dir], [])
+
+    # New run block directory
+    create_root_file(100100)
+    new_group_watermark, changed_blocks = get_group_dir_watermark(group_dir, watermark[group_dir])
+    assert changed_blocks == ["0001001xx"]
+    store, watermark = get_incremental_meta(store, watermark, [group_dir], "*DQMIO.root", ["JetMET1"])
+    assert store.runs.tolist() == [100000, 100001, 100100]
+    assert watermark[group_dir] == new_group_watermark
+
+    # Groups which are not scanned anymore are dropped
+    store, _ = get_incremental_meta(store, watermark, [], "*DQMIO.root", ["JetMET1"])
+    assert len(store) == 0
+
+
+@pytest.fixture
+def restore_dqm_store():
+    """Restores the loaded DQM Metadata Store of the client after a test swaps it"""
+    names = ("__METADATA_CACHE", "__CACHE_UPDATE_TIME", "__CACHE_FILE_IDENTITY")
+    saved = {name: getattr(dqm_client, name) for name in names}
+    yield
+    for name, value in saved.items():
+        setattr(dqm_client, name, value)
+
+
+def test_dqm_store_client_refresh(tmp_path, restore_dqm_store):
+    conf = get_config().model_copy(deep=True)
+    conf.dqm_meta_store.meta_store_snapshot_file = str(tmp_path / "DQM_META.snapshot")
+    write_snapshot(util_create_dqm_meta_store(), conf.dqm_meta_store.meta_store_snapshot_file)
+
+    refresh_dqm_store(conf)
+    version = get_dqm_store_info().version
+    assert refresh_dqm_store(conf) is False  # file is not changed
+    assert get_dqm_store(conf).version == version
+
+    # New snapshot is swapped in with a new version
+    write_snapshot(DqmMetaStore.from_rows([]), conf.dqm_meta_store.meta_store_snapshot_file)
+    assert refresh_dqm_store(conf) is True
+    assert get_dqm_store_info().version != version
+    assert len(get_dqm_store(conf)) == 0
+
+
+def test_synthetic_root_file_names():
+    # Benchmark data: file names are distributed to groups, years and eras, and all of them are parsed by the grinder
+    group_confs = get_config().plots.groups
+    file_names = get_synthetic_root_file_names(
+        base_dir="/eos/DQMGUI_data", group_confs=group_confs, years=[2023, 2024], eras_per_year=3, file_count=600
+    )
+    store = DqmMetaStore.from_metas(get_group_meta(f, [g.eos_directory for g in group_confs]) for f in file_names)
+    assert len(store) == len(file_names) >= 600
+    assert sorted(store.eras) == [f"Run{y}{e}" for y in (2023, 2024) for e in "ABC"]
+    assert sorted(store.groups) == sorted(g.eos_directory for g in group_confs)
+
+
+def test_synthetic_runs_do_not_overlap():
+    # Eras with more runs than a run block directory start after the previous era's runs
+    runs = get_synthetic_runs(years=[2023, 2024], eras_per_year=3, runs_per_era=1852)
+    assert [run for _, _, run in runs] == sorted({run for _, _, run in runs})
+    assert len(runs) == 2 * 3 * 1852
+    assert all(run % 100 == 0 for _, _, run in runs[::1852])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : ROOT worker pool tests
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend.client.engine import RootWorkerPool, TaskError, WorkerError, get_pool_size_per_process
+from backend.client.profiling import ProfileSession, current_session
+
+
+@pytest.fixture(scope="module")
+def worker_pool() -> RootWorkerPool:
+    pool = RootWorkerPool(size=1, task_timeout_secs=10)
+    yield pool
+    pool.shutdown()
+
+
+def test_worker_pool_runs_tasks_in_worker(worker_pool):
+    worker_pid = worker_pool.run("os:getpid")
+    assert worker_pid != os.getpid()
+    assert worker_pool.run("math:sqrt", 16) == 4
+
+    with pytest.raises(TaskError, match="ValueError"):
+        worker_pool.run("math:sqrt", -1)
+    assert worker_pool.run("os:getpid") == worker_pid  # task errors do not replace the worker
+
+
+def test_worker_pool_replaces_failed_workers(worker_pool):
+    worker_pid = worker_pool.run("os:getpid")
+    restart_count = worker_pool.restart_count
+
+    with pytest.raises(WorkerError, match="TimeoutError"):
+        worker_pool.run("time:sleep", 5, timeout=0.5)
+    with pytest.raises(WorkerError, match="EOFError"):
+        worker_pool.run("os:_exit", 1)  # crash
+
+    assert worker_pool.restart_count == restart_count + 2
+    new_worker_pid = worker_pool.run("os:getpid")
+    assert new_worker_pid not in (worker_pid, os.getpid())
+
+
+def test_worker_pool_inline():
+    assert RootWorkerPool(size=0, task_timeout_secs=10).run("os:getpid") == os.getpid()
+
+
+def test_worker_pool_concurrency():
+    pool = RootWorkerPool(size=2, task_timeout_secs=10)
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            start_time = time.time()
+            list(executor.map(lambda _: pool.run("time:sleep", 1), range(2)))
+            assert time.time() - start_time < 1.8  # two tasks run at the same time
+    finally:
+        pool.shutdown()
+
+
+def test_worker_pool_in_each_worker():
+    pool = RootWorkerPool(size=2, task_timeout_secs=10)
+    try:
+        assert len(set(pool.run_in_each_worker("os:getpid"))) == 2
+    finally:
+        pool.shutdown()
+
+
+def test_pool_size_per_process():
+    # Pod's pool size is divided between uvicorn workers
+    assert get_pool_size_per_process(pool_size=4, process_count=2) == 2
+    assert get_pool_size_per_process(pool_size=4, process_count=8) == 1
+    assert get_pool_size_per_process(pool_size=0, process_count=2) == 0
+
+
+def test_worker_pool_profiles_session_tasks(worker_pool):
+    # Tasks of a profiled request are profiled in the worker and merged into the request's profile
+    session = ProfileSession("cprofile").start()
+    assert session.run(worker_pool.run, "math:factorial", 5) == 120
+    assert any("factorial" in func_name for _, _, func_name in session.stop())
+
+    session = ProfileSession("sampling").start()
+    session.run(worker_pool.run, "time:sleep", 0.2)
+    stacks = session.stop()
+    assert any(stack.startswith("root_worker:MainThread;") for stack in stacks)
+    assert any(stack.startswith("api:MainThread;") for stack in stacks)
+
+    worker_pool.run("math:sqrt", 4)  # Not profiled out of the session
+    assert current_session() is None
+
+
+def test_worker_pool_does_not_lose_workers():
+    pool = RootWorkerPool(size=1, task_timeout_secs=10, acquire_timeout_secs=0.5)
+    try:
+        # Arguments which cannot be pickled fail the task, the worker stays idle
+        with pytest.raises(TaskError, match="cannot be sent"):
+            pool.run("os:getpid", lambda: None)
+        worker_pid = pool.run("os:getpid")
+
+        # All workers are busy
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(pool.run, "time:sleep", 2)
+            time.sleep(0.2)
+            with pytest.raises(WorkerError, match="No idle ROOT worker"):
+                pool.run("os:getpid")
+            with pytest.raises(WorkerError, match="No idle ROOT worker"):
+                pool.run_in_each_worker("os:getpid")
+            future.result()
+        assert pool.run_in_each_worker("os:getpid") == [worker_pid]
+
+        # Replacement cannot be started, it is started with the next task
+        def fail_start_worker():
+            raise OSError("cannot fork")
+
+        start_worker, pool._start_worker = pool._start_worker, fail_start_worker
+        with pytest.raises(WorkerError, match="EOFError"):
+            pool.run("os:_exit", 1)
+        pool._start_worker = start_worker
+        assert pool.run("os:getpid") not in (worker_pid, os.getpid())
+    finally:
+        pool.shutdown()
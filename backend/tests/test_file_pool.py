@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : File handle pool tests
+"""
+
+import threading
+import time
+
+import pytest
+
+from backend.client.file_pool import FileHandlePool
+from backend.client.pyroot import get_file_pool
+
+
+def util_create_files(tmp_path, count: int):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"file_{i}"
+        path.write_bytes(b"x" * (i + 1))
+        paths.append(str(path))
+    return paths
+
+
+def test_file_pool_reuse_and_lru(tmp_path):
+    closed = []
+    pool = FileHandlePool(opener=lambda p: open(p, "rb"), closer=closed.append, max_handles=2, idle_timeout_secs=60)
+    path_0, path_1, path_2 = util_create_files(tmp_path, 3)
+
+    with pool.open(path_0) as f:
+        first_handle = f
+    with pool.open(path_0) as f:
+        assert f is first_handle
+    assert (pool.open_count, pool.reuse_count) == (1, 1)
+
+    with pool.open(path_1):
+        pass
+    with pool.open(path_0):  # path_1 is the least recently used now
+        pass
+    with pool.open(path_2):
+        pass
+    assert len(pool) == 2 and [f.name for f in closed] == [path_1]
+
+    pool.close_all()
+    assert len(pool) == 0 and len(closed) == 3
+
+
+def test_file_pool_invalidation(tmp_path):
+    closed = []
+    pool = FileHandlePool(opener=lambda p: open(p, "rb"), closer=closed.append, max_handles=2, idle_timeout_secs=60)
+    path, other_path = util_create_files(tmp_path, 2)
+    with pool.open(path) as f:
+        first_handle = f
+
+    # Rewritten file is opened again
+    with open(path, "wb") as f:
+        f.write(b"new content")
+    with pool.open(path) as f:
+        assert f is not first_handle and f.read() == b"new content"
+    assert closed == [first_handle]
+
+    # Idle handles are closed
+    pool.idle_timeout_secs = 0
+    time.sleep(0.01)
+    with pool.open(other_path):
+        pass
+    assert len(closed) == 2
+
+    with pytest.raises(OSError):
+        with pool.open(str(tmp_path / "not_exist")):
+            pass
+
+
+def test_file_pool_reaper(tmp_path):
+    # Idle handles are closed without a later open, the reaper exits when the pool is empty
+    closed = []
+    pool = FileHandlePool(
+        opener=lambda p: open(p, "rb"),
+        closer=closed.append,
+        max_handles=2,
+        idle_timeout_secs=0.05,
+        reap_interval_secs=0.02,
+    )
+    (path,) = util_create_files(tmp_path, 1)
+    with pool.open(path) as f:
+        time.sleep(0.2)  # A handle in use is not closed
+        assert closed == []
+    reaper = pool._reaper
+    reaper.join(timeout=5)
+    assert not reaper.is_alive() and closed == [f] and len(pool) == 0
+
+    with pool.open(path):
+        pass
+    assert pool._reaper is not None and pool._reaper is not reaper
+
+
+def test_file_pool_handle_lock(tmp_path):
+    pool = FileHandlePool(
+        opener=lambda p: open(p, "rb"), closer=lambda f: f.close(), max_handles=2, idle_timeout_secs=60
+    )
+    (path,) = util_create_files(tmp_path, 1)
+    users, max_users = [0], [0]
+
+    def use_handle():
+        with pool.open(path):
+            users[0] += 1
+            max_users[0] = max(max_users[0], users[0])
+            time.sleep(0.01)
+            users[0] -= 1
+
+    threads = [threading.Thread(target=use_handle) for _ in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert max_users[0] == 1 and pool.open_count == 1 and pool.reuse_count == 7
+
+
+def test_root_file_pool(tmp_path, create_histograms_for_test):
+    root_file = str(create_histograms_for_test[0])
+    pool = get_file_pool()
+    with pool.open(root_file) as tf:
+        first_tf = tf
+        assert tf.IsOpen()
+    with pool.open(root_file) as tf:
+        assert tf is first_tf
+
+    (not_root_file,) = util_create_files(tmp_path, 1)
+    with pytest.raises(OSError):
+        with pool.open(not_root_file):
+            pass
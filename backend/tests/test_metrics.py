@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Stage latency metrics and /metrics endpoint tests
+"""
+
+import os
+import subprocess
+import sys
+
+from backend import metrics
+
+
+def test_metrics_worker_delta():
+    # A worker's delta is taken and reset, and it is added to the API process samples
+    delta = metrics.take_delta()
+    metrics.observe("ppd_stage_seconds", 0.002, stage="test_stage", group='a "b"')
+    metrics.observe("ppd_stage_seconds", 2, stage="test_stage", group='a "b"')
+    worker_delta = metrics.take_delta()
+    metrics.merge(delta)
+    metrics.merge(worker_delta)
+
+    text = metrics.render([("ppd_test", "gauge", "Test gauge", [({"x": "1"}, 3)])])
+    labels = 'stage="test_stage",group="a \\"b\\""'
+    assert f'ppd_stage_seconds_bucket{{{labels},le="0.005"}} 1' in text
+    assert f'ppd_stage_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"ppd_stage_seconds_sum{{{labels}}} 2.002" in text
+    assert f"ppd_stage_seconds_count{{{labels}}} 2" in text
+    assert '# TYPE ppd_test gauge\nppd_test{x="1"} 3\n' in text
+
+
+def test_metrics_endpoint(fast_api_client_test, config_test, dqm_store_test):
+    group_conf = config_test.plots.groups[1]
+    response = fast_api_client_test.post(
+        config_test.api_v1_prefix + "/get-hists", json={"groups": [group_conf.group_name], "runs": [100100, 100101]}
+    )
+    assert response.status_code == 200
+
+    response = fast_api_client_test.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    # Stages of the ROOT workers are merged into the API process
+    assert f'ppd_stage_seconds_count{{stage="get",group="{group_conf.group_name}"}}' in text
+    assert f'ppd_stage_seconds_count{{stage="overlay",group="{group_conf.group_name}"}}' in text
+    assert 'ppd_stage_seconds_count{stage="metadata_lookup",group=""}' in text
+    assert 'ppd_stage_seconds_count{stage="response_encode",group=""}' in text
+    endpoint = config_test.api_v1_prefix + "/get-hists"
+    assert f'ppd_http_request_seconds_count{{endpoint="{endpoint}",method="POST",status="200"}}' in text
+    assert 'ppd_worker_task_seconds_count{task="util_overlay_group_hists"}' in text
+    # Gauges
+    assert "ppd_hist_cache_entries{" in text
+    assert "ppd_dqm_store_files " in text
+    assert "ppd_grinder_last_files " in text
+
+
+def test_metrics_multiprocess(fast_api_client_test, tmp_path):
+    # An exited uvicorn worker's samples are in the shared directory, its gauges are not summed
+    code = (
+        "from backend import metrics;"
+        f"metrics.enable_multiprocess({str(tmp_path)!r});"
+        "metrics.set_process_collector(lambda: [('ppd_ready', 'gauge', 'Ready', [({}, 1)])]);"
+        "metrics.inc('ppd_coalesced_total', 2, kind='test_multiprocess');"
+        "metrics.observe('ppd_worker_task_seconds', 0.5, task='test_multiprocess');"
+        "metrics.write_process_file()"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+    text = fast_api_client_test.get("/metrics").text
+    assert 'ppd_coalesced_total{kind="test_multiprocess"}' not in text
+
+    metrics.inc("ppd_coalesced_total", kind="test_multiprocess")
+    metrics.enable_multiprocess(str(tmp_path))
+    try:
+        text = fast_api_client_test.get("/metrics").text
+        assert os.path.exists(tmp_path / f"metrics_{os.getpid()}.json")
+    finally:
+        metrics.enable_multiprocess(None)
+    assert 'ppd_coalesced_total{kind="test_multiprocess"} 3' in text
+    assert 'ppd_worker_task_seconds_count{task="test_multiprocess"} 1' in text
+    # Gauge of the exited process is not summed
+    assert "\nppd_ready 2\n" not in text and "\nppd_ready " in text
+
+    metrics.clear_multiprocess_dir(str(tmp_path))
+    assert not os.listdir(tmp_path)
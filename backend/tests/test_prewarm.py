@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Histogram cache pre-warming tests
+"""
+
+import pytest
+
+from backend.client import histograms
+from backend.client.cache import get_hist_cache
+from backend.client.leader import LeaderLock
+from backend.client.prewarm import Prewarmer
+from backend.dqm_meta.models import DqmMetaStore
+
+LAST_ERA_FIRST_RUN = 100400
+
+
+@pytest.fixture
+def run_tasks(monkeypatch):
+    """Records the reads and overlays of the pre-warm tasks in their run order"""
+    tasks = []
+    read_group_plots_of_one_run = histograms.read_group_plots_of_one_run
+    get_group_histograms = histograms.get_group_histograms
+
+    def read(group_conf, dqm_meta):
+        tasks.append(("read", group_conf.eos_directory, dqm_meta.run))
+        return read_group_plots_of_one_run(group_conf, dqm_meta)
+
+    def overlay(group_conf, run_era_map):
+        tasks.append(("overlay", group_conf.eos_directory, *sorted(set(run_era_map.values()))))
+        return get_group_histograms(group_conf=group_conf, run_era_map=run_era_map)
+
+    monkeypatch.setattr(histograms, "read_group_plots_of_one_run", read)
+    monkeypatch.setattr(histograms, "get_group_histograms", overlay)
+    return tasks
+
+
+def test_prewarm_new_runs(config_test, dqm_store_test, run_tasks):
+    # Previous store does not have the last era's runs
+    previous_store = DqmMetaStore.from_metas([m for m in dqm_store_test if m.run < LAST_ERA_FIRST_RUN])
+    new_group_runs = dqm_store_test.get_new_group_runs(previous_store)
+    group_dirs = [g.eos_directory for g in config_test.plots.groups]
+    assert sorted(new_group_runs) == sorted(group_dirs)
+    assert all(list(runs) == [100402, 100401, 100400] for runs in new_group_runs.values())
+
+    prewarmer = Prewarmer(max_tasks_per_sec=1000, max_queue_size=1000, max_era_run_size=2)
+    prewarmer.on_store_swapped(previous_store, dqm_store_test)
+    # 2 latest runs are read and their era overlay is built for each group
+    assert len(prewarmer) == len(group_dirs) * 3
+
+    entries = get_hist_cache().stats().entries
+    while prewarmer.run_next(timeout=0):
+        pass
+    assert (prewarmer.done_count, prewarmer.failed_count) == (len(group_dirs) * 3, 0)
+    # Newest run first, era overlay after the reads of its newest run
+    era = dqm_store_test.get_meta_by_group_and_run(group_directory=group_dirs[0], run_num=100402).era
+    assert run_tasks == (
+        [("read", d, 100402) for d in sorted(group_dirs)]
+        + [("overlay", d, era) for d in sorted(group_dirs)]
+        + [("read", d, 100401) for d in sorted(group_dirs)]
+    )
+    # Plot JSONs and histogram objects of 2 runs, and overlays of each group
+    overlay_count = sum(len(g.plots) for g in config_test.plots.groups)
+    assert get_hist_cache().stats().entries == entries + len(group_dirs) * 2 * 2 + overlay_count
+
+
+def test_prewarm_queue_limit(config_test, dqm_store_test, run_tasks):
+    prewarmer = Prewarmer(max_tasks_per_sec=1000, max_queue_size=2, max_era_run_size=5)
+    group_dir = config_test.plots.groups[0].eos_directory
+    era = dqm_store_test.get_meta_by_group_and_run(group_directory=group_dir, run_num=100402).era
+    prewarmer.put_group_runs({group_dir: {100402: era, 100401: era, 100400: era}})
+    prewarmer.put_group_runs({group_dir: {100402: era}})  # already queued
+    assert len(prewarmer) == 2 and prewarmer.dropped_count == 2
+
+    # Oldest run tasks are dropped
+    while prewarmer.run_next(timeout=0):
+        pass
+    assert run_tasks == [("read", group_dir, 100402), ("overlay", group_dir, era)]
+
+
+def test_prewarm_only_leader(config_test, dqm_store_test, tmp_path):
+    lock_file = str(tmp_path / "PREWARM.lock")
+    leader = Prewarmer(
+        max_tasks_per_sec=1000, max_queue_size=1000, max_era_run_size=1, leader_lock=LeaderLock(lock_file)
+    )
+    follower = Prewarmer(
+        max_tasks_per_sec=1000, max_queue_size=1000, max_era_run_size=1, leader_lock=LeaderLock(lock_file)
+    )
+    assert leader.try_lead() and not follower.try_lead()
+    leader.on_store_swapped(None, dqm_store_test)
+    follower.on_store_swapped(None, dqm_store_test)
+    assert len(leader) > 0 and len(follower) == 0
+
+    # Follower takes the leadership over and queues the latest runs of the current store
+    leader.leader_lock.release()
+    assert follower.try_lead()
+    assert len(follower) == len(leader)
+    follower.leader_lock.release()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : On-demand request profiling tests
+"""
+
+import pstats
+import threading
+
+import pytest
+
+from backend.client import profiling
+
+ADMIN_TOKEN = "test-admin-token"
+
+
+@pytest.fixture
+def profiling_test(config_test, tmp_path, monkeypatch):
+    """Enables profiling with the test admin token and a temporary output directory"""
+    monkeypatch.setattr(config_test.profiling, "enabled", True)
+    monkeypatch.setattr(config_test.profiling, "admin_token", ADMIN_TOKEN)
+    monkeypatch.setattr(config_test.profiling, "output_dir", str(tmp_path))
+    yield config_test.profiling
+
+
+def test_profile_session_bind():
+    # Functions bound in a session are profiled in other threads too, they are not bound out of a session
+    result = []
+
+    def work():
+        thread = threading.Thread(target=profiling.bind(lambda: result.append(sum(range(1000)))))
+        thread.start()
+        thread.join()
+
+    session = profiling.ProfileSession("cprofile").start()
+    session.run(work)
+    func_names = {func_name for _, _, func_name in session.stop()}
+    assert "work" in func_names and "<lambda>" in func_names
+    assert result == [499500]
+    assert profiling.bind(work) is work
+
+
+def test_profile_get_hists(fast_api_client_test, config_test, dqm_store_test, profiling_test, monkeypatch):
+    url = config_test.api_v1_prefix + "/get-hists"
+    req = {"groups": [config_test.plots.groups[0].group_name], "runs": [100000, 100002]}
+
+    response = fast_api_client_test.post(url, json=req, headers={"X-Profile-Token": "wrong"})
+    assert response.status_code == 200
+    assert "X-Profile" not in response.headers
+    assert fast_api_client_test.get("/debug/profiles").status_code == 403
+
+    response = fast_api_client_test.post(url, json=req, headers={"X-Profile-Token": ADMIN_TOKEN})
+    assert response.status_code == 200
+    profile_name = response.headers["X-Profile"]
+    assert profile_name.endswith("on_demand.prof")
+    stats = pstats.Stats(str(profiling.get_profile_path(profile_name)))
+    assert any(func_name == "_build_hists_response" for _, _, func_name in stats.stats)
+
+    # Sampling mode profiles 1 in N requests
+    monkeypatch.setattr(profiling_test, "mode", "sampling")
+    monkeypatch.setattr(profiling_test, "sample_every_n", 1)
+    response = fast_api_client_test.post(url, json=req)
+    sampled_name = response.headers["X-Profile"]
+    assert sampled_name.endswith("sampled.collapsed")
+
+    # Admin token is accepted only in the header
+    assert fast_api_client_test.get("/debug/profiles", params={"profile": ADMIN_TOKEN}).status_code == 403
+    response = fast_api_client_test.get("/debug/profiles", headers={"X-Profile-Token": ADMIN_TOKEN})
+    assert response.status_code == 200
+    infos = response.json()
+    assert [i["name"] for i in infos] == [sampled_name, profile_name]
+    assert infos[1]["trigger"] == "on_demand" and req["groups"][0] in infos[1]["request"]
+
+    response = fast_api_client_test.get(f"/debug/profiles/{sampled_name}", headers={"X-Profile-Token": ADMIN_TOKEN})
+    assert response.status_code == 200
+    for line in response.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert stack.startswith(("api:", "root_worker:")) and int(count) > 0
+    response = fast_api_client_test.get("/debug/profiles/..%2Fconfig.py", headers={"X-Profile-Token": ADMIN_TOKEN})
+    assert response.status_code == 404
+
+
+def test_profile_disabled(fast_api_client_test, config_test):
+    assert config_test.profiling.enabled is False
+    assert fast_api_client_test.get("/debug/profiles").status_code == 404
+
+
+def test_delete_old_profiles(profiling_test, monkeypatch):
+    monkeypatch.setattr(profiling_test, "max_files", 2)
+    names = [profiling.write_profile("cprofile", {}, "on_demand", "test", 0.1) for _ in range(3)]
+    assert [i.name for i in profiling.list_profiles()] == names[:0:-1]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : ROOT file reader backends tests: uproot reader gives the same histograms with pyroot reader
+"""
+
+import base64
+import json
+import zlib
+
+import numpy as np
+import pytest
+from ROOT import TH1D, TObjString, TProfile
+
+from backend.client import pyroot, uproot_reader
+from backend.client.readers import get_reader_task
+
+
+def test_uproot_reader_same_with_pyroot(config_test, dqm_store_test):
+    group_conf = config_test.plots.groups[0]
+    dqm_meta = dqm_store_test.get_meta_by_group_and_run(group_conf.eos_directory, 100000)
+
+    for hist_format in ("json", "compact"):
+        pyroot_plots = pyroot.util_read_group_plots_of_one_run_from_root_file(group_conf, dqm_meta, hist_format)
+        uproot_plots = uproot_reader.util_read_group_plots_of_one_run_from_root_file(group_conf, dqm_meta, hist_format)
+        assert list(uproot_plots) == list(pyroot_plots) == [p.name for p in group_conf.plots]
+        for name in pyroot_plots:
+            pyroot_plot, uproot_plot = pyroot_plots[name], uproot_plots[name]
+            assert uproot_plot.model_dump(exclude={"data"}) == pyroot_plot.model_dump(exclude={"data"})
+            pyroot_data, uproot_data = json.loads(pyroot_plot.data), json.loads(uproot_plot.data)
+            if hist_format == "compact":
+                assert uproot_data == pyroot_data
+            else:
+                assert set(uproot_data) == set(pyroot_data)
+                for member in ("_typename", "fName", "fTitle", "fEntries", "fTsumw", "fArray", "fSumw2", "fNcells"):
+                    assert uproot_data[member] == pyroot_data[member]
+
+
+def test_uproot_reader_skips_unknown_class(config_test, dqm_store_test, monkeypatch):
+    # A histogram class without a draw option is skipped, the other plots are still read
+    group_conf = config_test.plots.groups[0]
+    dqm_meta = dqm_store_test.get_meta_by_group_and_run(group_conf.eos_directory, 100000)
+    monkeypatch.delitem(config_test.plots.draw_options, "TH1F")
+    assert uproot_reader.util_read_group_plots_of_one_run_from_root_file(group_conf, dqm_meta) is None
+
+
+def test_readers_same_error_rule(config_test, dqm_store_test, tmp_path):
+    # A missing histogram is skipped by both readers, a file which cannot be opened raises OSError in both
+    group_conf = config_test.plots.groups[0]
+    dqm_meta = dqm_store_test.get_meta_by_group_and_run(group_conf.eos_directory, 100000)
+    missing_plot = group_conf.plots[0].model_copy(update={"name": "NotInTheFile/h_missing"})
+    group_conf_with_missing = group_conf.model_copy(update={"plots": [missing_plot] + group_conf.plots})
+    not_root_file = tmp_path / "not_root.root"
+    not_root_file.write_bytes(b"not a ROOT file")
+
+    for reader in (pyroot, uproot_reader):
+        plots = reader.util_read_group_plots_of_one_run_from_root_file(group_conf_with_missing, dqm_meta)
+        assert list(plots) == [p.name for p in group_conf.plots]
+        missing_group_conf = group_conf.model_copy(update={"plots": [missing_plot]})
+        assert reader.util_read_group_plots_of_one_run_from_root_file(missing_group_conf, dqm_meta) is None
+        for root_file in (str(tmp_path / "no_such_file.root"), str(not_root_file)):
+            with pytest.raises(OSError):
+                reader.util_read_group_plots_of_one_run_from_root_file(
+                    group_conf, dqm_meta.model_copy(update={"root_file": root_file})
+                )
+
+
+def test_dump_load_hist():
+    th1d, tprofile = TH1D("h_dump_th1d", "TH1D", 10, 0, 1), TProfile("h_dump_tprofile", "TProfile", 10, 0, 1)
+    th1d.Fill(0.35, 0.1)
+    tprofile.Fill(0.35, 2.5)
+    for hist in (th1d, tprofile):
+        loaded = pyroot.util_load_hist(pyroot.util_dump_hist(hist))
+        assert (loaded.ClassName(), loaded.GetName()) == (hist.ClassName(), hist.GetName())
+        assert [loaded.GetBinContent(i) for i in range(12)] == [hist.GetBinContent(i) for i in range(12)]
+        assert loaded.GetEntries() == hist.GetEntries()
+
+    with pytest.raises(ValueError):
+        pyroot.util_load_hist(pyroot.util_dump_hist(TObjString("not a histogram")))
+
+
+def test_compact_keeps_double_precision():
+    th1d = TH1D("h_compact_th1d", "TH1D", 10, 0, 1)
+    th1d.Fill(0.35, 0.1)
+    th1d.Fill(0.35, 1e-9)
+    compact = json.loads(pyroot.util_hist_to_compact_json(th1d))
+    assert compact["dtypes"] == {"contents": "f8", "sumw2": "f8"}
+    contents = np.frombuffer(zlib.decompress(base64.b64decode(compact["contents"])), dtype="<f8")
+    assert contents[4] == th1d.GetBinContent(4) == 0.1 + 1e-9
+
+
+def test_reader_task(config_test, monkeypatch):
+    assert get_reader_task("init_worker") == "backend.client.pyroot:init_worker"
+    monkeypatch.setattr(config_test.root_workers, "reader", "uproot")
+    assert get_reader_task("init_worker") == "backend.client.uproot_reader:init_worker"
+
+
+def test_get_hists_with_uproot_reader(fast_api_client_test, config_test, dqm_store_test, monkeypatch):
+    url = config_test.api_v1_prefix
+    req = {"groups": [config_test.plots.groups[0].group_name], "runs": [100101], "hist_format": "compact"}
+    pyroot_groups = fast_api_client_test.post(url + "/get-hists", json=req).json()["groups_data"]
+
+    monkeypatch.setattr(config_test.root_workers, "reader", "uproot")
+    stats = fast_api_client_test.get(url + "/get-cache-stats").json()
+    uproot_groups = fast_api_client_test.post(url + "/get-hists", json=req).json()["groups_data"]
+    # Each reader has its own cache entries
+    assert fast_api_client_test.get(url + "/get-cache-stats").json()["misses"] == stats["misses"] + 1
+    assert uproot_groups == pyroot_groups
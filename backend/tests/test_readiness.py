@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
+Description : Startup warmup and readiness tests
+"""
+
+import subprocess
+import sys
+import time
+
+from backend.client import readiness
+from backend.client.engine import get_engine
+
+
+def test_import_does_not_load_root():
+    # Importing the app should not import ROOT nor load the DQM Metadata Store
+    code = "import sys, backend.main; print('ROOT' in sys.modules, 'uproot' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip().splitlines()[-1] == "False False"
+
+
+def test_ready(fast_api_client_test, dqm_store_test):
+    assert fast_api_client_test.get("/").json() == "ok"
+    # Warmup waits the store which is created after the app start
+    deadline = time.time() + 60
+    response = fast_api_client_test.get("/ready")
+    while response.status_code == 503 and time.time() < deadline:
+        time.sleep(0.1)
+        response = fast_api_client_test.get("/ready")
+    assert response.status_code == 200
+    report = response.json()
+    assert report["ready"] and report["error"] is None
+    assert list(report["steps"]) == ["import", "engine", "workers", "dqm_store"]
+    assert report["total_secs"] >= sum(report["steps"].values()) - report["steps"]["import"]
+
+
+def test_warmup(config_test, dqm_store_test):
+    assert get_engine().run_in_each_worker(readiness.PING_TASK) == [True] * config_test.root_workers.pool_size
+    # Latest run of the first group
+    assert readiness.warmup_read() == f"{config_test.plots.groups[0].group_name}:100402"
+
+
+def test_warmup_retries_failed_step(config_test, dqm_store_test, monkeypatch):
+    # A failed step is retried with backoff until it succeeds, its error is reported meanwhile
+    errors = []
+
+    def warmup_workers():
+        if len(errors) < 2:
+            errors.append(report.error)
+            raise OSError("cannot start worker")
+
+    monkeypatch.setattr(readiness, "warmup_workers", warmup_workers)
+    report = readiness.StartupReport()
+    getattr(readiness, "__warmup")(report, time.time())
+    assert errors == [None, "workers failed: cannot start worker"]
+    assert report.ready and report.error is None
+    assert list(report.steps) == ["engine", "workers", "dqm_store"]
@@ -5,8 +5,18 @@ Author      : Ceyhun Uzunoglu <ceyhunuzngl AT gmail [DOT] com>
 Description : FastAPI tests
 """
 
+import base64
+import json
+import os
+import zlib
+from concurrent.futures import Future
+
+import numpy as np
 from fastapi import __version__
 
+from backend.client import histograms, utils
+from backend.client.utils import get_overlay_styles
+
 
 def test_version(fast_api_client_test):
     response = fast_api_client_test.get("/version")
@@ -18,3 +28,246 @@ def test_version(fast_api_client_test):
 def test_mock_histograms_len(create_histograms_for_test):
     # with 3 runs per era and 5 eras in total, 1 plot for each
     assert len(create_histograms_for_test) % (5 * 3) == 0
+
+
+def test_get_hists(fast_api_client_test, config_test, dqm_store_test):
+    url = config_test.api_v1_prefix + "/get-hists"
+    group_conf = config_test.plots.groups[0]
+
+    # One run: raw histograms which are read in the ROOT workers
+    response = fast_api_client_test.post(url, json={"groups": [group_conf.group_name], "runs": [100000]})
+    assert response.status_code == 200
+    plots = response.json()["groups_data"][0]["plots"]
+    assert [p["conf_name"] for p in plots] == [p.name for p in group_conf.plots]
+    assert all(p["type"] == "TH1F" and p["run"] == 100000 and p["data"] for p in plots)
+
+    # Multiple runs: overlaid histograms
+    response = fast_api_client_test.post(url, json={"groups": [group_conf.group_name], "runs": [100000, 100001]})
+    assert response.status_code == 200
+    plots = response.json()["groups_data"][0]["plots"]
+    assert len(plots) == len(group_conf.plots)
+    assert all(p["type"] == "THStack" and p["data"] for p in plots)
+
+
+def test_get_hists_of_all_groups(fast_api_client_test, config_test, dqm_store_test):
+    # Reads of all groups and runs are fanned out, results keep the config group order
+    response = fast_api_client_test.post(config_test.api_v1_prefix + "/get-hists", json={"runs": [100000, 100002]})
+    assert response.status_code == 200
+    groups_data = response.json()["groups_data"]
+    assert [g["group_name"] for g in groups_data] == [g.group_name for g in config_test.plots.groups]
+    assert all(len(g["plots"]) == len(c.plots) for g, c in zip(groups_data, config_test.plots.groups))
+
+
+def test_get_hists_without_runs(fast_api_client_test, config_test, dqm_store_test):
+    # Groups without runs or eras give the recent run of the requested groups
+    url = config_test.api_v1_prefix
+    group_conf = config_test.plots.groups[0]
+    response = fast_api_client_test.post(url + "/get-hists", json={"groups": [group_conf.group_name]})
+    assert response.status_code == 200
+    [group] = response.json()["groups_data"]
+    assert group["group_name"] == group_conf.group_name
+    assert group["plots"] and all(plot["run"] == dqm_store_test.get_max_run() for plot in group["plots"])
+
+    # A group which does not have the runs has an empty run map
+    [(_, run_era_map)] = histograms.get_groups_run_era_maps(groups=[group_conf.group_name], runs=[1])
+    assert run_era_map == {}
+
+
+def test_get_hists_cache(fast_api_client_test, config_test, dqm_store_test):
+    url = config_test.api_v1_prefix
+    req = {"groups": [config_test.plots.groups[0].group_name], "runs": [100200]}
+    stats = fast_api_client_test.get(url + "/get-cache-stats").json()
+
+    first = fast_api_client_test.post(url + "/get-hists", json=req).json()
+    second = fast_api_client_test.post(url + "/get-hists", json=req).json()
+    assert first == second
+
+    new_stats = fast_api_client_test.get(url + "/get-cache-stats").json()
+    assert new_stats["misses"] == stats["misses"] + 1
+    assert new_stats["hits"] == stats["hits"] + 1
+    assert new_stats["entries"] == stats["entries"] + 1
+
+
+def test_get_hists_overlay_cache(fast_api_client_test, config_test, dqm_store_test):
+    url = config_test.api_v1_prefix
+    group_conf = config_test.plots.groups[0]
+    req = {"groups": [group_conf.group_name], "runs": [100300, 100301, 100302]}
+
+    first = fast_api_client_test.post(url + "/get-hists", json=req).json()
+    stats = fast_api_client_test.get(url + "/get-cache-stats").json()
+    second = fast_api_client_test.post(url + "/get-hists", json=req).json()
+    assert first == second
+
+    # Only the overlays are served from the cache, runs are not read again
+    new_stats = fast_api_client_test.get(url + "/get-cache-stats").json()
+    assert new_stats["hits"] == stats["hits"] + len(group_conf.plots)
+    assert new_stats["misses"] == stats["misses"]
+
+
+def test_get_hists_client_overlay(fast_api_client_test, config_test, dqm_store_test):
+    url = config_test.api_v1_prefix
+    group_conf = config_test.plots.groups[0]
+    runs = [100000, 100001, 100100]
+    req = {"groups": [group_conf.group_name], "runs": runs, "overlay_mode": "client"}
+    response = fast_api_client_test.post(url + "/get-hists", json=req)
+    assert response.status_code == 200
+    plots = response.json()["groups_data"][0]["plots"]
+    assert len(plots) == len(group_conf.plots)
+
+    run_era_map = {run: dqm_store_test.get_meta_by_group_and_run(group_conf.eos_directory, run).era for run in runs}
+    styles = get_overlay_styles(runs=sorted(runs, reverse=True), run_era_map=run_era_map)
+    for plot in plots:
+        assert plot["type"] == "THStack" and plot["data"] is None
+        assert [item["run"] for item in plot["overlay"]] == sorted(runs, reverse=True)
+        assert [(i["line_style"], i["line_color"], i["line_width"]) for i in plot["overlay"]] == styles
+        assert all(item["data"] and str(item["run"]) in item["legend"] for item in plot["overlay"])
+
+
+def test_get_hists_drops_failed_run(fast_api_client_test, config_test, dqm_store_test, monkeypatch):
+    # A run read which fails with any error drops only that run, not the response
+    group_conf = config_test.plots.groups[0]
+    submit_read_group_plots_of_one_run = histograms.submit_read_group_plots_of_one_run
+
+    def read_or_fail(group_config, dqm_meta, hist_format="json"):
+        if dqm_meta.run == 100001:
+            future = Future()
+            future.set_exception(KeyError("broken cache entry"))
+            return future
+        return submit_read_group_plots_of_one_run(group_config, dqm_meta, hist_format=hist_format)
+
+    monkeypatch.setattr(histograms, "submit_read_group_plots_of_one_run", read_or_fail)
+    req = {"groups": [group_conf.group_name], "runs": [100000, 100001], "overlay_mode": "client"}
+    response = fast_api_client_test.post(config_test.api_v1_prefix + "/get-hists", json=req)
+    assert response.status_code == 200
+    group = response.json()["groups_data"][0]
+    assert group["partial"] and group["plots"]
+    assert all([item["run"] for item in plot["overlay"]] == [100000] for plot in group["plots"])
+    # Partial response is not cached by the clients
+    assert "etag" not in response.headers and response.headers["cache-control"] == "no-store"
+
+
+def test_get_hists_compact(fast_api_client_test, config_test, dqm_store_test):
+
+    url = config_test.api_v1_prefix
+    group_conf = config_test.plots.groups[0]
+    req = {"groups": [group_conf.group_name], "runs": [100001]}
+    json_plots = fast_api_client_test.post(url + "/get-hists", json=req).json()["groups_data"][0]["plots"]
+    req["hist_format"] = "compact"
+    compact_plots = fast_api_client_test.post(url + "/get-hists", json=req).json()["groups_data"][0]["plots"]
+
+    assert len(compact_plots) == len(json_plots) == len(group_conf.plots)
+    for json_plot, compact_plot in zip(json_plots, compact_plots):
+        assert json_plot["data_format"] == "json" and compact_plot["data_format"] == "compact"
+        assert len(compact_plot["data"]) < len(json_plot["data"])
+        hist_json, compact = json.loads(json_plot["data"]), json.loads(compact_plot["data"])
+        dtype = "<" + compact["dtypes"]["contents"]
+        contents = np.frombuffer(zlib.decompress(base64.b64decode(compact["contents"])), dtype=dtype)
+        assert compact["class"] == hist_json["_typename"]
+        assert compact["entries"] == hist_json["fEntries"]
+        assert len(contents) == compact["xaxis"]["nbins"] + 2
+        assert contents.sum() == compact["entries"]
+
+
+def test_get_hists_stream(fast_api_client_test, config_test, dqm_store_test):
+    url = config_test.api_v1_prefix
+    req = {"runs": [100000, 100001]}
+    groups = fast_api_client_test.post(url + "/get-hists", json=req).json()["groups_data"]
+
+    for accept_encoding in ("gzip", "identity"):
+        response = fast_api_client_test.post(
+            url + "/get-hists-stream", json=req, headers={"Accept-Encoding": accept_encoding}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert response.headers.get("content-encoding") == (accept_encoding if accept_encoding == "gzip" else None)
+        streamed_groups = [json.loads(line) for line in response.text.splitlines()]
+        # Groups are streamed in the order they are ready
+        key = lambda group: group["group_name"]
+        assert sorted(streamed_groups, key=key) == sorted(groups, key=key)
+
+
+def test_get_hists_stream_failed_group(fast_api_client_test, config_test, dqm_store_test, monkeypatch):
+    # A group which fails with any error is streamed without plots, the other groups are still streamed
+    failed_group = config_test.plots.groups[0].group_name
+    get_client_overlays = histograms.get_client_overlays
+
+    def overlay_or_fail(group_conf, runs_plots, run_era_map):
+        if group_conf.group_name == failed_group:
+            raise RuntimeError("broken overlay")
+        return get_client_overlays(group_conf, runs_plots=runs_plots, run_era_map=run_era_map)
+
+    monkeypatch.setattr(histograms, "get_client_overlays", overlay_or_fail)
+    req = {"runs": [100000, 100001], "overlay_mode": "client"}
+    response = fast_api_client_test.post(config_test.api_v1_prefix + "/get-hists-stream", json=req)
+    assert response.status_code == 200
+    streamed_groups = {group["group_name"]: group for group in map(json.loads, response.text.splitlines())}
+    assert sorted(streamed_groups) == sorted(g.group_name for g in config_test.plots.groups)
+    assert streamed_groups.pop(failed_group)["plots"] == [] and not any(g["partial"] for g in streamed_groups.values())
+    assert all(group["plots"] for group in streamed_groups.values())
+
+
+def test_etag(fast_api_client_test, config_test, dqm_store_test):
+    url = config_test.api_v1_prefix
+    group_conf = config_test.plots.groups[0]
+    params = {"groups": [group_conf.group_name], "runs": [100002]}
+
+    first = fast_api_client_test.get(url + "/get-hists", params=params)
+    # Weak ETag: same for gzip compressed and identity bodies
+    assert first.status_code == 200 and first.headers["etag"].startswith('W/"')
+    assert first.headers["cache-control"] == f"public, max-age={config_test.http_cache.max_age_secs}"
+    # Plot ids do not depend on the process
+    assert first.json()["groups_data"][0]["plots"][0]["id"] == utils.get_plot_id(group_conf.plots[0].name)
+
+    # Same ETag for the POST body and 304 without reading ROOT files
+    stats = fast_api_client_test.get(url + "/get-cache-stats").json()
+    post = fast_api_client_test.post(url + "/get-hists", json=params, headers={"If-None-Match": first.headers["etag"]})
+    assert post.status_code == 304 and post.headers["etag"] == first.headers["etag"]
+    assert fast_api_client_test.get(url + "/get-cache-stats").json()["misses"] == stats["misses"]
+    # If-None-Match is compared weakly
+    strong_etag = first.headers["etag"].removeprefix("W/")
+    get = fast_api_client_test.get(url + "/get-hists", params=params, headers={"If-None-Match": strong_etag})
+    assert get.status_code == 304
+
+    # Rewritten ROOT file changes the ETag, its mtime is restored for the other tests
+    root_file = dqm_store_test.get_meta_by_group_and_run(group_conf.eos_directory, 100002).root_file
+    st = os.stat(root_file)
+    try:
+        os.utime(root_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        second = fast_api_client_test.get(
+            url + "/get-hists", params=params, headers={"If-None-Match": first.headers["etag"]}
+        )
+        assert second.status_code == 200 and second.headers["etag"] != first.headers["etag"]
+    finally:
+        os.utime(root_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    eras = fast_api_client_test.get(url + "/get-eras")
+    not_modified = fast_api_client_test.get(url + "/get-eras", headers={"If-None-Match": eras.headers["etag"]})
+    assert not_modified.status_code == 304 and not not_modified.content
+
+
+def test_get_plot_lazy(fast_api_client_test, config_test, dqm_store_test):
+    url = config_test.api_v1_prefix
+    group_conf = config_test.plots.groups[0]
+    params = {"groups": [group_conf.group_name], "runs": [100400, 100401]}
+
+    descriptors = fast_api_client_test.get(url + "/get-plot-descriptors", params=params).json()["groups_data"]
+    assert [p["conf_name"] for p in descriptors[0]["plots"]] == [p.name for p in group_conf.plots]
+    assert all(p["data"] is None and p["type"] == "THStack" for p in descriptors[0]["plots"])
+
+    descriptor = descriptors[0]["plots"][-1]
+    plot_params = {"group": group_conf.group_name, "conf_name": descriptor["conf_name"], "runs": params["runs"]}
+    stats = fast_api_client_test.get(url + "/get-cache-stats").json()
+    plot = fast_api_client_test.get(url + "/get-plot", params={**plot_params, "overlay_mode": "client"}).json()
+    assert plot["id"] == descriptor["id"] and plot["conf_name"] == descriptor["conf_name"]
+    assert [item["run"] for item in plot["overlay"]] == [100401, 100400]
+
+    # Cached on its own: one entry per run with only this plot
+    new_stats = fast_api_client_test.get(url + "/get-cache-stats").json()
+    assert new_stats["entries"] == stats["entries"] + 2
+    fast_api_client_test.get(url + "/get-plot", params={**plot_params, "overlay_mode": "client"})
+    assert fast_api_client_test.get(url + "/get-cache-stats").json()["hits"] == new_stats["hits"] + 2
+
+    server_plot = fast_api_client_test.get(url + "/get-plot", params=plot_params).json()
+    assert server_plot["type"] == "THStack" and server_plot["data"]
+    missing = fast_api_client_test.get(url + "/get-plot", params={**plot_params, "conf_name": "not/in/config"})
+    assert missing.status_code == 404
@@ -0,0 +1,64 @@
+/* Decoder of the compact histogram format, see backend/client/pyroot.py : util_hist_to_compact_json */
+import { create } from "jsroot";
+
+/* base64 to bytes */
+function decodeBase64(b64) {
+  return Uint8Array.from(atob(b64), (c) => c.charCodeAt(0));
+}
+
+/* base64 of zlib compressed little endian float32("f4") or float64("f8") array to an Array */
+async function inflateArray(b64, dtype) {
+  const stream = new Blob([decodeBase64(b64)]).stream().pipeThrough(new DecompressionStream("deflate"));
+  const buffer = await new Response(stream).arrayBuffer();
+  return Array.from(dtype === "f8" ? new Float64Array(buffer) : new Float32Array(buffer));
+}
+
+/* Sets TAxis fields: fixed bins, variable bin edges(float64) and bin labels */
+function fillAxis(axis, compactAxis) {
+  Object.assign(axis, {
+    fNbins: compactAxis.nbins,
+    fXmin: compactAxis.min,
+    fXmax: compactAxis.max,
+    fTitle: compactAxis.title,
+  });
+  if (compactAxis.edges) {
+    axis.fXbins = Array.from(new Float64Array(decodeBase64(compactAxis.edges).buffer));
+  }
+  if (compactAxis.labels) {
+    axis.fLabels = create("THashList");
+    for (const [bin, label] of Object.entries(compactAxis.labels)) {
+      const objString = create("TObjString");
+      Object.assign(objString, { fString: label, fUniqueID: Number(bin) });
+      axis.fLabels.Add(objString);
+    }
+  }
+}
+
+/* Creates JSROOT histogram object from compact JSON string */
+export async function parseCompactHist(data) {
+  const compact = JSON.parse(data);
+  const hist = create(compact.class);
+  Object.assign(hist, {
+    fName: compact.name,
+    fTitle: compact.title,
+    fEntries: compact.entries,
+    fMinimum: compact.minimum,
+    fMaximum: compact.maximum,
+    ...compact.stats,
+  });
+  fillAxis(hist.fXaxis, compact.xaxis);
+  if (compact.yaxis) {
+    fillAxis(hist.fYaxis, compact.yaxis);
+  }
+  const dtypes = compact.dtypes;
+  hist.fArray = await inflateArray(compact.contents, dtypes.contents);
+  hist.fNcells = hist.fArray.length;
+  /* Empty fSumw2 means errors are sqrt(content) */
+  hist.fSumw2 = compact.sumw2 ? await inflateArray(compact.sumw2, dtypes.sumw2) : [];
+  if (compact.bin_entries) {
+    hist.fBinEntries = await inflateArray(compact.bin_entries, dtypes.bin_entries);
+    hist.fBinSumw2 = compact.bin_sumw2 ? await inflateArray(compact.bin_sumw2, dtypes.bin_sumw2) : [];
+    Object.assign(hist, { fErrorMode: compact.error_mode, fYmin: compact.ymin, fYmax: compact.ymax });
+  }
+  return hist;
+}
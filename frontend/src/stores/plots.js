@@ -52,21 +52,46 @@ export const usePlotsStore = defineStore("plots", {
         groups: argGroups,
         runs: argRuns,
         max_era_run_size: argEraRunSizeLimit,
+        /* Runs' histograms are overlaid by JSROOT in the browser */
+        overlay_mode: "client",
+        /* Axes and bin arrays instead of full TBufferJSON objects, see src/histCompact.js */
+        hist_format: "compact",
       };
 
       // console.log("[DEBUG] Request obj:" + JSON.stringify(request));
       try {
         this.hasTriggeredToUpdate = false;
-        const r = await axios.post("/v1/get-hists", request);
-        const data = await r.data;
-        this.hasUpdated = false;
-
-        /* Nested obj reactivity is not working, so we use v-if="hasUpdated" */
-
-        /* r.data: backend/api_v1/models.py : ResponseMain */
-        this.resp_groups_data = await data.groups_data;
+        /* Streamed NDJSON: each line is a group(backend/api_v1/models.py : ResponseGroup), drawn as soon as it comes */
+        const r = await fetch(axios.defaults.baseURL + "/v1/get-hists-stream", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify(request),
+        });
+        if (!r.ok) {
+          throw new Error((await r.json()).detail);
+        }
+        const reader = r.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = "";
+        let groups = [];
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) {
+            break;
+          }
+          buffer += value;
+          const lines = buffer.split("\n");
+          buffer = lines.pop();
+          if (lines.length === 0) {
+            continue;
+          }
+          /* Nested obj reactivity is not working, so we use v-if="hasUpdated" */
+          this.hasUpdated = false;
+          groups = groups.concat(lines.map((line) => JSON.parse(line)));
+          this.resp_groups_data = groups;
+          this.hasTriggeredToUpdate = true;
+          this.hasUpdated = true;
+        }
         this.hasTriggeredToUpdate = true;
-        this.hasUpdated = true;
         // TODO: use only on debug
         // console.log("[DEBUG] Response: " + JSON.stringify(this.groups_data));
       } catch (e) {